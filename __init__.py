@@ -3,19 +3,30 @@ from __future__ import division
 import time
 import json
 import datetime
-import math
+import uuid
+import hmac
 
-from flask import Blueprint, request, Flask, render_template, url_for, redirect, flash
+from flask import Blueprint, request, Flask, Response, render_template, url_for, redirect, flash
+from sqlalchemy import event
 
-from CTFd.models import db, Solves
+from CTFd.models import db
 from CTFd.plugins import register_plugin_assets_directory
+from CTFd.plugins.migrations import upgrade
 from CTFd.plugins.challenges import CHALLENGE_CLASSES, BaseChallenge
 from CTFd.utils.decorators import authed_only, admins_only, during_ctf_time_only, ratelimit, require_verified_emails
-from CTFd.utils.user import get_current_user
-from CTFd.utils.modes import get_model
+from CTFd.utils.user import get_current_user, get_current_user_attrs, is_admin
 
-from .models import ContainerChallengeModel, ContainerInfoModel, ContainerSettingsModel
+from .models import ContainerChallengeModel, ContainerInfoModel, ContainerSettingsModel, ContainerJobModel, \
+    ContainerBulkJobModel, ContainerReclaimModel, ContainerReplicaModel, ContainerAssignmentModel
 from .container_manager import ContainerManager, ContainerException
+from .provisioning import ProvisioningQueue, job_to_dict
+from .admission import AdmissionControl
+from .metrics import REQUESTS, PROVISION_SECONDS, render_metrics, response_outcome
+from .bulk import BulkOperations, bulk_job_to_dict
+from .settings import ContainerSettings, SettingsWatcher, save_settings
+from .scoring import decayed_value, recount_solves, record_solve
+from .reservation import reserve_container, fulfil_reservation, delete_container_row
+from .events import EventPublisher, publish_event, READY, RENEWED, KILLED
 
 
 class ContainerChallenge(BaseChallenge):
@@ -51,6 +62,9 @@ class ContainerChallenge(BaseChallenge):
             "image": challenge.image,
             "port": challenge.port,
             "command": challenge.command,
+            "warm_pool_size": challenge.warm_pool_size,
+            "reset_mode": challenge.reset_mode,
+            "shared_replicas": challenge.shared_replicas,
             "initial": challenge.initial,
             "decay": challenge.decay,
             "minimum": challenge.minimum,
@@ -71,37 +85,12 @@ class ContainerChallenge(BaseChallenge):
 
     @classmethod
     def calculate_value(cls, challenge):
-        Model = get_model()
-
-        solve_count = (
-            Solves.query.join(Model, Solves.account_id == Model.id)
-            .filter(
-                Solves.challenge_id == challenge.id,
-                Model.hidden == False,
-                Model.banned == False,
-            )
-            .count()
-        )
-
-        # If the solve count is 0 we shouldn't manipulate the solve count to
-        # let the math update back to normal
-        if solve_count != 0:
-            # We subtract -1 to allow the first solver to get max point value
-            solve_count -= 1
-
-        # It is important that this calculation takes into account floats.
-        # Hence this file uses from __future__ import division
-        value = (
-            ((challenge.minimum - challenge.initial) / (challenge.decay ** 2))
-            * (solve_count ** 2)
-        ) + challenge.initial
-
-        value = math.ceil(value)
-
-        if value < challenge.minimum:
-            value = challenge.minimum
-
-        challenge.value = value
+        # Solves are only scanned the first time; after that every solve updates the counter in place
+        if challenge.solve_count is None:
+            recount_solves([challenge.id])
+            return challenge
+
+        challenge.value = decayed_value(challenge, challenge.solve_count)
         db.session.commit()
         return challenge
 
@@ -120,6 +109,8 @@ class ContainerChallenge(BaseChallenge):
             # We need to set these to floats so that the next operations don't operate on strings
             if attr in ("initial", "minimum", "decay"):
                 value = float(value)
+            if attr in ("warm_pool_size", "shared_replicas"):
+                value = int(value or 0)
             setattr(challenge, attr, value)
 
         return ContainerChallenge.calculate_value(challenge)
@@ -128,25 +119,44 @@ class ContainerChallenge(BaseChallenge):
     def solve(cls, user, team, challenge, request):
         super().solve(user, team, challenge, request)
 
+        # The team is the account in teams mode, the user in users mode
+        record_solve(challenge, team if team is not None else user)
         ContainerChallenge.calculate_value(challenge)
 
 
-def settings_to_dict(settings):
-    return {
-        setting.key: setting.value for setting in settings
-    }
-
-
 def load(app: Flask):
+    started = time.perf_counter()
+    # create_all only creates missing tables. Columns and indexes added to existing tables come from the migrations.
     app.db.create_all()
+    upgrade(plugin_name="containers")
     CHALLENGE_CLASSES["container"] = ContainerChallenge
     register_plugin_assets_directory(
         app, base_path="/plugins/containers/assets/"
     )
 
-    container_settings = settings_to_dict(ContainerSettingsModel.query.all())
+    # Identifies containers started by this CTFd instance when several share a Docker host
+    if ContainerSettingsModel.query.filter_by(key="instance_id").first() is None:
+        db.session.add(ContainerSettingsModel(
+            key="instance_id", value=uuid.uuid4().hex[:12]))
+        db.session.commit()
+
+    container_settings = ContainerSettings.load()
+    # Returns without waiting for Docker, which is connected in the background
     container_manager = ContainerManager(container_settings, app)
 
+    # Reload the settings when an admin saves them through another worker
+    settings_watcher = SettingsWatcher(container_manager, app)
+    settings_watcher.start()
+
+    # Pull a challenge's image onto every host as soon as the challenge is saved
+    def prefetch_challenge_image(mapper, connection, challenge):
+        container_manager.prefetch_image(challenge.image)
+
+    event.listen(ContainerChallengeModel, "after_insert",
+                 prefetch_challenge_image)
+    event.listen(ContainerChallengeModel, "after_update",
+                 prefetch_challenge_image)
+
     containers_bp = Blueprint(
         'containers', __name__, template_folder='templates', static_folder='assets', url_prefix='/containers')
 
@@ -156,20 +166,50 @@ def load(app: Flask):
         return datetime.datetime.fromtimestamp(unix_seconds, tz=datetime.datetime.now(
             datetime.timezone.utc).astimezone().tzinfo).isoformat()
 
-    def kill_container(container_id):
+    def kill_container(container_id, reason: "str|None" = "Your container was stopped."):
         container: ContainerInfoModel = ContainerInfoModel.query.filter_by(
             container_id=container_id).first()
+        if container is None:
+            return {"error": "No container found"}
+
+        # Rows without a host were created before multiple hosts and live on the first one
+        host = container.host or next(iter(container_manager.hosts), None)
 
         try:
-            container_manager.kill_container(container_id)
+            container_manager.kill_container(container_id, host)
         except ContainerException:
             return {"error": "Docker is not initialized. Please check your settings."}
 
+        if container.standby_id is not None:
+            try:
+                container_manager.remove_container(
+                    container.standby_id, host)
+            except Exception as err:
+                # The orphan reconciler removes it later
+                print("[Container] Could not remove standby container:", err)
+
         db.session.delete(container)
+        # Resets replace the container right away, so they pass no reason and the team only hears about the new one
+        if reason is not None:
+            publish_event(container.team_id,
+                          container.challenge_id, KILLED, reason=reason)
 
         db.session.commit()
+        container_manager.release_ports([container_id])
         return {"success": "Container killed"}
 
+    def connecting_response():
+        # Requests made before the hosts have connected get a clear answer instead of a failed job
+        if container_manager.connection_status() == "connecting":
+            return {"error": "Docker is still connecting, please try again shortly.", "status": "connecting"}, 503
+        return None
+
+    def reclaim_reason(chal_id, team_id) -> "str|None":
+        # Set when the idle monitor stopped this team's container, so the team learns why it disappeared
+        reclaim: ContainerReclaimModel = ContainerReclaimModel.query.filter_by(
+            challenge_id=chal_id, team_id=team_id).first()
+        return reclaim.reason if reclaim is not None else None
+
     def renew_container(chal_id, team_id):
         # Get the requested challenge
         challenge = ContainerChallenge.challenge_model.query.filter_by(
@@ -179,16 +219,26 @@ def load(app: Flask):
         if challenge is None:
             return {"error": "Challenge not found"}, 400
 
+        if challenge.shared_replicas:
+            expires = container_manager.renew_shared(challenge.id, team_id)
+            if expires is None:
+                return {"error": "Container not found, try requesting it again."}
+            publish_event(team_id, challenge.id, RENEWED, expires=expires)
+            db.session.commit()
+            return {"success": "Container renewed", "expires": expires}
+
         running_containers = ContainerInfoModel.query.filter_by(
             challenge_id=challenge.id, team_id=team_id)
         running_container = running_containers.first()
 
         if running_container is None:
-            return {"error": "Container not found, try resetting the container."}
+            return {"error": reclaim_reason(challenge.id, team_id) or "Container not found, try resetting the container."}
 
         try:
             running_container.expires = int(
                 time.time() + container_manager.expiration_seconds)
+            publish_event(team_id, challenge.id, RENEWED,
+                          expires=running_container.expires)
             db.session.commit()
         except ContainerException:
             return {"error": "Database error occurred, please try again."}
@@ -196,78 +246,151 @@ def load(app: Flask):
         return {"success": "Container renewed", "expires": running_container.expires}
 
     def create_container(chal_id, team_id):
+        """
+        Start a container for the team, or return the one already running.
+
+        Runs on a provisioning worker, so errors are raised as ContainerException rather than returned as responses.
+        """
         # Get the requested challenge
         challenge = ContainerChallenge.challenge_model.query.filter_by(
             id=chal_id).first()
 
         # Make sure the challenge exists and is a container challenge
         if challenge is None:
-            return {"error": "Challenge not found"}, 400
+            raise ContainerException("Challenge not found")
 
-        # Check for any existing containers for the team
-        running_containers = ContainerInfoModel.query.filter_by(
-            challenge_id=challenge.id, team_id=team_id)
-        running_container = running_containers.first()
+        # Stateless challenges hand every team one of a few shared containers
+        if challenge.shared_replicas:
+            return container_manager.assign_shared(challenge, team_id, start=True)
 
-        # If a container is already running for the team, return it
-        if running_container:
-            # Check if Docker says the container is still running before returning it
-            try:
-                if container_manager.is_container_running(
-                        running_container.container_id):
-                    return json.dumps({
-                        "status": "already_running",
-                        "hostname": container_manager.settings.get("docker_hostname", ""),
-                        "port": running_container.port,
-                        "expires": running_container.expires
-                    })
-                else:
-                    # Container is not running, it must have died or been killed,
-                    # remove it from the database and create a new one
-                    running_containers.delete()
-                    db.session.commit()
-            except ContainerException as err:
-                return {"error": str(err)}, 500
+        # Reserve the challenge and team before starting anything, so concurrent requests from any worker end up
+        # with the same container
+        running_container, reservation_id = reserve_container(
+            container_manager, challenge.id, team_id)
 
-        # TODO: Should insert before creating container, then update. That would avoid a TOCTOU issue
+        # If a container is already running for the team, return it
+        if running_container is not None:
+            return {
+                "status": "already_running",
+                "hostname": container_manager.get_hostname(running_container.host),
+                "port": running_container.port,
+                "expires": running_container.expires
+            }
 
-        # Run a new Docker container
         try:
-            created_container = container_manager.create_container(
-                challenge.image, challenge.port, challenge.command, challenge.volumes)
-        except ContainerException as err:
-            return {"error": str(err)}
+            # Hand out a pre-started container if the challenge has a warm pool. The claim is committed by
+            # fulfil_reservation, in the same transaction that gives the container to the team.
+            warm_container = container_manager.claim_warm_container(challenge)
+
+            if warm_container is not None:
+                host, container_id, port = warm_container
+            else:
+                # Run a new Docker container on the least-loaded host; the host port comes from the configured
+                # range, or is looked up if Docker picked it
+                host, container_id, port = container_manager.create_container(
+                    challenge.image, challenge.port, challenge.command, challenge.volumes,
+                    challenge_id=challenge.id, team_id=team_id)
+
+                # Port may be blank if the container failed to start
+                if port is None:
+                    container_manager.kill_container(container_id, host)
+                    raise ContainerException("Could not get port")
+        except Exception:
+            db.session.rollback()
+            delete_container_row(reservation_id)
+            raise
+
+        expires = fulfil_reservation(
+            container_manager, reservation_id, challenge.id, team_id, container_id, host, port)
+        if expires is None:
+            # The reservation was killed while the container was starting, so don't leave the container behind
+            container_manager.kill_container(container_id, host)
+            container_manager.release_ports([container_id])
+            raise ContainerException(
+                "The container was stopped while it was starting.")
+
+        container_manager.notify_expiry(expires)
+
+        return {
+            "status": "created",
+            "hostname": container_manager.get_hostname(host),
+            "port": port,
+            "expires": expires
+        }
+
+    def provision_container(chal_id, team_id, reset):
+        if reset:
+            running_container: ContainerInfoModel = ContainerInfoModel.query.filter_by(
+                challenge_id=chal_id, team_id=team_id).first()
+
+            if running_container:
+                kill_container(running_container.container_id, reason=None)
 
-        # Fetch the random port Docker assigned
-        port = container_manager.get_container_port(created_container.id)
-
-        # Port may be blank if the container failed to start
-        if port is None:
-            return json.dumps({
-                "status": "error",
-                "error": "Could not get port"
-            })
-
-        expires = int(time.time() + container_manager.expiration_seconds)
-
-        # Insert the new container into the database
-        new_container = ContainerInfoModel(
-            container_id=created_container.id,
-            challenge_id=challenge.id,
-            team_id=team_id,
-            port=port,
-            timestamp=int(time.time()),
-            expires=expires
-        )
-        db.session.add(new_container)
+        return create_container(chal_id, team_id)
+
+    def reset_in_place(challenge, running_container: ContainerInfoModel) -> dict:
+        """
+        Restart or recreate the team's container without giving up its row or port, for challenges with a fast reset
+        mode. Raises ContainerException on failure.
+        """
+        if running_container.port is None:
+            raise ContainerException("The container's port is unknown")
+
+        container_id = None
+        standby_id = running_container.standby_id
+        if challenge.reset_mode == "restart":
+            port = container_manager.restart_container(
+                running_container.container_id, running_container.host)
+            if port is not None:
+                container_id = running_container.container_id
+            else:
+                # Without the port the connection info could be wrong, so replace the container on the old port
+                print("[Container Reset] Could not read the port after a restart, recreating the container")
+
+        if container_id is None:
+            container_id = container_manager.recreate_container(
+                running_container.container_id, running_container.host, running_container.port,
+                challenge.image, challenge.port, challenge.command, challenge.volumes,
+                challenge_id=challenge.id, team_id=running_container.team_id, standby_id=standby_id)
+            port = running_container.port
+            # The standby was started or removed, and the warm pool makes the next one
+            standby_id = None
+
+        now = int(time.time())
+        expires = int(now + container_manager.expiration_seconds)
+        port = int(port)
+
+        # The primary key changes when the container was recreated, so update the row by its old id
+        ContainerInfoModel.query.filter_by(container_id=running_container.container_id).update({
+            "container_id": container_id,
+            "port": port,
+            "timestamp": now,
+            "expires": expires,
+            "last_active": None,
+            "standby_id": standby_id,
+        }, synchronize_session=False)
+        hostname = container_manager.get_hostname(running_container.host)
+        publish_event(running_container.team_id, challenge.id, READY,
+                      hostname=hostname, port=port, expires=expires)
         db.session.commit()
 
-        return json.dumps({
-            "status": "created",
-            "hostname": container_manager.settings.get("docker_hostname", ""),
+        container_manager.notify_expiry(expires)
+
+        return {
+            "status": "ready",
+            "hostname": hostname,
             "port": port,
             "expires": expires
-        })
+        }
+
+    # Requests over the instance limits wait in a queue shared by every worker
+    provisioning_queue = ProvisioningQueue(
+        app, provision_container, AdmissionControl(container_manager))
+    provisioning_queue.start()
+    bulk_operations = BulkOperations(container_manager, app)
+    # Pushes container events to the players connected to this worker
+    event_publisher = EventPublisher(app)
+    event_publisher.start()
 
     @containers_bp.route('/api/request', methods=['POST'])
     @authed_only
@@ -289,10 +412,34 @@ def load(app: Flask):
         if user.team is None:
             return {"error": "User not a member of a team"}, 400
 
+        connecting = connecting_response()
+        if connecting is not None:
+            return connecting
+
+        # A shared challenge answers right away unless its first replica still has to be started
+        challenge = ContainerChallenge.challenge_model.query.filter_by(
+            id=request.json.get("chal_id")).first()
+        if challenge is not None and challenge.shared_replicas:
+            try:
+                response = container_manager.assign_shared(
+                    challenge, user.team.id)
+            except ContainerException as err:
+                REQUESTS.inc(action="request", outcome="failed")
+                return {"error": str(err)}, 503
+            if response is not None:
+                REQUESTS.inc(action="request", outcome="shared")
+                publish_event(user.team.id, challenge.id, READY, hostname=response["hostname"],
+                              port=response["port"], expires=response["expires"])
+                db.session.commit()
+                return response
+
         try:
-            return create_container(request.json.get("chal_id"), user.team.id)
+            job = provisioning_queue.submit(
+                request.json.get("chal_id"), user.team.id)
         except ContainerException as err:
-            return {"error": str(err)}, 500
+            return {"error": str(err)}, 503
+
+        return job_to_dict(job, provisioning_queue.queue_position(job)), 202
 
     @containers_bp.route('/api/renew', methods=['POST'])
     @authed_only
@@ -315,10 +462,15 @@ def load(app: Flask):
             return {"error": "User not a member of a team"}, 400
 
         try:
-            return renew_container(request.json.get("chal_id"), user.team.id)
+            response = renew_container(
+                request.json.get("chal_id"), user.team.id)
         except ContainerException as err:
+            REQUESTS.inc(action="renew", outcome="failed")
             return {"error": str(err)}, 500
 
+        REQUESTS.inc(action="renew", outcome=response_outcome(response))
+        return response
+
     @containers_bp.route('/api/reset', methods=['POST'])
     @authed_only
     @during_ctf_time_only
@@ -339,13 +491,133 @@ def load(app: Flask):
         if user.team is None:
             return {"error": "User not a member of a team"}, 400
 
-        running_container: ContainerInfoModel = ContainerInfoModel.query.filter_by(
-            challenge_id=request.json.get("chal_id"), team_id=user.team.id).first()
+        challenge = ContainerChallenge.challenge_model.query.filter_by(
+            id=request.json.get("chal_id")).first()
+        if challenge is not None and challenge.shared_replicas:
+            return {"error": "This challenge's container is shared by every team and can't be reset."}, 400
+
+        connecting = connecting_response()
+        if connecting is not None:
+            return connecting
+
+        # Fast reset modes reuse the running container's row and port and skip the queue, since the team's instance
+        # already counts against the limits
+        if challenge is not None and challenge.reset_mode in ("restart", "recreate"):
+            running_container: ContainerInfoModel = ContainerInfoModel.query.filter_by(
+                challenge_id=challenge.id, team_id=user.team.id).first()
+
+            # A pending row is still being created by another request, which the queue will wait for
+            if running_container is not None and not running_container.pending:
+                start = time.time()
+                try:
+                    response = reset_in_place(challenge, running_container)
+                except ContainerException as err:
+                    # Fall back to a full reset, which replaces whatever is left of the container
+                    db.session.rollback()
+                    print("[Container Reset] In-place reset failed, starting a new container:", err)
+                else:
+                    REQUESTS.inc(action="reset", outcome="ready")
+                    PROVISION_SECONDS.observe(
+                        time.time() - start, action="reset", outcome="ready")
+                    return response
 
-        if running_container:
-            kill_container(running_container.container_id)
+        try:
+            job = provisioning_queue.submit(
+                request.json.get("chal_id"), user.team.id, reset=True)
+        except ContainerException as err:
+            return {"error": str(err)}, 503
+
+        return job_to_dict(job, provisioning_queue.queue_position(job)), 202
+
+    @containers_bp.route('/api/events', methods=['GET'])
+    @authed_only
+    def route_events():
+        user = get_current_user()
+
+        if user is None or user.team is None:
+            return {"error": "User not a member of a team"}, 400
+
+        # The stream outlives the request's app context, so it only takes the team id
+        return Response(event_publisher.stream(user.team.id), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
-        return create_container(request.json.get("chal_id"), user.team.id)
+    @containers_bp.route('/api/instances', methods=['GET'])
+    @authed_only
+    def route_list_instances():
+        # Cached user attributes, so an unchanged listing is answered without touching the database
+        user = get_current_user_attrs()
+
+        if user is None or user.team_id is None:
+            return {"error": "User not a member of a team"}, 400
+
+        team_id = user.team_id
+        version = event_publisher.team_version(team_id)
+        now = int(time.time())
+
+        # Shared assignments leave the listing when they expire, which publishes no event. The ETag therefore ends
+        # with the earliest expiry of the team's shared assignments (0 if none), and stops matching once it passes.
+        etag = None
+        for tag in request.if_none_match.as_set():
+            parts = tag.split("-")
+            if len(parts) != 3 or not all(part.isdigit() for part in parts):
+                continue
+            valid_until = int(parts[2])
+            if parts[0] == str(team_id) and parts[1] == str(version) and (valid_until == 0 or now <= valid_until):
+                etag = tag
+                break
+
+        if etag is not None:
+            response = Response(status=304)
+        else:
+            containers: "list[ContainerInfoModel]" = ContainerInfoModel.query.filter_by(
+                team_id=team_id).all()
+            instances = [{
+                "challenge_id": container.challenge_id,
+                "status": "starting" if container.pending else "running",
+                "hostname": container_manager.get_hostname(container.host),
+                "port": container.port,
+                "expires": container.expires,
+            } for container in containers]
+
+            # Containers shared by every team, for challenges in shared-instance mode
+            shared = db.session.query(ContainerAssignmentModel, ContainerReplicaModel).join(
+                ContainerReplicaModel, ContainerReplicaModel.container_id == ContainerAssignmentModel.container_id
+            ).filter(
+                ContainerAssignmentModel.team_id == team_id,
+                ContainerAssignmentModel.expires >= now,
+            ).all()
+            instances.extend({
+                "challenge_id": assignment.challenge_id,
+                "status": "shared",
+                "hostname": container_manager.get_hostname(replica.host),
+                "port": replica.port,
+                "expires": assignment.expires,
+            } for assignment, replica in shared)
+
+            valid_until = min((assignment.expires for assignment, _ in shared), default=0)
+            etag = f"{team_id}-{version}-{valid_until}"
+            response = Response(json.dumps({"instances": instances}), mimetype="application/json")
+
+        # Browsers revalidate every time, which is cheap while nothing changed
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "private, no-cache"
+        return response
+
+    @containers_bp.route('/api/jobs/<job_id>', methods=['GET'])
+    @authed_only
+    def route_job_status(job_id):
+        user = get_current_user()
+
+        if user is None or user.team is None:
+            return {"error": "User not a member of a team"}, 400
+
+        job: ContainerJobModel = ContainerJobModel.query.filter_by(
+            id=job_id, team_id=user.team.id).first()
+
+        if job is None:
+            return {"error": "Job not found"}, 404
+
+        return job_to_dict(job, provisioning_queue.queue_position(job))
 
     @containers_bp.route('/api/stop', methods=['POST'])
     @authed_only
@@ -367,13 +639,34 @@ def load(app: Flask):
         if user.team is None:
             return {"error": "User not a member of a team"}, 400
 
+        challenge = ContainerChallenge.challenge_model.query.filter_by(
+            id=request.json.get("chal_id")).first()
+        if challenge is not None and challenge.shared_replicas:
+            # Other teams keep using the shared container, so only this team's assignment goes away
+            try:
+                released = container_manager.release_shared(
+                    challenge.id, user.team.id)
+            except ContainerException as err:
+                REQUESTS.inc(action="stop", outcome="failed")
+                return {"error": str(err)}, 503
+            REQUESTS.inc(action="stop", outcome="ok" if released else "failed")
+            if released:
+                publish_event(user.team.id, challenge.id, KILLED,
+                              reason="Your container was stopped.")
+                db.session.commit()
+                return {"success": "Container stopped"}
+            return {"error": "No container found"}, 400
+
         running_container: ContainerInfoModel = ContainerInfoModel.query.filter_by(
             challenge_id=request.json.get("chal_id"), team_id=user.team.id).first()
 
         if running_container:
-            return kill_container(running_container.container_id)
+            response = kill_container(running_container.container_id)
+            REQUESTS.inc(action="stop", outcome=response_outcome(response))
+            return response
 
-        return {"error": "No container found"}, 400
+        REQUESTS.inc(action="stop", outcome="failed")
+        return {"error": reclaim_reason(request.json.get("chal_id"), user.team.id) or "No container found"}, 400
 
     @containers_bp.route('/api/kill', methods=['POST'])
     @admins_only
@@ -389,120 +682,114 @@ def load(app: Flask):
     @containers_bp.route('/api/purge', methods=['POST'])
     @admins_only
     def route_purge_containers():
-        containers: "list[ContainerInfoModel]" = ContainerInfoModel.query.all()
-        for container in containers:
-            try:
-                kill_container(container.container_id)
-            except ContainerException:
-                pass
-        return {"success": "Purged all containers"}, 200
+        job = bulk_operations.submit("purge")
+        return {"success": "Purging all containers", **bulk_job_to_dict(job)}, 202
 
-    @containers_bp.route('/api/images', methods=['GET'])
+    @containers_bp.route('/api/bulk', methods=['POST'])
     @admins_only
-    def route_get_images():
+    def route_bulk_operation():
+        if request.json is None:
+            return {"error": "Invalid request"}, 400
+
+        if request.json.get("operation", None) is None:
+            return {"error": "No operation specified"}, 400
+
         try:
-            images = container_manager.get_images()
+            job = bulk_operations.submit(
+                request.json.get("operation"), request.json.get("target"))
         except ContainerException as err:
-            return {"error": str(err)}
+            return {"error": str(err)}, 400
 
-        return {"images": images}
+        return {"success": "Operation started", **bulk_job_to_dict(job)}, 202
 
-    @containers_bp.route('/api/settings/update', methods=['POST'])
+    @containers_bp.route('/api/bulk/<job_id>', methods=['GET'])
     @admins_only
-    def route_update_settings():
-        if request.form.get("docker_base_url") is None:
-            return {"error": "Invalid request"}, 400
+    def route_bulk_status(job_id):
+        job: ContainerBulkJobModel = ContainerBulkJobModel.query.filter_by(
+            id=job_id).first()
 
-        if request.form.get("docker_hostname") is None:
-            return {"error": "Invalid request"}, 400
+        if job is None:
+            return {"error": "Job not found"}, 404
 
-        if request.form.get("container_expiration") is None:
-            return {"error": "Invalid request"}, 400
+        return bulk_job_to_dict(job)
 
-        if request.form.get("container_maxmemory") is None:
-            return {"error": "Invalid request"}, 400
+    @containers_bp.route('/api/solves/recount', methods=['POST'])
+    @admins_only
+    def route_recount_solves():
+        corrected = recount_solves()
+        return {"success": "Recounted solves", "corrected": corrected}
 
-        if request.form.get("container_maxcpu") is None:
-            return {"error": "Invalid request"}, 400
+    @containers_bp.route('/api/reconcile', methods=['POST'])
+    @admins_only
+    def route_reconcile():
+        try:
+            report = container_manager.reconcile()
+        except ContainerException as err:
+            return {"error": str(err)}, 500
+        return {"success": "Reconciled containers", **report}
 
-        docker_base_url = ContainerSettingsModel.query.filter_by(
-            key="docker_base_url").first()
+    @containers_bp.route('/metrics', methods=['GET'])
+    def route_metrics():
+        # Scrapers authenticate with the metrics token, admins with their session
+        token = container_manager.settings.get("metrics_token")
+        authorization = request.headers.get("Authorization", "")
+        if not is_admin() and not (token and hmac.compare_digest(authorization, f"Bearer {token}")):
+            return {"error": "Unauthorized"}, 401
 
-        docker_hostname = ContainerSettingsModel.query.filter_by(
-            key="docker_hostname").first()
+        return Response(render_metrics(container_manager, provisioning_queue.admission_status()),
+                        mimetype="text/plain; version=0.0.4")
 
-        container_expiration = ContainerSettingsModel.query.filter_by(
-            key="container_expiration").first()
+    @containers_bp.route('/api/leader', methods=['GET'])
+    @admins_only
+    def route_leader_status():
+        return {"leader": container_manager.leader_status(), "is_leader": container_manager.is_leader()}
 
-        container_maxmemory = ContainerSettingsModel.query.filter_by(
-            key="container_maxmemory").first()
+    @containers_bp.route('/api/images', methods=['GET'])
+    @admins_only
+    def route_get_images():
+        try:
+            images = container_manager.get_images()
+        except ContainerException as err:
+            return {"error": str(err)}
 
-        container_maxcpu = ContainerSettingsModel.query.filter_by(
-            key="container_maxcpu").first()
+        return {"images": images}
 
-        # Create or update
-        if docker_base_url is None:
-            # Create
-            docker_base_url = ContainerSettingsModel(
-                key="docker_base_url", value=request.form.get("docker_base_url"))
-            db.session.add(docker_base_url)
-        else:
-            # Update
-            docker_base_url.value = request.form.get("docker_base_url")
-
-        # Create or update
-        if docker_hostname is None:
-            # Create
-            docker_hostname = ContainerSettingsModel(
-                key="docker_hostname", value=request.form.get("docker_hostname"))
-            db.session.add(docker_hostname)
-        else:
-            # Update
-            docker_hostname.value = request.form.get("docker_hostname")
-
-        # Create or update
-        if container_expiration is None:
-            # Create
-            container_expiration = ContainerSettingsModel(
-                key="container_expiration", value=request.form.get("container_expiration"))
-            db.session.add(container_expiration)
-        else:
-            # Update
-            container_expiration.value = request.form.get(
-                "container_expiration")
-
-        # Create or update
-        if container_maxmemory is None:
-            # Create
-            container_maxmemory = ContainerSettingsModel(
-                key="container_maxmemory", value=request.form.get("container_maxmemory"))
-            db.session.add(container_maxmemory)
-        else:
-            # Update
-            container_maxmemory.value = request.form.get("container_maxmemory")
-
-        # Create or update
-        if container_maxcpu is None:
-            # Create
-            container_maxcpu = ContainerSettingsModel(
-                key="container_maxcpu", value=request.form.get("container_maxcpu"))
-            db.session.add(container_maxcpu)
-        else:
-            # Update
-            container_maxcpu.value = request.form.get("container_maxcpu")
+    @containers_bp.route('/api/images/prefetch', methods=['POST'])
+    @admins_only
+    def route_prefetch_images():
+        challenges = ContainerChallengeModel.query.all()
+        for challenge in challenges:
+            container_manager.prefetch_image(challenge.image, force=True)
 
-        db.session.commit()
+        return {"success": "Pulling challenge images"}
 
-        container_manager.settings = settings_to_dict(
-            ContainerSettingsModel.query.all())
+    @containers_bp.route('/api/images/status', methods=['GET'])
+    @admins_only
+    def route_image_status():
+        return {"pulls": container_manager.image_status()}
 
-        if container_manager.settings.get("docker_base_url") is not None:
-            try:
-                container_manager.initialize_connection(
-                    container_manager.settings, app)
-            except ContainerException as err:
-                flash(str(err), "error")
-                return redirect(url_for(".route_containers_settings"))
+    @containers_bp.route('/api/settings/update', methods=['POST'])
+    @admins_only
+    def route_update_settings():
+        for key in ContainerSettings.REQUIRED_KEYS:
+            if request.form.get(key) is None:
+                return {"error": "Invalid request"}, 400
+
+        values = {key: request.form.get(key)
+                  for key in ContainerSettings.REQUIRED_KEYS}
+        # These are optional; blank means a single host from docker_base_url and random ports
+        for key in ContainerSettings.OPTIONAL_KEYS:
+            values[key] = request.form.get(key, "")
+
+        # Written with one query for the existing rows and one commit
+        settings = save_settings(values)
+
+        # Other workers pick the new settings up through the settings watcher. This one waits for the hosts to connect,
+        # so connection errors are shown to the admin.
+        err = container_manager.reload_settings(settings, wait=True)
+        if err is not None:
+            flash(str(err), "error")
+            return redirect(url_for(".route_containers_settings"))
 
         return redirect(url_for(".route_containers_dashboard"))
 
@@ -512,20 +799,26 @@ def load(app: Flask):
         running_containers = ContainerInfoModel.query.order_by(
             ContainerInfoModel.timestamp.desc()).all()
 
-        connected = False
+        connection = container_manager.connection_status()
+
+        # Resolve every container's state with one list call per host instead of one call per row
         try:
-            connected = container_manager.is_connected()
+            states = container_manager.get_container_states(
+                [(container.container_id, container.host) for container in running_containers])
         except ContainerException:
-            pass
+            states = {}
 
-        for i, container in enumerate(running_containers):
-            try:
-                running_containers[i].is_running = container_manager.is_container_running(
-                    container.container_id)
-            except ContainerException:
-                running_containers[i].is_running = False
+        for container in running_containers:
+            container.is_running = states.get(
+                container.container_id) == "running"
 
-        return render_template('container_dashboard.html', containers=running_containers, connected=connected)
+        return render_template('container_dashboard.html', containers=running_containers, connection=connection,
+                               hosts=container_manager.host_status(),
+                               image_pulls=container_manager.image_status(),
+                               reaper_lag=container_manager.reaper_lag(),
+                               leader=container_manager.leader_status(),
+                               reconcile=container_manager.reconcile_status(),
+                               admission=provisioning_queue.admission_status())
 
     @containers_bp.route('/settings', methods=['GET'])
     @admins_only
@@ -535,3 +828,6 @@ def load(app: Flask):
         return render_template('container_settings.html', settings=container_manager.settings)
 
     app.register_blueprint(containers_bp)
+
+    print(
+        f"[Container Startup] Plugin loaded in {time.perf_counter() - started:.2f}s")
@@ -0,0 +1,167 @@
+import math
+
+from sqlalchemy.exc import IntegrityError
+
+from CTFd.models import db
+from .models import ContainerInfoModel, ContainerJobModel, ContainerLeaseModel
+
+
+def lock_row(name: str) -> None:
+    """
+    Lock the ContainerLeaseModel row of the given name until the end of the transaction, creating it if needed. Must be
+    called with an app context.
+    """
+    lock = ContainerLeaseModel.query.filter_by(
+        name=name).with_for_update().first()
+    if lock is not None:
+        return
+
+    try:
+        with db.session.begin_nested():
+            db.session.add(ContainerLeaseModel(name=name))
+    except IntegrityError:
+        pass
+    ContainerLeaseModel.query.filter_by(
+        name=name).with_for_update().first()
+
+
+class AdmissionControl:
+    """
+    Decides which queued provisioning jobs may start, so the plugin never runs more instances than the hosts can take.
+
+    An instance is a team's container for a challenge, whether it is running or still starting. The global limit is
+    the smallest of container_max_instances and the number of containers that fit in the CPU and memory budgets, each
+    container reserving container_maxcpu cores and container_maxmemory MB. A blank budget is taken from the sum of the
+    hosts' max_cpu and max_memory when every host has one. Warm pool containers are not counted, since requests claim
+    them instead of starting new ones.
+
+    Queued jobs are considered round-robin by team: every team's oldest job comes before any team's second job, so one
+    team queueing many challenges can't starve the others.
+    """
+
+    LOCK_NAME = "admission"
+
+    def __init__(self, container_manager) -> None:
+        self.container_manager = container_manager
+
+    def setting(self, key: str):
+        return self.container_manager.settings.value(key)
+
+    def budget(self, key: str, host_attribute: str):
+        """A configured budget, or the sum of every host's limit if all hosts have one"""
+        budget = self.setting(key)
+        if budget:
+            return budget
+
+        limits = [getattr(host, host_attribute)
+                  for host in self.container_manager.hosts.values()]
+        if len(limits) == 0 or not all(limits):
+            return None
+        return sum(limits)
+
+    def capacity(self) -> "int|None":
+        """Number of instances allowed at once over all teams, or None if unlimited"""
+        limits = []
+
+        if self.setting("container_max_instances"):
+            limits.append(self.setting("container_max_instances"))
+
+        cpu = self.container_manager.container_cpu()
+        cpu_budget = self.budget("container_cpu_budget", "max_cpu")
+        if cpu > 0 and cpu_budget:
+            limits.append(math.floor(cpu_budget / cpu))
+
+        memory = self.container_manager.container_memory()
+        memory_budget = self.budget("container_memory_budget", "max_memory")
+        if memory > 0 and memory_budget:
+            limits.append(math.floor(memory_budget / memory))
+
+        if len(limits) == 0:
+            return None
+        return max(0, min(limits))
+
+    def team_capacity(self) -> "int|None":
+        """Number of instances one team may have at once, or None if unlimited"""
+        return self.setting("container_max_team_instances") or None
+
+    def lock(self) -> None:
+        """
+        Lock the admission row until the end of the transaction so only one process admits jobs at a time. Must be
+        called with an app context.
+        """
+        lock_row(self.LOCK_NAME)
+
+    def usage(self, stale_before: int) -> "tuple[set[tuple[int, int]], set[tuple[int, int]]]":
+        """
+        :return: (challenge, team) pairs with a container, and pairs with a starting job but no container yet
+        """
+        running = {(challenge_id, team_id) for challenge_id, team_id in db.session.query(
+            ContainerInfoModel.challenge_id, ContainerInfoModel.team_id).all()}
+
+        starting = {(challenge_id, team_id) for challenge_id, team_id in db.session.query(
+            ContainerJobModel.challenge_id, ContainerJobModel.team_id
+        ).filter(
+            ContainerJobModel.status == "starting",
+            ContainerJobModel.updated >= stale_before,
+        ).all()} - running
+
+        return running, starting
+
+    def admit(self, queued: "list[ContainerJobModel]", stale_before: int, limit: int) -> "list[ContainerJobModel]":
+        """
+        Pick up to limit queued jobs that fit within the limits, in fair order. Must be called with the admission lock
+        held.
+        """
+        running, starting = self.usage(stale_before)
+        instances = running | starting
+
+        team_counts: "dict[int, int]" = {}
+        for _, team_id in instances:
+            team_counts[team_id] = team_counts.get(team_id, 0) + 1
+
+        capacity = self.capacity()
+        team_capacity = self.team_capacity()
+
+        admitted = []
+        for job in fair_order(queued):
+            if len(admitted) >= limit:
+                break
+
+            key = (job.challenge_id, job.team_id)
+            # Jobs for an instance the team already has, e.g. resets, don't take a new slot
+            if key not in instances:
+                if capacity is not None and len(instances) >= capacity:
+                    continue
+                if team_capacity is not None and team_counts.get(job.team_id, 0) >= team_capacity:
+                    continue
+                instances.add(key)
+                team_counts[job.team_id] = team_counts.get(job.team_id, 0) + 1
+
+            admitted.append(job)
+
+        return admitted
+
+    def status(self, stale_before: int) -> dict:
+        """Instances in use and the limits, for the admin dashboard. Must be called with an app context."""
+        running, starting = self.usage(stale_before)
+        return {
+            "instances": len(running | starting),
+            "capacity": self.capacity(),
+            "team_capacity": self.team_capacity(),
+            "queued": ContainerJobModel.query.filter_by(status="queued").count(),
+        }
+
+
+def fair_order(jobs: "list[ContainerJobModel]") -> "list[ContainerJobModel]":
+    """Order jobs round-robin by team, each team's jobs oldest first, teams by their oldest job"""
+    by_team: "dict[int, list[ContainerJobModel]]" = {}
+    for job in sorted(jobs, key=lambda job: (job.created, job.id)):
+        by_team.setdefault(job.team_id, []).append(job)
+
+    ordered = []
+    teams = list(by_team.values())
+    for i in range(max((len(team) for team in teams), default=0)):
+        for team in teams:
+            if i < len(team):
+                ordered.append(team[i])
+    return ordered
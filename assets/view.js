@@ -8,7 +8,9 @@ CTFd._internal.challenge.render = function (markdown) {
 	return CTFd._internal.challenge.renderer.render(markdown);
 };
 
-CTFd._internal.challenge.postRender = function () {};
+CTFd._internal.challenge.postRender = function () {
+	container_listen(parseInt(CTFd.lib.$("#challenge-id").val()));
+};
 
 CTFd._internal.challenge.submit = function (preview) {
 	var challenge_id = parseInt(CTFd.lib.$("#challenge-id").val());
@@ -51,15 +53,158 @@ function mergeQueryParams(parameters, queryParameters) {
 	return queryParameters;
 }
 
-function container_request(challenge_id) {
-	var path = "/containers/api/request";
-	var requestButton = document.getElementById("container-request-btn");
-	var requestResult = document.getElementById("container-request-result");
-	var connectionInfo = document.getElementById("container-connection-info");
+var CONTAINER_JOB_POLL_INTERVAL = 1000;
+var CONTAINER_COUNTDOWN_INTERVAL = 15000;
+
+var container_events = null;
+var container_countdown = null;
+
+function container_show_expiry(expires) {
 	var containerExpires = document.getElementById("container-expires");
 	var containerExpiresTime = document.getElementById(
 		"container-expires-time"
 	);
+
+	containerExpiresTime.innerHTML = new Date(expires * 1000).toLocaleTimeString();
+
+	// Keep counting down between pushed updates
+	var update = function () {
+		containerExpires.innerHTML = Math.max(
+			0,
+			Math.ceil((new Date(expires * 1000) - new Date()) / 1000 / 60)
+		);
+	};
+	update();
+	clearInterval(container_countdown);
+	container_countdown = setInterval(update, CONTAINER_COUNTDOWN_INTERVAL);
+}
+
+function container_show_connection(data) {
+	var requestButton = document.getElementById("container-request-btn");
+	var requestResult = document.getElementById("container-request-result");
+	var connectionInfo = document.getElementById("container-connection-info");
+	var requestError = document.getElementById("container-request-error");
+
+	requestError.style.display = "none";
+	if (requestButton !== null) {
+		requestButton.parentNode.removeChild(requestButton);
+	}
+	connectionInfo.innerHTML = data.hostname + ":" + data.port;
+	container_show_expiry(data.expires);
+	requestResult.style.display = "";
+}
+
+function container_listen(challenge_id) {
+	// Status updates for the team's containers are pushed by the server, including ones started by teammates
+	if (container_events !== null) {
+		container_events.close();
+	}
+	if (typeof EventSource === "undefined" || document.getElementById("container-request-result") === null) {
+		return;
+	}
+
+	container_events = new EventSource("/containers/api/events");
+	var queueStatus = document.getElementById("container-queue-status");
+	var listen = function (event, handler) {
+		container_events.addEventListener(event, function (message) {
+			var data = JSON.parse(message.data);
+			if (data.challenge_id === challenge_id) {
+				handler(data);
+			}
+		});
+	};
+
+	listen("progress", function (data) {
+		container_show_queue_position(data);
+	});
+	listen("ready", function (data) {
+		container_show_queue_position(data);
+		container_show_connection(data);
+	});
+	listen("renewed", function (data) {
+		queueStatus.style.display = "none";
+		container_show_expiry(data.expires);
+	});
+	listen("expiring", function (data) {
+		queueStatus.style.display = "";
+		queueStatus.firstElementChild.innerHTML =
+			"Your container expires at " + new Date(data.expires * 1000).toLocaleTimeString() +
+			". Add time to keep it running.";
+	});
+	listen("killed", function (data) {
+		clearInterval(container_countdown);
+		queueStatus.style.display = "none";
+		document.getElementById("container-request-result").innerHTML =
+			data.reason + " Reopen this challenge to start another.";
+	});
+	listen("failed", function (data) {
+		var requestError = document.getElementById("container-request-error");
+		queueStatus.style.display = "none";
+		requestError.style.display = "";
+		requestError.firstElementChild.innerHTML = data.error;
+	});
+
+	// Stop listening once the challenge is closed
+	CTFd.lib.$("#challenge-window").one("hidden.bs.modal", function () {
+		container_events.close();
+		clearInterval(container_countdown);
+	});
+}
+
+function container_poll_job(job_id, callback, progress) {
+	var path = "/containers/api/jobs/" + encodeURIComponent(job_id);
+
+	var xhr = new XMLHttpRequest();
+	xhr.open("GET", path, true);
+	xhr.setRequestHeader("Accept", "application/json");
+	xhr.setRequestHeader("CSRF-Token", init.csrfNonce);
+	xhr.send();
+	xhr.onload = function () {
+		var data = JSON.parse(this.responseText);
+		if (data.status === "queued" || data.status === "starting") {
+			// Still provisioning, check again shortly
+			if (progress !== undefined) {
+				progress(data);
+			}
+			setTimeout(function () {
+				container_poll_job(job_id, callback, progress);
+			}, CONTAINER_JOB_POLL_INTERVAL);
+		} else {
+			callback(data);
+		}
+	};
+}
+
+function container_show_queue_position(data) {
+	var queueStatus = document.getElementById("container-queue-status");
+
+	// Requests over the instance limits wait in a queue until capacity frees up
+	if (data.status === "queued" && data.position !== undefined) {
+		queueStatus.style.display = "";
+		queueStatus.firstElementChild.innerHTML =
+			"All instances are in use. You are number " + data.position + " in the queue.";
+	} else {
+		queueStatus.style.display = "none";
+		queueStatus.firstElementChild.innerHTML = "";
+	}
+}
+
+function container_wait_for_job(data, callback) {
+	// Requests and resets return a job that is provisioned in the background
+	if (data.job_id !== undefined && data.status !== "ready" && data.status !== "failed") {
+		container_show_queue_position(data);
+		container_poll_job(data.job_id, function (result) {
+			container_show_queue_position(result);
+			callback(result);
+		}, container_show_queue_position);
+	} else {
+		callback(data);
+	}
+}
+
+function container_request(challenge_id) {
+	var path = "/containers/api/request";
+	var requestButton = document.getElementById("container-request-btn");
 	var requestError = document.getElementById("container-request-error");
 
 	requestButton.setAttribute("disabled", "disabled");
@@ -71,32 +216,24 @@ function container_request(challenge_id) {
 	xhr.setRequestHeader("CSRF-Token", init.csrfNonce);
 	xhr.send(JSON.stringify({ chal_id: challenge_id }));
 	xhr.onload = function () {
-		var data = JSON.parse(this.responseText);
-		if (data.error !== undefined) {
-			// Container error
-			requestError.style.display = "";
-			requestError.firstElementChild.innerHTML = data.error;
-			requestButton.removeAttribute("disabled");
-		} else if (data.message !== undefined) {
-			// CTFd error
-			requestError.style.display = "";
-			requestError.firstElementChild.innerHTML = data.message;
-			requestButton.removeAttribute("disabled");
-		} else {
-			// Success
-			requestError.style.display = "none";
-			requestError.firstElementChild.innerHTML = "";
-			requestButton.parentNode.removeChild(requestButton);
-			connectionInfo.innerHTML = data.hostname + ":" + data.port;
-			containerExpires.innerHTML = Math.ceil(
-				(new Date(data.expires * 1000) - new Date()) / 1000 / 60
-			);
-			containerExpiresTime.innerHTML = new Date(
-				data.expires * 1000
-			).toLocaleTimeString();
-			requestResult.style.display = "";
-		}
-		console.log(data);
+		container_wait_for_job(JSON.parse(this.responseText), function (data) {
+			if (data.error !== undefined) {
+				// Container error
+				requestError.style.display = "";
+				requestError.firstElementChild.innerHTML = data.error;
+				requestButton.removeAttribute("disabled");
+			} else if (data.message !== undefined) {
+				// CTFd error
+				requestError.style.display = "";
+				requestError.firstElementChild.innerHTML = data.message;
+				requestButton.removeAttribute("disabled");
+			} else {
+				// Success
+				requestError.firstElementChild.innerHTML = "";
+				container_show_connection(data);
+			}
+			console.log(data);
+		});
 	};
 }
 
@@ -104,10 +241,6 @@ function container_reset(challenge_id) {
 	var path = "/containers/api/reset";
 	var resetButton = document.getElementById("container-reset-btn");
 	var requestResult = document.getElementById("container-request-result");
-	var containerExpires = document.getElementById("container-expires");
-	var containerExpiresTime = document.getElementById(
-		"container-expires-time"
-	);
 	var connectionInfo = document.getElementById("container-connection-info");
 	var requestError = document.getElementById("container-request-error");
 
@@ -120,31 +253,27 @@ function container_reset(challenge_id) {
 	xhr.setRequestHeader("CSRF-Token", init.csrfNonce);
 	xhr.send(JSON.stringify({ chal_id: challenge_id }));
 	xhr.onload = function () {
-		var data = JSON.parse(this.responseText);
-		if (data.error !== undefined) {
-			// Container rrror
-			requestError.style.display = "";
-			requestError.firstElementChild.innerHTML = data.error;
-			resetButton.removeAttribute("disabled");
-		} else if (data.message !== undefined) {
-			// CTFd error
-			requestError.style.display = "";
-			requestError.firstElementChild.innerHTML = data.message;
-			resetButton.removeAttribute("disabled");
-		} else {
-			// Success
-			requestError.style.display = "none";
-			connectionInfo.innerHTML = data.hostname + ":" + data.port;
-			containerExpires.innerHTML = Math.ceil(
-				(new Date(data.expires * 1000) - new Date()) / 1000 / 60
-			);
-			containerExpiresTime.innerHTML = new Date(
-				data.expires * 1000
-			).toLocaleTimeString();
-			requestResult.style.display = "";
-			resetButton.removeAttribute("disabled");
-		}
-		console.log(data);
+		container_wait_for_job(JSON.parse(this.responseText), function (data) {
+			if (data.error !== undefined) {
+				// Container rrror
+				requestError.style.display = "";
+				requestError.firstElementChild.innerHTML = data.error;
+				resetButton.removeAttribute("disabled");
+			} else if (data.message !== undefined) {
+				// CTFd error
+				requestError.style.display = "";
+				requestError.firstElementChild.innerHTML = data.message;
+				resetButton.removeAttribute("disabled");
+			} else {
+				// Success
+				requestError.style.display = "none";
+				connectionInfo.innerHTML = data.hostname + ":" + data.port;
+				container_show_expiry(data.expires);
+				requestResult.style.display = "";
+				resetButton.removeAttribute("disabled");
+			}
+			console.log(data);
+		});
 	};
 }
 
@@ -152,10 +281,6 @@ function container_renew(challenge_id) {
 	var path = "/containers/api/renew";
 	var renewButton = document.getElementById("container-renew-btn");
 	var requestResult = document.getElementById("container-request-result");
-	var containerExpires = document.getElementById("container-expires");
-	var containerExpiresTime = document.getElementById(
-		"container-expires-time"
-	);
 	var requestError = document.getElementById("container-request-error");
 
 	renewButton.setAttribute("disabled", "disabled");
@@ -182,12 +307,7 @@ function container_renew(challenge_id) {
 			// Success
 			requestError.style.display = "none";
 			requestResult.style.display = "";
-			containerExpires.innerHTML = Math.ceil(
-				(new Date(data.expires * 1000) - new Date()) / 1000 / 60
-			);
-			containerExpiresTime.innerHTML = new Date(
-				data.expires * 1000
-			).toLocaleTimeString();
+			container_show_expiry(data.expires);
 			renewButton.removeAttribute("disabled");
 		}
 		console.log(data);
@@ -0,0 +1,86 @@
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask
+
+
+class BackgroundContainers:
+    """
+    Base for the jobs that run containers no team owns yet: the warm pool and the shared replicas.
+
+    Subclasses set JOB_ID and LOG_NAME, schedule their own job and keep their own rows. This class starts and kills the
+    containers, in batches on worker threads.
+    """
+
+    JOB_ID = None
+    # Prefix of the messages printed by the job
+    LOG_NAME = None
+    # Number of concurrent Docker calls while starting or killing containers
+    MAX_WORKERS = 8
+
+    def __init__(self, container_manager, app: Flask, scheduler) -> None:
+        self.container_manager = container_manager
+        self.app = app
+        self.scheduler = scheduler
+
+    def trigger(self) -> None:
+        """Run the job as soon as possible instead of waiting for the next interval"""
+        try:
+            self.scheduler.modify_job(
+                self.JOB_ID, next_run_time=datetime.datetime.now(datetime.timezone.utc))
+        except Exception:
+            # The scheduler was shut down or the job was never added
+            pass
+
+    def start_container(self, spec: tuple) -> "tuple[str, str, int]|None":
+        """
+        Start a container for a (challenge_id, image, port, command, volumes) spec.
+
+        :return: (host, container_id, port), or None if it could not be started
+        """
+        challenge_id, image, port, command, volumes = spec
+        try:
+            # Not labelled with a team, since no single team owns these containers
+            # Runs on a worker thread, and port allocation needs the database
+            with self.app.app_context():
+                host, container_id, port = self.container_manager.create_container(
+                    image, port, command, volumes, challenge_id=challenge_id)
+        except Exception as err:
+            # Runs for a whole batch at once, so one failure must not lose the containers the others started
+            print(f"[{self.LOG_NAME}] Could not start container:", err)
+            return None
+
+        if port is None:
+            self.kill_container(container_id, host)
+            return None
+
+        return host, container_id, port
+
+    def start_containers(self, specs: "list[tuple]") -> "list[tuple[str, str, int]|None]":
+        """Start a container for each spec in parallel. Results are in the order of the specs."""
+        if len(specs) == 0:
+            return []
+
+        with ThreadPoolExecutor(max_workers=min(self.MAX_WORKERS, len(specs))) as executor:
+            return list(executor.map(self.start_container, specs))
+
+    def kill_container(self, container_id: str, host: "str|None") -> None:
+        from .container_manager import ContainerException
+
+        try:
+            self.container_manager.kill_container(container_id, host)
+        except ContainerException:
+            print(
+                f"[{self.LOG_NAME}] Docker is not initialized. Please check your settings.")
+        except Exception as err:
+            print(f"[{self.LOG_NAME}] Could not kill container {container_id}:", err)
+
+    def kill_containers(self, containers: "list[tuple[str, str]]") -> None:
+        """Kill the given (container_id, host) pairs in parallel"""
+        if len(containers) == 0:
+            return
+
+        container_ids = [container_id for container_id, _ in containers]
+        hosts = [host for _, host in containers]
+        with ThreadPoolExecutor(max_workers=min(self.MAX_WORKERS, len(container_ids))) as executor:
+            list(executor.map(self.kill_container, container_ids, hosts))
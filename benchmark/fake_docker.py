@@ -0,0 +1,586 @@
+"""
+Stand-in Docker daemon for load testing the plugin without starting real containers.
+
+Implements the part of the Docker Engine HTTP API that ContainerManager uses: ping, version, events, container create,
+start, inspect, list, stats, restart, kill and remove, and image list, inspect and pull. Containers are only records in
+memory. Every call can be slowed down, failed with a 500 or have its connection dropped, to rehearse a slow or flaky
+daemon, and new connections can be made expensive to rehearse an SSH transport. POST /_fake/orphans starts containers
+the plugin has no row for, for the orphan reconciler to find.
+
+Point the plugin's Base URL at it, e.g. tcp://127.0.0.1:2375, and read what is left running from /_fake/stats.
+"""
+import re
+import json
+import time
+import queue
+import random
+import argparse
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+API_VERSION = "1.41"
+VERSION_PREFIX = re.compile(r"^/v[0-9.]+")
+
+
+class FakeDaemon:
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, failure_rate: float = 0, drop_rate: float = 0,
+                 port_range: range = range(30000, 40000), images: "list[str]|None" = None,
+                 connect_latency_ms: float = 0, idle_fraction: float = 0) -> None:
+        self.latency = latency_ms / 1000
+        self.connect_latency = connect_latency_ms / 1000
+        self.idle_fraction = idle_fraction
+        self.jitter = jitter_ms / 1000
+        self.failure_rate = failure_rate
+        self.drop_rate = drop_rate
+        self.port_range = port_range
+
+        self.lock = threading.Lock()
+        self.containers: "dict[str, dict]" = {}
+        self.images: "set[str]" = set(images or [])
+        self.used_ports: "set[int]" = set()
+        self.subscribers: "list[tuple[queue.Queue, dict]]" = []
+        self.calls: "dict[str, int]" = {}
+        self.created = 0
+        self.killed = 0
+        self.removed = 0
+        self.restarted = 0
+        self.connections = 0
+
+    def delay(self) -> None:
+        if self.latency > 0 or self.jitter > 0:
+            time.sleep(max(0.0, random.gauss(self.latency, self.jitter)))
+
+    def connect(self) -> None:
+        with self.lock:
+            self.connections += 1
+        if self.connect_latency > 0:
+            time.sleep(self.connect_latency)
+
+    def count(self, call: str) -> None:
+        with self.lock:
+            self.calls[call] = self.calls.get(call, 0) + 1
+
+    def publish(self, action: str, container: dict) -> None:
+        event = {
+            "Type": "container",
+            "Action": action,
+            "status": action,
+            "id": container["Id"],
+            "from": container["Image"],
+            "Actor": {"ID": container["Id"], "Attributes": dict(container["Labels"])},
+            "time": int(time.time()),
+            "timeNano": time.time_ns(),
+        }
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for events, filters in subscribers:
+            if matches(container, filters):
+                events.put(event)
+
+    def allocate_port(self, requested: str) -> "int|None":
+        with self.lock:
+            if requested:
+                port = int(requested)
+                if port in self.used_ports:
+                    return None
+            else:
+                free = [port for port in self.port_range if port not in self.used_ports]
+                if len(free) == 0:
+                    return None
+                port = random.choice(free)
+            self.used_ports.add(port)
+            return port
+
+    def find_image(self, name: str) -> "str|None":
+        """Tag of the image with the given tag or Id, which docker-py uses when listing images"""
+        if name in self.images:
+            return name
+        if name.startswith("sha256:"):
+            for image in self.images:
+                if image_id(image) == name:
+                    return image
+        return None
+
+    def create(self, body: dict) -> "tuple[int, dict]":
+        image = body.get("Image", "")
+        if image not in self.images and image.split(":")[0] + ":latest" not in self.images:
+            return 404, {"message": f"No such image: {image}"}
+
+        host_config = body.get("HostConfig") or {}
+        # Like Docker, host ports are only bound when the container starts
+        bindings = {container_port: (bindings or [{}])[0].get("HostPort") or ""
+                    for container_port, bindings in (host_config.get("PortBindings") or {}).items()}
+
+        container_id = uuid.uuid4().hex + uuid.uuid4().hex
+        container = {
+            "Id": container_id,
+            "Name": "/" + container_id[:12],
+            "Image": image,
+            "Labels": body.get("Labels") or {},
+            "State": "created",
+            "Bindings": bindings,
+            "Ports": {},
+            "AutoRemove": bool(host_config.get("AutoRemove")),
+            "Created": int(time.time()),
+            "Started": None,
+            # Idle containers report no CPU or network use, for the plugin's idle monitor
+            "Idle": random.random() < self.idle_fraction,
+        }
+        with self.lock:
+            self.containers[container_id] = container
+            self.created += 1
+        self.publish("create", container)
+        return 201, {"Id": container_id, "Warnings": []}
+
+    def start(self, container_id: str) -> "tuple[int, dict|None]":
+        with self.lock:
+            container = self.containers.get(container_id)
+            if container is None:
+                return 404, {"message": f"No such container: {container_id}"}
+        if container["State"] != "running":
+            error = self.bind(container)
+            if error is not None:
+                return 500, {"message": error}
+            with self.lock:
+                container["State"] = "running"
+                container["Started"] = time.time()
+        self.publish("start", container)
+        return 204, None
+
+    def bind(self, container: dict) -> "str|None":
+        """Allocate the container's host ports. Returns Docker's error message if one is taken."""
+        ports = {}
+        for container_port, requested in container["Bindings"].items():
+            port = self.allocate_port(requested)
+            if port is None:
+                with self.lock:
+                    self.used_ports.difference_update(ports.values())
+                return f"driver failed programming external connectivity: Bind for 0.0.0.0:{requested} failed: port " \
+                       f"is already allocated"
+            ports[container_port] = port
+        with self.lock:
+            container["Ports"] = ports
+        return None
+
+    def restart(self, container_id: str) -> "tuple[int, dict|None]":
+        container = self.find(container_id)
+        if container is None:
+            return 404, {"message": f"No such container: {container_id}"}
+        if container["State"] != "running":
+            error = self.bind(container)
+            if error is not None:
+                return 500, {"message": error}
+        with self.lock:
+            was_running = container["State"] == "running"
+            container["State"] = "running"
+            container["Started"] = time.time()
+            self.restarted += 1
+        if was_running:
+            self.publish("die", container)
+        self.publish("start", container)
+        self.publish("restart", container)
+        return 204, None
+
+    def remove(self, container_id: str, force: bool) -> "tuple[int, dict|None]":
+        container = self.find(container_id)
+        if container is None:
+            return 404, {"message": f"No such container: {container_id}"}
+        with self.lock:
+            running = container["State"] == "running"
+            if running and not force:
+                return 409, {"message": f"You cannot remove a running container {container_id}. Stop the container "
+                                        f"before attempting removal or force remove"}
+            self.containers.pop(container["Id"], None)
+            self.used_ports.difference_update(container["Ports"].values())
+            container["State"] = "removed"
+            self.removed += 1
+        if running:
+            self.publish("kill", container)
+            self.publish("die", container)
+        self.publish("destroy", container)
+        return 204, None
+
+    def container_stats(self, container_id: str) -> "tuple[int, dict]":
+        """Cumulative counters that grow with uptime, except for idle containers"""
+        container = self.find(container_id)
+        if container is None:
+            return 404, {"message": f"No such container: {container_id}"}
+
+        uptime = 0.0
+        if container["State"] == "running" and container["Started"] is not None and not container["Idle"]:
+            uptime = time.time() - container["Started"]
+        return 200, {
+            "id": container["Id"],
+            "read": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            # A tenth of a core and 10 kB/s while running
+            "cpu_stats": {"cpu_usage": {"total_usage": int(uptime * 100_000_000)}},
+            "networks": {"eth0": {"rx_bytes": int(uptime * 5_000), "tx_bytes": int(uptime * 5_000)}},
+        }
+
+    def add_orphans(self, count: int, labels: dict, age: int) -> "tuple[int, dict]":
+        """Start containers nobody has a row for, as if a kill had failed after its row was deleted"""
+        now = time.time()
+        ids = []
+        with self.lock:
+            for _ in range(count):
+                container_id = uuid.uuid4().hex + uuid.uuid4().hex
+                self.containers[container_id] = {
+                    "Id": container_id,
+                    "Name": "/" + container_id[:12],
+                    "Image": "fake/orphan:latest",
+                    "Labels": dict(labels),
+                    "State": "running",
+                    "Bindings": {},
+                    "Ports": {},
+                    "AutoRemove": False,
+                    "Created": int(now - age),
+                    "Started": now - age,
+                    "Idle": True,
+                }
+                ids.append(container_id)
+        return 201, {"ids": ids}
+
+    def kill(self, container_id: str) -> "tuple[int, dict|None]":
+        with self.lock:
+            container = self.containers.get(container_id)
+            if container is None:
+                return 404, {"message": f"No such container: {container_id}"}
+            if container["State"] != "running":
+                return 409, {"message": f"Container {container_id} is not running"}
+            container["State"] = "exited"
+            self.killed += 1
+            # A stopped container gives its host ports back
+            self.used_ports.difference_update(container["Ports"].values())
+            container["Ports"] = {}
+            if container["AutoRemove"]:
+                del self.containers[container_id]
+        self.publish("kill", container)
+        self.publish("die", container)
+        if container["AutoRemove"]:
+            self.publish("destroy", container)
+        return 204, None
+
+    def find(self, name: str) -> "dict|None":
+        with self.lock:
+            if name in self.containers:
+                return self.containers[name]
+            for container_id, container in self.containers.items():
+                if container_id.startswith(name) or container["Name"] == "/" + name:
+                    return container
+        return None
+
+    def inspect(self, container_id: str) -> "tuple[int, dict]":
+        container = self.find(container_id)
+        if container is None:
+            return 404, {"message": f"No such container: {container_id}"}
+
+        running = container["State"] == "running"
+        return 200, {
+            "Id": container["Id"],
+            "Name": container["Name"],
+            "Image": container["Image"],
+            "Created": container["Created"],
+            "Config": {"Image": container["Image"], "Labels": container["Labels"]},
+            "State": {"Status": container["State"], "Running": running},
+            "NetworkSettings": {"Ports": {
+                container_port: [{"HostIp": "0.0.0.0", "HostPort": str(port)}] if running else None
+                for container_port, port in container["Ports"].items()
+            }},
+        }
+
+    def list(self, query: dict) -> "tuple[int, list]":
+        filters = json.loads(query.get("filters", ["{}"])[0] or "{}")
+        show_all = query.get("all", ["0"])[0] in ("1", "true", "True")
+        with self.lock:
+            containers = list(self.containers.values())
+
+        result = []
+        for container in containers:
+            if not show_all and container["State"] != "running":
+                continue
+            if not matches(container, filters):
+                continue
+            result.append({
+                "Id": container["Id"],
+                "Names": [container["Name"]],
+                "Image": container["Image"],
+                "Labels": container["Labels"],
+                "State": container["State"],
+                "Status": container["State"].capitalize(),
+                "Created": container["Created"],
+                "Ports": [{
+                    "IP": "0.0.0.0",
+                    "PrivatePort": int(container_port.split("/")[0]),
+                    "PublicPort": port,
+                    "Type": "tcp",
+                } for container_port, port in container["Ports"].items()],
+            })
+        return 200, result
+
+    def stats(self) -> dict:
+        with self.lock:
+            containers = [{
+                "id": container["Id"],
+                "state": container["State"],
+                "labels": container["Labels"],
+            } for container in self.containers.values()]
+            return {
+                "running": sum(1 for container in containers if container["state"] == "running"),
+                "created": self.created,
+                "killed": self.killed,
+                "removed": self.removed,
+                "restarted": self.restarted,
+                "connections": self.connections,
+                "calls": dict(self.calls),
+                "containers": containers,
+            }
+
+
+def image_id(image: str) -> str:
+    """Stable fake Id of an image tag"""
+    return "sha256:" + uuid.uuid5(uuid.NAMESPACE_DNS, image).hex
+
+
+def matches(container: dict, filters: dict) -> bool:
+    """Apply the id, label and type filters the plugin uses"""
+    ids = filters.get("id") or []
+    if isinstance(ids, dict):
+        ids = list(ids.keys())
+    if len(ids) > 0 and not any(container["Id"].startswith(container_id) for container_id in ids):
+        return False
+
+    labels = filters.get("label") or []
+    if isinstance(labels, dict):
+        labels = list(labels.keys())
+    for label in labels:
+        key, _, value = label.partition("=")
+        if key not in container["Labels"] or (value and container["Labels"][key] != value):
+            return False
+
+    return True
+
+
+def make_handler(daemon: FakeDaemon):
+    class Handler(BaseHTTPRequestHandler):
+        # Chunked streams for events and pulls need HTTP/1.1
+        protocol_version = "HTTP/1.1"
+        # Headers and body are written separately, which Nagle's algorithm would hold up on a reused connection
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args) -> None:
+            pass
+
+        def setup(self) -> None:
+            super().setup()
+            # Charged once per connection, like opening a channel and starting "docker system dial-stdio" over SSH
+            daemon.connect()
+
+        def send_json(self, status: int, body=None) -> None:
+            data = b"" if body is None else json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def send_chunk(self, body) -> None:
+            data = json.dumps(body).encode() + b"\n"
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def start_stream(self) -> None:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+        def end_stream(self) -> None:
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+        def read_body(self) -> dict:
+            length = int(self.headers.get("Content-Length") or 0)
+            if length == 0:
+                return {}
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def skip_body(self) -> None:
+            """Read and discard the request body, so it isn't parsed as the next request on a keep-alive connection"""
+            length = int(self.headers.get("Content-Length") or 0)
+            if length > 0:
+                self.rfile.read(length)
+
+        def do_GET(self) -> None:
+            self.route("GET")
+
+        def do_POST(self) -> None:
+            self.route("POST")
+
+        def do_HEAD(self) -> None:
+            self.route("HEAD")
+
+        def do_DELETE(self) -> None:
+            self.route("DELETE")
+
+        def route(self, method: str) -> None:
+            url = urlparse(self.path)
+            path = VERSION_PREFIX.sub("", url.path)
+            query = parse_qs(url.query)
+
+            if path == "/_fake/stats":
+                return self.send_json(200, daemon.stats())
+            if path == "/_fake/orphans" and method == "POST":
+                body = self.read_body()
+                return self.send_json(*daemon.add_orphans(
+                    int(body.get("count", 1)), body.get("labels") or {}, int(body.get("age", 3600))))
+
+            call = f"{method} {re.sub(r'/[0-9a-f]{12,}', '/{id}', path)}"
+            daemon.count(call)
+
+            # The health checks and the event stream are never failed on purpose, so injected failures only hit
+            # the calls being measured
+            if path not in ("/_ping", "/version", "/events"):
+                daemon.delay()
+                if random.random() < daemon.drop_rate:
+                    self.close_connection = True
+                    self.connection.close()
+                    return
+                if random.random() < daemon.failure_rate:
+                    self.skip_body()
+                    return self.send_json(500, {"message": "injected failure"})
+
+            if path == "/_ping":
+                data = b"OK"
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain")
+                self.send_header("Api-Version", API_VERSION)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                if method != "HEAD":
+                    self.wfile.write(data)
+                return
+            if path == "/version":
+                return self.send_json(200, {"Version": "fake", "ApiVersion": API_VERSION, "MinAPIVersion": "1.12",
+                                            "Os": "linux", "Arch": "amd64"})
+            if path == "/events":
+                return self.events(query)
+
+            if path == "/containers/json":
+                return self.send_json(*daemon.list(query))
+            if path == "/containers/create" and method == "POST":
+                return self.send_json(*daemon.create(self.read_body()))
+            match = re.match(r"^/containers/([^/]+)/(json|stats|start|kill|restart)$", path)
+            if match is not None:
+                container_id, action = match.groups()
+                if action == "json":
+                    return self.send_json(*daemon.inspect(container_id))
+                if action == "stats":
+                    return self.send_json(*daemon.container_stats(container_id))
+                self.read_body()
+                if action == "start":
+                    return self.send_json(*daemon.start(container_id))
+                if action == "restart":
+                    return self.send_json(*daemon.restart(container_id))
+                return self.send_json(*daemon.kill(container_id))
+            match = re.match(r"^/containers/([^/]+)$", path)
+            if match is not None and method == "DELETE":
+                force = query.get("force", ["0"])[0] in ("1", "true", "True")
+                return self.send_json(*daemon.remove(match.group(1), force))
+
+            if path == "/images/json":
+                return self.send_json(200, [{"Id": image_id(image), "RepoTags": [image]}
+                                            for image in sorted(daemon.images)])
+            if path == "/images/create" and method == "POST":
+                return self.pull(query)
+            match = re.match(r"^/images/(.+)/json$", path)
+            if match is not None:
+                image = daemon.find_image(match.group(1))
+                if image is None:
+                    return self.send_json(404, {"message": f"No such image: {match.group(1)}"})
+                return self.send_json(200, {"Id": image_id(image), "RepoTags": [image]})
+
+            self.send_json(404, {"message": f"page not found: {method} {path}"})
+
+        def events(self, query: dict) -> None:
+            filters = json.loads(query.get("filters", ["{}"])[0] or "{}")
+            events = queue.Queue()
+            with daemon.lock:
+                daemon.subscribers.append((events, filters))
+
+            self.start_stream()
+            try:
+                while True:
+                    try:
+                        self.send_chunk(events.get(timeout=1))
+                    except queue.Empty:
+                        # A closed connection is only noticed on the next write
+                        continue
+            except (BrokenPipeError, ConnectionResetError, OSError):
+                pass
+            finally:
+                with daemon.lock:
+                    daemon.subscribers.remove((events, filters))
+
+        def pull(self, query: dict) -> None:
+            image = query.get("fromImage", [""])[0]
+            tag = query.get("tag", ["latest"])[0] or "latest"
+            self.start_stream()
+            total = 1000
+            for current in range(0, total + 1, 250):
+                self.send_chunk({"status": "Downloading", "id": "layer",
+                                 "progressDetail": {"current": current, "total": total}})
+            self.send_chunk({"status": f"Downloaded newer image for {image}:{tag}"})
+            self.end_stream()
+            with daemon.lock:
+                daemon.images.add(f"{image}:{tag}")
+
+    return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2375)
+    parser.add_argument("--latency-ms", type=float, default=0,
+                        help="Mean added latency per API call")
+    parser.add_argument("--jitter-ms", type=float, default=0,
+                        help="Standard deviation of the added latency")
+    parser.add_argument("--connect-latency-ms", type=float, default=0,
+                        help="Added latency when a client opens a new connection, e.g. to mimic an SSH transport")
+    parser.add_argument("--idle-fraction", type=float, default=0,
+                        help="Fraction of containers that report no CPU or network use in their stats")
+    parser.add_argument("--failure-rate", type=float, default=0,
+                        help="Fraction of API calls answered with a 500")
+    parser.add_argument("--drop-rate", type=float, default=0,
+                        help="Fraction of API calls whose connection is dropped without an answer")
+    parser.add_argument("--port-range", default="30000-39999",
+                        help="Host ports handed out when the plugin lets Docker pick")
+    parser.add_argument("--image", action="append", default=[],
+                        help="Image present from the start, e.g. fake/challenge:latest. May be repeated.")
+    args = parser.parse_args()
+
+    start, end = (int(part) for part in args.port_range.split("-", 1))
+    daemon = FakeDaemon(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        failure_rate=args.failure_rate,
+        drop_rate=args.drop_rate,
+        port_range=range(start, end + 1),
+        images=args.image or ["fake/challenge:latest"],
+        connect_latency_ms=args.connect_latency_ms,
+        idle_fraction=args.idle_fraction,
+    )
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(daemon))
+    server.daemon_threads = True
+    print(f"Fake Docker daemon listening on tcp://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""
+Stand-in SSH endpoint for measuring the plugin's ssh:// transport against fake_docker.py.
+
+The Docker SDK reaches a daemon over SSH by running "docker system dial-stdio" on the remote machine, once per pooled
+connection, each as a channel of one SSH connection. This server accepts any public key, and answers every such command
+by connecting the channel to the fake daemon's TCP port, so each channel also shows up as a connection in the fake
+daemon's stats.
+
+The SDK only connects to hosts listed in known_hosts. The server prints the line to add, e.g. to a throwaway HOME's
+~/.ssh/known_hosts, next to a key in ~/.ssh/id_ed25519 for the client to log in with.
+"""
+import os
+import socket
+import argparse
+import threading
+
+import paramiko
+
+
+class Server(paramiko.ServerInterface):
+    def __init__(self, docker_address: "tuple[str, int]") -> None:
+        self.docker_address = docker_address
+
+    def get_allowed_auths(self, username: str) -> str:
+        return "publickey"
+
+    def check_auth_publickey(self, username: str, key: paramiko.PKey) -> int:
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind: str, chanid: int) -> int:
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel: paramiko.Channel, command: bytes) -> bool:
+        if command.decode() != "docker system dial-stdio":
+            return False
+        threading.Thread(target=self.dial, args=(channel,), daemon=True).start()
+        return True
+
+    def dial(self, channel: paramiko.Channel) -> None:
+        daemon = socket.create_connection(self.docker_address)
+
+        def pump(read, write) -> None:
+            try:
+                while True:
+                    data = read(65536)
+                    if not data:
+                        break
+                    write(data)
+            except OSError:
+                pass
+            finally:
+                channel.close()
+                daemon.close()
+
+        threading.Thread(target=pump, args=(channel.recv, daemon.sendall), daemon=True).start()
+        pump(daemon.recv, channel.sendall)
+
+
+def serve(client: socket.socket, host_key: paramiko.PKey, docker_address: "tuple[str, int]") -> None:
+    transport = paramiko.Transport(client)
+    transport.add_server_key(host_key)
+    transport.start_server(server=Server(docker_address))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=2222)
+    parser.add_argument("--docker", default="127.0.0.1:2375", help="Address of fake_docker.py")
+    parser.add_argument("--host-key", default="fake_ssh_host_key",
+                        help="Host key file, created if it doesn't exist")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.host_key):
+        paramiko.RSAKey.generate(2048).write_private_key_file(args.host_key)
+    host_key = paramiko.RSAKey.from_private_key_file(args.host_key)
+    docker_host, _, docker_port = args.docker.rpartition(":")
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind((args.host, args.port))
+    listener.listen(100)
+    print(f"Fake SSH endpoint listening on ssh://{args.host}:{args.port}, forwarding to tcp://{args.docker}")
+    print(f"known_hosts line: [{args.host}]:{args.port} {host_key.get_name()} {host_key.get_base64()}", flush=True)
+    try:
+        while True:
+            client, _ = listener.accept()
+            threading.Thread(target=serve, args=(client, host_key, (docker_host, int(docker_port))),
+                             daemon=True).start()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
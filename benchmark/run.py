@@ -0,0 +1,399 @@
+"""
+Load test for the containers plugin, run against a CTFd instance whose Docker host is the fake daemon.
+
+Creates simulated teams, has every team request, renew, reset and stop containers concurrently through the player
+endpoints, optionally leaves the last round of containers for the expiry reaper or injects orphans for the reconciler,
+and then reports throughput, latency percentiles, errors and containers left running on the daemon that CTFd no longer
+knows about.
+"""
+import re
+import sys
+import json
+import math
+import time
+import uuid
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+NONCE_INPUT = re.compile(r'name="nonce"[^>]*value="([^"]+)"|value="([^"]+)"[^>]*name="nonce"')
+CSRF_NONCE = re.compile(r"csrfNonce['\"]?\s*:\s*\"([^\"]+)\"")
+METRIC_LINE = re.compile(r"^([a-z_]+)(\{[^}]*\})? ([0-9.e+-]+)$")
+
+JOB_POLL_INTERVAL_SECONDS = 0.25
+JOB_TIMEOUT_SECONDS = 300
+# Label the plugin puts on every container it starts, with the CTFd instance's id
+LABEL_INSTANCE = "ctfd.containers.instance"
+# Orphans are this much older than the reconciler's grace period
+ORPHAN_AGE_SECONDS = 3600
+
+
+class Session:
+    """A logged in CTFd browser session"""
+
+    def __init__(self, base_url: str, forwarded_for: "str|None" = None) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.http = requests.Session()
+        if forwarded_for is not None:
+            # Every team needs its own address, or the plugin's per-IP rate limits throttle the whole run. CTFd only
+            # honours this header when it runs behind a trusted reverse proxy (REVERSE_PROXY=true).
+            self.http.headers["X-Forwarded-For"] = forwarded_for
+        self.nonce = None
+
+    def url(self, path: str) -> str:
+        return self.base_url + path
+
+    def login(self, name: str, password: str) -> None:
+        page = self.http.get(self.url("/login")).text
+        match = NONCE_INPUT.search(page)
+        if match is None:
+            raise RuntimeError("Could not find the login nonce")
+        response = self.http.post(self.url("/login"), data={
+            "name": name, "password": password, "nonce": match.group(1) or match.group(2)})
+        if "/login" in response.url:
+            raise RuntimeError(f"Could not log in as {name}")
+        self.refresh_nonce()
+
+    def refresh_nonce(self) -> None:
+        match = CSRF_NONCE.search(self.http.get(self.url("/challenges")).text)
+        if match is None:
+            raise RuntimeError("Could not find the CSRF nonce")
+        self.nonce = match.group(1)
+
+    def post_json(self, path: str, body: dict) -> requests.Response:
+        return self.http.post(self.url(path), json=body, headers={"CSRF-Token": self.nonce})
+
+    def get_json(self, path: str) -> requests.Response:
+        return self.http.get(self.url(path), headers={"Accept": "application/json"})
+
+
+class Results:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        # Action -> latencies in seconds of successful calls
+        self.latencies: "dict[str, list[float]]" = {}
+        # Action -> error message -> count
+        self.errors: "dict[str, dict[str, int]]" = {}
+
+    def record(self, action: str, seconds: float, error: "str|None" = None) -> None:
+        with self.lock:
+            if error is None:
+                self.latencies.setdefault(action, []).append(seconds)
+            else:
+                counts = self.errors.setdefault(action, {})
+                counts[error] = counts.get(error, 0) + 1
+
+    def summary(self) -> dict:
+        with self.lock:
+            actions = sorted(set(self.latencies) | set(self.errors))
+            summary = {}
+            for action in actions:
+                latencies = sorted(self.latencies.get(action, []))
+                summary[action] = {
+                    "ok": len(latencies),
+                    "failed": sum(self.errors.get(action, {}).values()),
+                    "p50": percentile(latencies, 50),
+                    "p90": percentile(latencies, 90),
+                    "p99": percentile(latencies, 99),
+                    "max": latencies[-1] if latencies else None,
+                    "errors": dict(self.errors.get(action, {})),
+                }
+            return summary
+
+
+def percentile(values: "list[float]", percent: float) -> "float|None":
+    if len(values) == 0:
+        return None
+    # Nearest rank
+    index = min(len(values) - 1, max(0, math.ceil(percent / 100 * len(values)) - 1))
+    return values[index]
+
+
+def check(response: requests.Response) -> dict:
+    """Return the JSON body, raising with the plugin's error message if the call failed"""
+    if response.status_code == 429:
+        raise RuntimeError("rate limited")
+    try:
+        data = response.json()
+    except ValueError:
+        raise RuntimeError(f"HTTP {response.status_code}")
+    if response.status_code >= 400 or "error" in data:
+        raise RuntimeError(data.get("error") or data.get("message") or f"HTTP {response.status_code}")
+    return data
+
+
+def wait_for_job(session: Session, data: dict) -> dict:
+    deadline = time.time() + JOB_TIMEOUT_SECONDS
+    while data.get("status") in ("queued", "starting"):
+        if time.time() > deadline:
+            raise RuntimeError("job timed out")
+        time.sleep(JOB_POLL_INTERVAL_SECONDS)
+        data = check(session.get_json(f"/containers/api/jobs/{data['job_id']}"))
+    if data.get("status") == "failed":
+        raise RuntimeError(data.get("error") or "job failed")
+    return data
+
+
+def timed(results: Results, action: str, func) -> bool:
+    start = time.perf_counter()
+    try:
+        func()
+    except Exception as err:
+        results.record(action, time.perf_counter() - start, str(err) or type(err).__name__)
+        return False
+    results.record(action, time.perf_counter() - start)
+    return True
+
+
+def run_team(session: Session, challenge_ids: "list[int]", iterations: int, leave_running: bool,
+             results: Results) -> None:
+    def request(chal_id: int) -> None:
+        wait_for_job(session, check(session.post_json("/containers/api/request", {"chal_id": chal_id})))
+
+    def renew(chal_id: int) -> None:
+        check(session.post_json("/containers/api/renew", {"chal_id": chal_id}))
+
+    def reset(chal_id: int) -> None:
+        wait_for_job(session, check(session.post_json("/containers/api/reset", {"chal_id": chal_id})))
+
+    def stop(chal_id: int) -> None:
+        check(session.post_json("/containers/api/stop", {"chal_id": chal_id}))
+
+    for iteration in range(iterations):
+        chal_id = random.choice(challenge_ids)
+        if not timed(results, "request", lambda: request(chal_id)):
+            continue
+        timed(results, "renew", lambda: renew(chal_id))
+        timed(results, "reset", lambda: reset(chal_id))
+        if leave_running and iteration == iterations - 1:
+            # Left for the expiry reaper
+            continue
+        timed(results, "stop", lambda: stop(chal_id))
+
+
+def setup(admin: Session, args) -> "tuple[list[int], list[tuple[str, str]]]":
+    """Configure the plugin, create the challenges and create one user per team"""
+    if args.configure:
+        response = admin.http.post(admin.url("/containers/api/settings/update"), data={
+            "docker_base_url": args.docker_url,
+            "docker_hostname": "localhost",
+            "container_expiration": str(args.expiration),
+            "container_maxmemory": "",
+            "container_maxcpu": "",
+            "docker_pool_size": "" if args.pool_size is None else str(args.pool_size),
+            "container_idle_minutes": "" if args.idle_minutes is None else str(args.idle_minutes),
+            "nonce": admin.nonce,
+        })
+        if response.status_code >= 400:
+            raise RuntimeError(f"Could not save the plugin settings: HTTP {response.status_code}")
+
+    run_id = uuid.uuid4().hex[:6]
+    challenge_ids = []
+    for i in range(args.challenges):
+        data = check(admin.post_json("/api/v1/challenges", {
+            "name": f"bench-{run_id}-{i}",
+            "category": "benchmark",
+            "description": "Created by the load test",
+            "type": "container",
+            "state": "hidden",
+            "image": args.image,
+            "port": 80,
+            "command": "",
+            "volumes": "",
+            "initial": 500,
+            "minimum": 100,
+            "decay": 20,
+            "reset_mode": args.reset_mode,
+        }))
+        challenge_ids.append(data["data"]["id"])
+
+    def create_team(i: int) -> "tuple[str, str]":
+        name = f"bench-{run_id}-{i}"
+        password = uuid.uuid4().hex
+        user = check(admin.post_json("/api/v1/users", {
+            "name": name, "email": f"{name}@example.com", "password": password, "verified": True}))
+        team = check(admin.post_json("/api/v1/teams", {"name": name, "password": password}))
+        check(admin.post_json(f"/api/v1/teams/{team['data']['id']}/members", {"user_id": user["data"]["id"]}))
+        return name, password
+
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        accounts = list(executor.map(create_team, range(args.teams)))
+
+    return challenge_ids, accounts
+
+
+def read_metrics(admin: Session) -> "dict[str, float]":
+    """Sum every metric over its labels"""
+    totals = {}
+    for line in admin.http.get(admin.url("/containers/metrics")).text.splitlines():
+        match = METRIC_LINE.match(line.strip())
+        if match is not None:
+            name, _, value = match.groups()
+            totals[name] = totals.get(name, 0.0) + float(value)
+    return totals
+
+
+def daemon_stats(docker_url: str) -> dict:
+    return requests.get(docker_url.replace("tcp://", "http://").rstrip("/") + "/_fake/stats").json()
+
+
+def leaked_containers(admin: Session, docker_url: str) -> int:
+    """Containers running on the daemon that are neither a team's instance nor in a warm pool"""
+    metrics = read_metrics(admin)
+    known = metrics.get("ctfd_containers_instances", 0) + metrics.get("ctfd_containers_warm_pool", 0)
+    return max(0, daemon_stats(docker_url)["running"] - int(known))
+
+
+def inject_orphans(docker_url: str, count: int, stopped: threading.Event) -> int:
+    """Once the plugin has started a container, start orphans carrying its instance label on the daemon"""
+    base_url = docker_url.replace("tcp://", "http://").rstrip("/")
+    while not stopped.is_set():
+        for container in daemon_stats(docker_url)["containers"]:
+            instance = container["labels"].get(LABEL_INSTANCE)
+            if instance:
+                requests.post(base_url + "/_fake/orphans", json={
+                    "count": count, "labels": {LABEL_INSTANCE: instance}, "age": ORPHAN_AGE_SECONDS})
+                return count
+        stopped.wait(0.5)
+    return 0
+
+
+def reconcile(admin: Session, results: Results) -> "dict|None":
+    """Run an orphan reconciler pass, which removes the injected orphans"""
+    report = None
+
+    def run() -> None:
+        nonlocal report
+        report = check(admin.post_json("/containers/api/reconcile", {}))
+
+    timed(results, "reconcile", run)
+    return report
+
+
+def wait_for_reaper(admin: Session, docker_url: str, timeout: float) -> "float|None":
+    """Wait until every team instance is gone and return how long that took, or None on timeout"""
+    start = time.time()
+    while time.time() - start < timeout:
+        if read_metrics(admin).get("ctfd_containers_instances", 0) == 0:
+            return time.time() - start
+        time.sleep(1)
+    return None
+
+
+def print_report(report: dict) -> None:
+    print(f"\n{report['teams']} teams, {report['actions']} actions in {report['seconds']:.1f}s "
+          f"({report['throughput']:.1f} actions/s)\n")
+    print(f"{'action':<10}{'ok':>8}{'failed':>8}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for action, stats in report["results"].items():
+        def ms(value):
+            return "-" if value is None else f"{value * 1000:.0f}ms"
+        print(f"{action:<10}{stats['ok']:>8}{stats['failed']:>8}{ms(stats['p50']):>10}{ms(stats['p90']):>10}"
+              f"{ms(stats['p99']):>10}{ms(stats['max']):>10}")
+        for error, count in sorted(stats["errors"].items(), key=lambda item: -item[1])[:5]:
+            print(f"{'':<10}{count:>8} x {error}")
+
+    if report["reaper_seconds"] is not None:
+        print(f"\nExpiry reaper cleared every instance after {report['reaper_seconds']:.1f}s")
+    elif report["waited_for_reaper"]:
+        print("\nExpiry reaper did not clear every instance in time")
+    if report["orphans"] > 0:
+        removed = report["reconcile"]["containers_removed"] if report["reconcile"] else 0
+        print(f"Orphan reconciler removed {removed} containers after {report['orphans']} orphans were injected")
+    print(f"Leaked containers: {report['leaked']}")
+    print(f"Daemon calls: {json.dumps(report['daemon_calls'], sort_keys=True)}")
+    print(f"Daemon connections: {report['daemon_connections']}")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="CTFd base URL")
+    parser.add_argument("--admin-name", default="admin")
+    parser.add_argument("--admin-password", required=True)
+    parser.add_argument("--docker-url", default="tcp://127.0.0.1:2375", help="Address of fake_docker.py")
+    parser.add_argument("--no-configure", dest="configure", action="store_false",
+                        help="Keep the plugin settings instead of pointing the plugin at the fake daemon")
+    parser.add_argument("--pool-size", type=int,
+                        help="Connections the plugin keeps open to the daemon when configuring it (default: the plugin's)")
+    parser.add_argument("--expiration", type=int, default=1,
+                        help="Container expiration in minutes when configuring the plugin")
+    parser.add_argument("--idle-minutes", type=int,
+                        help="Stop containers idle for this many minutes when configuring the plugin, which has the "
+                             "idle monitor sample container stats (use fake_docker.py --idle-fraction)")
+    parser.add_argument("--reset-mode", default="new", choices=("new", "restart", "recreate"),
+                        help="How the challenges' containers are reset")
+    parser.add_argument("--orphans", type=int, default=0,
+                        help="Start this many containers without rows on the daemon, then run the orphan reconciler")
+    parser.add_argument("--image", default="fake/challenge:latest")
+    parser.add_argument("--teams", type=int, default=200)
+    parser.add_argument("--challenges", type=int, default=5)
+    parser.add_argument("--iterations", type=int, default=3,
+                        help="Request, renew, reset and stop rounds per team")
+    parser.add_argument("--reaper", action="store_true",
+                        help="Leave the last round running and wait for the expiry reaper to kill it")
+    parser.add_argument("--json", help="Also write the report to this file")
+    args = parser.parse_args()
+
+    admin = Session(args.url)
+    admin.login(args.admin_name, args.admin_password)
+    challenge_ids, accounts = setup(admin, args)
+    print(f"Created {len(challenge_ids)} challenges and {len(accounts)} teams")
+
+    sessions = []
+    for i, (name, password) in enumerate(accounts):
+        session = Session(args.url, forwarded_for=f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}")
+        session.login(name, password)
+        sessions.append(session)
+
+    results = Results()
+    stopped = threading.Event()
+    with ThreadPoolExecutor(max_workers=1) as orphan_executor:
+        orphans = orphan_executor.submit(inject_orphans, args.docker_url, args.orphans, stopped) \
+            if args.orphans > 0 else None
+
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=len(sessions) or 1) as executor:
+            list(executor.map(lambda session: run_team(
+                session, challenge_ids, args.iterations, args.reaper, results), sessions))
+        seconds = time.time() - start
+
+        stopped.set()
+        injected = orphans.result() if orphans is not None else 0
+
+    reconciled = reconcile(admin, results) if injected > 0 else None
+
+    reaper_seconds = None
+    if args.reaper:
+        reaper_seconds = wait_for_reaper(admin, args.docker_url, args.expiration * 60 + 120)
+
+    summary = results.summary()
+    daemon = daemon_stats(args.docker_url)
+    actions = sum(stats["ok"] + stats["failed"] for stats in summary.values())
+    report = {
+        "teams": len(sessions),
+        "actions": actions,
+        "seconds": seconds,
+        "throughput": actions / seconds if seconds > 0 else 0.0,
+        "results": summary,
+        "waited_for_reaper": args.reaper,
+        "reaper_seconds": reaper_seconds,
+        "orphans": injected,
+        "reconcile": reconciled,
+        "leaked": leaked_containers(admin, args.docker_url),
+        "daemon_calls": daemon["calls"],
+        # Connections the plugin opened to the daemon, which stays low when they are pooled
+        "daemon_connections": daemon.get("connections"),
+    }
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+    return 1 if report["leaked"] > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+Measures the Docker client's transport on its own, without CTFd.
+
+Starts and kills containers on the fake daemon from many threads at once through one docker.DockerClient, the way the
+plugin's provisioning workers, reaper and warm pool share each host's client. It reports per-call latency percentiles
+and how many connections the client opened. Run it once with --pool-size 10 (the Docker SDK's own default) and once
+with the plugin's pool size to compare, and start the fake daemon with --connect-latency-ms to make new connections as
+expensive as they are over SSH. For the SSH transport itself, point --docker-url at fake_ssh.py and --stats-url at the
+fake daemon.
+"""
+import sys
+import math
+import time
+import argparse
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import docker
+import requests
+
+# Same as the plugin's DockerHost.DEFAULT_POOL_SIZE
+DEFAULT_POOL_SIZE = 32
+
+
+def percentile(values: "list[float]", percent: float) -> "float|None":
+    if len(values) == 0:
+        return None
+    # Nearest rank
+    index = min(len(values) - 1, max(0, math.ceil(percent / 100 * len(values)) - 1))
+    return values[index]
+
+
+def connections(stats_url: str) -> int:
+    return requests.get(stats_url.rstrip("/") + "/_fake/stats").json()["connections"]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--docker-url", default="tcp://127.0.0.1:2375",
+                        help="Address of fake_docker.py, or ssh:// address of fake_ssh.py")
+    parser.add_argument("--stats-url", help="HTTP address of fake_docker.py, if --docker-url is not its tcp:// address")
+    parser.add_argument("--pool-size", type=int, default=DEFAULT_POOL_SIZE,
+                        help="Connections the client keeps open")
+    parser.add_argument("--threads", type=int, default=24, help="Threads calling Docker at once")
+    parser.add_argument("--containers", type=int, default=20, help="Containers started and killed per thread")
+    parser.add_argument("--image", default="fake/challenge:latest")
+    parser.add_argument("--sdk-pools", action="store_true",
+                        help="Keep the SDK's pool per request URL over sockets and SSH, as before the plugin shared one")
+    args = parser.parse_args()
+
+    stats_url = args.stats_url or args.docker_url.replace("tcp://", "http://")
+
+    client = docker.DockerClient(base_url=args.docker_url, max_pool_size=args.pool_size)
+    if urllib.parse.urlparse(args.docker_url).scheme == "tcp":
+        # The SDK ignores max_pool_size for TCP, so size the pool the way the plugin's DockerHost.configure_transport
+        # does
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=args.pool_size)
+        client.api.mount("http://", adapter)
+        client.api.mount("https://", adapter)
+    elif not args.sdk_pools:
+        # One pool for every call, as the plugin sets it up
+        adapter = client.api.get_adapter(client.api.base_url)
+        get_connection = adapter.get_connection
+        adapter.get_connection = lambda url, proxies=None: get_connection(client.api.base_url, proxies)
+    client.ping()
+    opened_before = connections(stats_url)
+
+    lock = threading.Lock()
+    latencies: "dict[str, list[float]]" = {"run": [], "kill": []}
+    errors = 0
+
+    def worker(_) -> None:
+        nonlocal errors
+        for _ in range(args.containers):
+            try:
+                start = time.perf_counter()
+                container = client.containers.run(
+                    args.image, detach=True, ports={"80/tcp": None}, remove=True,
+                    labels={"ctfd.containers.benchmark": "transport"})
+                ran = time.perf_counter()
+                container.kill()
+                killed = time.perf_counter()
+            except docker.errors.APIError:
+                with lock:
+                    errors += 1
+                continue
+            with lock:
+                latencies["run"].append(ran - start)
+                latencies["kill"].append(killed - ran)
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        list(executor.map(worker, range(args.threads)))
+    seconds = time.time() - start
+
+    calls = sum(len(values) for values in latencies.values())
+    print(f"pool size {args.pool_size}, {args.threads} threads: {calls} calls in {seconds:.1f}s "
+          f"({calls / seconds:.1f} calls/s), {errors} errors, "
+          f"{connections(stats_url) - opened_before} connections opened")
+    print(f"{'call':<8}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}")
+    for call, values in latencies.items():
+        values.sort()
+
+        def ms(value):
+            return "-" if value is None else f"{value * 1000:.0f}ms"
+        print(f"{call:<8}{ms(percentile(values, 50)):>10}{ms(percentile(values, 90)):>10}"
+              f"{ms(percentile(values, 99)):>10}{ms(values[-1] if values else None):>10}")
+
+    client.close()
+    return 1 if errors > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
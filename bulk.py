@@ -0,0 +1,173 @@
+import time
+import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask
+
+from CTFd.models import db
+from .models import ContainerInfoModel, ContainerBulkJobModel
+from .events import publish_events, RENEWED, KILLED
+
+
+class BulkOperations:
+    """
+    Admin operations over many containers at once: purge, kill by challenge, kill by team and renew all.
+
+    Each operation runs as a background job. Docker kills fan out over a bounded thread pool, rows are deleted in
+    batches, and progress and per-container failures are written to ContainerBulkJobModel for the dashboard to poll.
+    Rows whose kill failed are kept so the container isn't forgotten while it may still be running.
+    """
+
+    OPERATIONS = ("purge", "kill_challenge", "kill_team", "renew_all")
+
+    # Number of concurrent Docker kill calls
+    MAX_WORKERS = 16
+    # Containers killed and deleted per batch; progress is saved after every batch
+    BATCH_SIZE = 100
+    # Failures kept on the job for display
+    MAX_REPORTED_ERRORS = 100
+
+    def __init__(self, container_manager, app: Flask) -> None:
+        self.container_manager = container_manager
+        self.app = app
+        # Jobs run one at a time; each one fans out over its own kill pool
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="container-bulk")
+
+    def submit(self, operation: str, target: "int|None" = None) -> ContainerBulkJobModel:
+        from .container_manager import ContainerException
+
+        if operation not in self.OPERATIONS:
+            raise ContainerException(f"Unknown operation {operation}")
+        if operation in ("kill_challenge", "kill_team") and target is None:
+            raise ContainerException(f"{operation} needs a target id")
+
+        now = int(time.time())
+        job = ContainerBulkJobModel(
+            id=uuid.uuid4().hex,
+            operation=operation,
+            target=target,
+            status="queued",
+            total=0,
+            done=0,
+            failed=0,
+            errors="[]",
+            created=now,
+            updated=now,
+        )
+        db.session.add(job)
+        db.session.commit()
+
+        self.executor.submit(self.run, job.id)
+        return job
+
+    def run(self, job_id: str) -> None:
+        with self.app.app_context():
+            job: ContainerBulkJobModel = ContainerBulkJobModel.query.filter_by(
+                id=job_id).first()
+            if job is None:
+                return
+
+            job.status = "running"
+            self.save(job)
+
+            try:
+                if job.operation == "renew_all":
+                    self.renew_all(job)
+                else:
+                    self.kill_matching(job)
+            except Exception as err:
+                print("[Container Bulk] Job failed:", err)
+                db.session.rollback()
+                job.status = "failed"
+                self.save(job)
+                return
+
+            job.status = "done"
+            self.save(job)
+
+    def query(self, job: ContainerBulkJobModel):
+        containers = ContainerInfoModel.query
+        if job.operation == "kill_challenge":
+            containers = containers.filter_by(challenge_id=job.target)
+        elif job.operation == "kill_team":
+            containers = containers.filter_by(team_id=job.target)
+        return containers
+
+    def renew_all(self, job: ContainerBulkJobModel) -> None:
+        expires = int(time.time() + self.container_manager.expiration_seconds)
+        publish_events([(team_id, challenge_id, RENEWED, {"expires": expires}) for team_id, challenge_id in
+                        self.query(job).with_entities(ContainerInfoModel.team_id, ContainerInfoModel.challenge_id)])
+        job.total = self.query(job).update(
+            {"expires": expires}, synchronize_session=False)
+        job.done = job.total
+        db.session.commit()
+
+    def kill_matching(self, job: ContainerBulkJobModel) -> None:
+        rows: "list[ContainerInfoModel]" = self.query(job).all()
+        targets = [(row.container_id, row.host) for row in rows]
+        # Container id -> (team, challenge), for telling the teams
+        owners = {row.container_id: (row.team_id, row.challenge_id)
+                  for row in rows}
+        job.total = len(targets)
+        self.save(job)
+
+        errors = []
+        with ThreadPoolExecutor(max_workers=self.MAX_WORKERS) as executor:
+            for i in range(0, len(targets), self.BATCH_SIZE):
+                batch = targets[i:i + self.BATCH_SIZE]
+                results = list(executor.map(lambda target: self.kill(*target), batch))
+
+                killed = [container_id for (container_id, _), error in zip(
+                    batch, results) if error is None]
+                for (container_id, _), error in zip(batch, results):
+                    if error is not None and len(errors) < self.MAX_REPORTED_ERRORS:
+                        errors.append(
+                            {"container_id": container_id, "error": error})
+
+                if len(killed) > 0:
+                    ContainerInfoModel.query.filter(
+                        ContainerInfoModel.container_id.in_(killed)
+                    ).delete(synchronize_session=False)
+                    publish_events([(*owners[container_id], KILLED, {"reason": "Your container was stopped by an admin."})
+                                    for container_id in killed])
+                    db.session.commit()
+                    self.container_manager.release_ports(killed)
+
+                job.done += len(killed)
+                job.failed += len(batch) - len(killed)
+                job.errors = json.dumps(errors)
+                self.save(job)
+
+    def kill(self, container_id: str, host: "str|None") -> "str|None":
+        """Kill one container and return the error message, if any"""
+        from .container_manager import ContainerException
+
+        try:
+            self.container_manager.kill_container(container_id, host)
+        except ContainerException as err:
+            return str(err)
+        except Exception as err:
+            return str(err) or "Unknown error"
+        return None
+
+    def save(self, job: ContainerBulkJobModel) -> None:
+        job.updated = int(time.time())
+        db.session.commit()
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False)
+
+
+def bulk_job_to_dict(job: ContainerBulkJobModel) -> dict:
+    return {
+        "job_id": job.id,
+        "operation": job.operation,
+        "target": job.target,
+        "status": job.status,
+        "total": job.total,
+        "done": job.done,
+        "failed": job.failed,
+        "errors": json.loads(job.errors or "[]"),
+    }
@@ -1,16 +1,33 @@
+import os
 import atexit
 import time
+import socket
+import threading
 import json
+import hashlib
+import functools
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 
-from flask import Flask
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.schedulers import SchedulerNotRunningError
 import docker
 import paramiko.ssh_exception
 import requests
 
-from CTFd.models import db
-from .models import ContainerInfoModel
+from .reaper import ExpiryReaper
+from .warm_pool import WarmPool
+from .shared import SharedReplicas
+from .leader import LeaderLease
+from .state_cache import ContainerStateCache
+from .health import CircuitBreaker, HealthMonitor
+from .images import ImageCatalogue
+from .ports import PortAllocator, parse_port_range
+from .scoring import SolveRecount
+from .idle import IdleMonitor
+from .reconciler import OrphanReconciler
+from .events import ExpiryWarnings
+from .metrics import DOCKER_CALL_SECONDS
 
 
 class ContainerException(Exception):
@@ -28,39 +45,195 @@ class ContainerException(Exception):
             return "Unknown Container Exception"
 
 
-class ContainerManager:
-    def __init__(self, settings, app):
-        self.settings = settings
-        self.client = None
-        self.app = app
+class PortInUseException(ContainerException):
+    """The requested host port is taken by something outside the plugin"""
+    pass
+
+
+# Labels attached to every container the plugin starts, so they can be found with a single filtered list call
+LABEL_INSTANCE = "ctfd.containers.instance"
+LABEL_CHALLENGE = "ctfd.containers.challenge"
+LABEL_TEAM = "ctfd.containers.team"
+# Image, command, volumes and host port a standby container was created with, so an outdated standby is never started
+LABEL_SPEC = "ctfd.containers.spec"
+
+# Name of the host built from docker_base_url when no docker_hosts list is configured
+DEFAULT_HOST = "default"
+
+
+def run_command(func):
+    """
+    Run a Docker call through the host's circuit breaker.
+
+    The daemon's health is tracked by the background health monitor, so calls are not preceded by a ping. While
+    the circuit is open calls fail immediately; connection errors count towards opening it.
+    """
+    @functools.wraps(func)
+    def wrapper_run_command(self, *args, **kwargs):
+        if self.client is None or self.breaker is None:
+            if self.connecting:
+                raise ContainerException(
+                    "Docker is still connecting, please try again shortly.")
+            raise ContainerException("Docker is not connected")
+        if not self.breaker.allow_request():
+            DOCKER_CALL_SECONDS.observe(
+                0, host=self.name, call=func.__name__, outcome="rejected")
+            raise ContainerException(
+                "Docker connection was lost. Please try your request again later.")
+        with DOCKER_CALL_SECONDS.time(host=self.name, call=func.__name__) as timer:
+            try:
+                result = func(self, *args, **kwargs)
+            except (paramiko.ssh_exception.SSHException, ConnectionError, requests.exceptions.ConnectionError) as e:
+                self.breaker.record_failure()
+                timer.labels["outcome"] = "disconnected"
+                raise ContainerException(
+                    "Docker connection was lost. Please try your request again later.")
+            timer.labels["outcome"] = "ok"
+        self.breaker.record_success()
+        return result
+    return wrapper_run_command
+
+
+def parse_hosts(settings) -> "list[dict]":
+    """
+    Read the configured Docker backends.
+
+    docker_hosts is a JSON list of objects with a base_url and optionally a name, hostname (shown to players),
+    max_containers, max_cpu (cores), max_memory (MB) and pool_size (connections kept open). Without it, a single host is built from docker_base_url and
+    docker_hostname.
+    """
+    raw = settings.get("docker_hosts")
+    if raw is None or raw.strip() == "":
         if settings.get("docker_base_url") is None or settings.get("docker_base_url") == "":
-            return
+            return []
+        return [{
+            "name": DEFAULT_HOST,
+            "base_url": settings.get("docker_base_url"),
+            "hostname": settings.get("docker_hostname", ""),
+        }]
 
-        # Connect to the docker daemon
-        try:
-            self.initialize_connection(settings, app)
-        except ContainerException:
-            print("Docker could not initialize or connect.")
-            return
+    try:
+        hosts = json.loads(raw)
+    except json.decoder.JSONDecodeError:
+        raise ContainerException("Docker hosts JSON string is invalid")
 
-    def initialize_connection(self, settings, app) -> None:
-        self.settings = settings
-        self.app = app
+    if not isinstance(hosts, list):
+        raise ContainerException("Docker hosts must be a JSON list")
+
+    names = set()
+    for i, host in enumerate(hosts):
+        if not isinstance(host, dict) or not host.get("base_url"):
+            raise ContainerException(
+                "Every Docker host needs a base_url")
+        host.setdefault("name", f"host{i + 1}")
+        if host["name"] in names:
+            raise ContainerException(
+                f"Docker host name {host['name']} is used more than once")
+        names.add(host["name"])
+
+    return hosts
+
+
+def container_spec(image: str, command: str, volumes: str, host_port: int) -> str:
+    """Short hash of what a container is started from and the host port it binds, for LABEL_SPEC"""
+    return hashlib.sha256(json.dumps([image, command or "", volumes or "", int(host_port)]).encode()).hexdigest()[:16]
+
+
+def parse_hosts_or_empty(settings) -> "list[dict]":
+    try:
+        return parse_hosts(settings)
+    except ContainerException as err:
+        print("Docker hosts are misconfigured:", err)
+        return []
+
+
+class DockerHost:
+    """A single Docker daemon, with its own client, health monitor, circuit breaker and state cache"""
+
+    # Number of container ids per filtered list call when looking up containers started without labels
+    ID_FILTER_CHUNK_SIZE = 100
+    # Connections kept open to the daemon and shared by every thread. Calls beyond this many at once open a connection
+    # that is closed afterwards, which over SSH means a new channel and a new "docker system dial-stdio" each time.
+    DEFAULT_POOL_SIZE = 32
+    # Keeps an idle SSH tunnel from being dropped by firewalls and NAT, so pooled connections stay usable
+    SSH_KEEPALIVE_SECONDS = 30
+    # How long a remote daemon's address may take to accept a connection. The SSH transport has no timeout of its own,
+    # so an unreachable host would otherwise hold the connecting thread until the OS gives up.
+    CONNECT_TIMEOUT_SECONDS = 10
 
-        # Remove any leftover expiration schedulers
+    def __init__(self, name: str, base_url: str, hostname: str, instance_id: str,
+                 max_containers: "int|None" = None, max_cpu: "float|None" = None,
+                 max_memory: "int|None" = None, pool_size: "int|None" = None) -> None:
+        self.name = name
+        self.base_url = base_url
+        self.hostname = hostname or ""
+        self.instance_id = instance_id
+        self.max_containers = max_containers
+        self.max_cpu = max_cpu
+        self.max_memory = max_memory
+        self.pool_size = pool_size or self.DEFAULT_POOL_SIZE
+
+        self.client = None
+        self.state_cache = None
+        self.breaker = CircuitBreaker()
+        self.health_monitor = HealthMonitor(self, self.breaker)
+
+        # True until the first connection attempt has finished, whether it worked or not
+        self.connecting = True
+        self.connection_error: "ContainerException|None" = None
+        self.connect_attempted = threading.Event()
+
+    def start(self) -> None:
+        """Start monitoring. The health monitor's thread makes the first connection, so this never waits on Docker."""
+        self.health_monitor.start()
+
+    def connect(self) -> None:
+        """First connection to the daemon. A failed connection opens the circuit and is retried by the health monitor."""
+        started = time.perf_counter()
         try:
-            self.expiration_scheduler.shutdown()
-        except (SchedulerNotRunningError, AttributeError):
-            # Scheduler was never running
-            pass
+            self.connect_client()
+        except ContainerException as err:
+            self.breaker.trip()
+            self.connection_error = err
+            print(
+                f"[Container Startup] Could not connect to Docker host {self.name} after {time.perf_counter() - started:.2f}s:", err)
+        else:
+            print(
+                f"[Container Startup] Connected to Docker host {self.name} in {time.perf_counter() - started:.2f}s")
+            if self.health_monitor.stopped.is_set():
+                # The host was replaced while connecting, e.g. by a settings reload, so close the new client
+                self.stop()
+        finally:
+            self.connecting = False
+            self.connect_attempted.set()
+
+    def wait_connected(self, timeout: float) -> "ContainerException|None":
+        """Wait for the first connection attempt. Returns its error, if any."""
+        if not self.connect_attempted.wait(timeout):
+            return ContainerException("CTFd timed out when connecting to Docker")
+        return self.connection_error
 
-        if settings.get("docker_base_url") is None:
+    def stop(self) -> None:
+        self.health_monitor.stop()
+        self.stop_state_cache()
+        if self.client is not None:
+            try:
+                self.client.close()
+            except Exception:
+                pass
+
+    def connect_client(self) -> None:
+        """(Re)create the Docker client and the event watcher that depends on it"""
+        try:
+            self.check_reachable()
+        except OSError as e:
             self.client = None
-            return
+            raise ContainerException(
+                "CTFd could not reach Docker within the connect timeout: " + str(e))
 
         try:
-            self.client = docker.DockerClient(
-                base_url=settings.get("docker_base_url"))
+            client = docker.DockerClient(
+                base_url=self.base_url, max_pool_size=self.pool_size)
         except (docker.errors.DockerException) as e:
             self.client = None
             raise ContainerException("CTFd could not connect to Docker")
@@ -77,119 +250,251 @@ class ContainerManager:
             raise ContainerException(
                 "CTFd had an authentication error when connecting to Docker: " + str(e))
 
-        # Set up expiration scheduler
+        self.configure_transport(client)
+
+        # The event watcher holds the old client, so stop it before closing that client
+        self.stop_state_cache()
+        old_client = self.client
+        self.client = client
+        if old_client is not None:
+            try:
+                old_client.close()
+            except Exception:
+                pass
+
+        self.state_cache = ContainerStateCache(
+            self.client, f"{LABEL_INSTANCE}={self.instance_id}")
+        self.state_cache.start()
+
+    def configure_transport(self, client: docker.DockerClient) -> None:
+        """
+        Size the connection pool of TCP clients, share one pool between all calls over sockets and SSH, and turn on
+        keepalives for an SSH client's tunnel.
+
+        The SDK only applies max_pool_size to socket and SSH transports, so TCP clients get an adapter of that size
+        here. The socket and SSH adapters keep a separate pool per request URL, i.e. per container, and close the least
+        recently used beyond 25, so nearly every call about a new container opened a new connection. Their pool is
+        keyed by the base URL instead. Over SSH every pooled connection is a channel of the same SSH connection, so one
+        handshake serves all threads and concurrent calls each get their own channel.
+        """
+        scheme = urllib.parse.urlparse(self.base_url).scheme
+        if scheme in ("tcp", "http", "https"):
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=self.pool_size)
+            client.api.mount("http://", adapter)
+            client.api.mount("https://", adapter)
+            return
+
+        adapter = client.api.get_adapter(client.api.base_url)
+        if hasattr(adapter, "pools"):
+            get_connection = adapter.get_connection
+            base_url = client.api.base_url
+            adapter.get_connection = lambda url, proxies=None: get_connection(
+                base_url, proxies)
+
+        if scheme != "ssh":
+            return
         try:
-            self.expiration_seconds = int(
-                settings.get("container_expiration", 0)) * 60
-        except (ValueError, AttributeError):
-            self.expiration_seconds = 0
+            adapter.ssh_client.get_transport().set_keepalive(self.SSH_KEEPALIVE_SECONDS)
+        except AttributeError:
+            # The ssh binary transport uses the keepalive options of the SSH config instead
+            pass
 
-        EXPIRATION_CHECK_INTERVAL = 5
+    def check_reachable(self) -> None:
+        """Open and close a TCP connection to a remote daemon's address, giving up after the connect timeout"""
+        url = urllib.parse.urlparse(self.base_url)
+        if url.scheme not in ("ssh", "tcp", "http", "https") or not url.hostname:
+            # Local sockets fail right away when the daemon is down
+            return
 
-        if self.expiration_seconds > 0:
-            self.expiration_scheduler = BackgroundScheduler()
-            self.expiration_scheduler.add_job(
-                func=self.kill_expired_containers, args=(app,), trigger="interval", seconds=EXPIRATION_CHECK_INTERVAL)
-            self.expiration_scheduler.start()
-
-            # Shut down the scheduler when exiting the app
-            atexit.register(lambda: self.expiration_scheduler.shutdown())
-
-    # TODO: Fix this cause it doesn't work
-    def run_command(func):
-        def wrapper_run_command(self, *args, **kwargs):
-            if self.client is None:
-                try:
-                    self.__init__(self.settings, self.app)
-                except:
-                    raise ContainerException("Docker is not connected")
-            try:
-                if self.client is None:
-                    raise ContainerException("Docker is not connected")
-                if self.client.ping():
-                    return func(self, *args, **kwargs)
-            except (paramiko.ssh_exception.SSHException, ConnectionError, requests.exceptions.ConnectionError) as e:
-                # Try to reconnect before failing
-                try:
-                    self.__init__(self.settings, self.app)
-                except:
-                    pass
-                raise ContainerException(
-                    "Docker connection was lost. Please try your request again later.")
-        return wrapper_run_command
+        hostname = url.hostname
+        port = url.port
+        if url.scheme == "ssh":
+            # Docker resolves SSH host aliases the same way
+            config_path = os.path.expanduser("~/.ssh/config")
+            if os.path.exists(config_path):
+                host_config = paramiko.SSHConfig.from_path(
+                    config_path).lookup(hostname)
+                if "proxycommand" in host_config or "proxyjump" in host_config:
+                    # The daemon's address may only be reachable through the proxy
+                    return
+                hostname = host_config.get("hostname", hostname)
+                if port is None and "port" in host_config:
+                    port = int(host_config["port"])
+            port = port or 22
+        elif port is None:
+            port = 2376 if url.scheme == "https" else 2375
 
-    @run_command
-    def kill_expired_containers(self, app: Flask):
-        with app.app_context():
-            containers: "list[ContainerInfoModel]" = ContainerInfoModel.query.all()
-
-            for container in containers:
-                delta_seconds = container.expires - int(time.time())
-                if delta_seconds < 0:
-                    try:
-                        self.kill_container(container.container_id)
-                    except ContainerException:
-                        print(
-                            "[Container Expiry Job] Docker is not initialized. Please check your settings.")
-
-                    db.session.delete(container)
-                    db.session.commit()
+        socket.create_connection(
+            (hostname, port), timeout=self.CONNECT_TIMEOUT_SECONDS).close()
+
+    def stop_state_cache(self) -> None:
+        try:
+            self.state_cache.stop()
+        except AttributeError:
+            pass
+        self.state_cache = None
+
+    def is_connected(self) -> bool:
+        """Cached result of the health monitor's last ping"""
+        return self.health_monitor.healthy
+
+    def circuit_state(self) -> str:
+        return self.breaker.state
+
+    def running_count(self) -> "int|None":
+        """Number of plugin containers running on this host, or None if the state cache isn't ready"""
+        state_cache = self.state_cache
+        if state_cache is None or not state_cache.ready:
+            return None
+        return sum(1 for state in state_cache.snapshot().values() if state == "running")
+
+    def cached_state(self, container_id: str) -> "str|None":
+        state_cache = self.state_cache
+        if state_cache is None or not state_cache.ready:
+            return None
+        return state_cache.get_state(container_id)
 
-    @run_command
     def is_container_running(self, container_id: str) -> bool:
+        state = self.cached_state(container_id)
+        if state is not None:
+            return state == "running"
+        return self.query_container_running(container_id)
+
+    @run_command
+    def query_container_running(self, container_id: str) -> bool:
         container = self.client.containers.list(filters={"id": container_id})
         if len(container) == 0:
             return False
         return container[0].status == "running"
 
     @run_command
-    def create_container(self, image: str, port: int, command: str, volumes: str):
-        kwargs = {}
+    def get_container_states(self, container_ids: "list[str]|None" = None) -> "dict[str, str]":
+        state_cache = self.state_cache
+        if state_cache is not None and state_cache.ready:
+            states = state_cache.snapshot()
+        else:
+            # sparse avoids an inspect call per container
+            containers = self.client.containers.list(
+                all=True, sparse=True, filters={"label": f"{LABEL_INSTANCE}={self.instance_id}"})
+            states = {container.id: container.status for container in containers}
 
-        # Set the memory and CPU limits for the container
-        if self.settings.get("container_maxmemory"):
-            try:
-                mem_limit = int(self.settings.get("container_maxmemory"))
-                if mem_limit > 0:
-                    kwargs["mem_limit"] = f"{mem_limit}m"
-            except ValueError:
-                ContainerException(
-                    "Configured container memory limit must be an integer")
-        if self.settings.get("container_maxcpu"):
-            try:
-                cpu_period = float(self.settings.get("container_maxcpu"))
-                if cpu_period > 0:
-                    kwargs["cpu_quota"] = int(cpu_period * 100000)
-                    kwargs["cpu_period"] = 100000
-            except ValueError:
-                ContainerException(
-                    "Configured container CPU limit must be a number")
+        missing = [container_id for container_id in (
+            container_ids or []) if container_id not in states]
+        for i in range(0, len(missing), self.ID_FILTER_CHUNK_SIZE):
+            containers = self.client.containers.list(
+                all=True, sparse=True, filters={"id": missing[i:i + self.ID_FILTER_CHUNK_SIZE]})
+            states.update(
+                {container.id: container.status for container in containers})
 
-        if volumes is not None and volumes != "":
-            print("Volumes:", volumes)
-            try:
-                volumes_dict = json.loads(volumes)
-                kwargs["volumes"] = volumes_dict
-            except json.decoder.JSONDecodeError:
-                raise ContainerException("Volumes JSON string is invalid")
+        return states
+
+    @run_command
+    def list_containers(self, container_ids: "list[str]|None" = None) -> "dict[str, tuple[str, int]]":
+        """
+        Ask the daemon for every container started by this plugin, bypassing the state cache.
+
+        :param container_ids: Containers that must be looked up even if they were started before containers were
+        labelled
+        :return: Dictionary of container id to (Docker state, creation time)
+        """
+        containers = self.client.containers.list(
+            all=True, sparse=True, filters={"label": f"{LABEL_INSTANCE}={self.instance_id}"})
 
+        missing = list(set(container_ids or []) -
+                       {container.id for container in containers})
+        for i in range(0, len(missing), self.ID_FILTER_CHUNK_SIZE):
+            containers.extend(self.client.containers.list(
+                all=True, sparse=True, filters={"id": missing[i:i + self.ID_FILTER_CHUNK_SIZE]}))
+
+        return {container.id: (container.status, container.attrs.get("Created") or 0) for container in containers}
+
+    @run_command
+    def create_container(self, image: str, port: int, command: str, labels: "dict[str, str]",
+                         host_port: "int|None" = None, **kwargs):
         try:
-            return self.client.containers.run(
+            container = self.client.containers.run(
                 image,
-                ports={str(port): None},
+                ports={str(port): host_port},
                 command=command,
                 detach=True,
                 auto_remove=True,
+                labels=labels,
+                **kwargs
+            )
+        except docker.errors.ImageNotFound:
+            raise ContainerException("Docker image not found")
+        except docker.errors.APIError as err:
+            if host_port is not None and ("port is already allocated" in str(err) or
+                                          "address already in use" in str(err)):
+                raise PortInUseException(
+                    f"Port {host_port} is already in use")
+            raise
+
+        if self.state_cache is not None:
+            self.state_cache.set(container.id, state="running",
+                                 port=None if host_port is None else str(host_port))
+        return container
+
+    @run_command
+    def prepare_container(self, image: str, port: int, command: str, labels: "dict[str, str]",
+                          host_port: int, **kwargs) -> str:
+        """
+        Create a container without starting it. Docker only binds the host port on start, so this works while another
+        container holds the port.
+
+        :return: Id of the created container
+        """
+        try:
+            container = self.client.containers.create(
+                image,
+                ports={str(port): host_port},
+                command=command,
+                auto_remove=True,
+                labels=labels,
                 **kwargs
             )
         except docker.errors.ImageNotFound:
             raise ContainerException("Docker image not found")
+        return container.id
 
     @run_command
+    def start_prepared_container(self, container_id: str, spec: str, host_port: int) -> None:
+        """Start a container made by prepare_container, if it was created with the given spec label"""
+        try:
+            labels = self.client.api.inspect_container(
+                container_id)["Config"]["Labels"] or {}
+        except docker.errors.NotFound:
+            raise ContainerException("Container not found")
+        if labels.get(LABEL_SPEC) != spec:
+            raise ContainerException("Container is outdated")
+
+        try:
+            self.client.api.start(container_id)
+        except docker.errors.APIError as err:
+            if "port is already allocated" in str(err) or "address already in use" in str(err):
+                raise PortInUseException(
+                    f"Port {host_port} is already in use")
+            raise
+
+        if self.state_cache is not None:
+            self.state_cache.set(container_id, state="running", port=str(host_port))
+
     def get_container_port(self, container_id: str) -> "str|None":
+        if self.state_cache is not None:
+            port = self.state_cache.get_port(container_id)
+            if port is not None:
+                return port
+        return self.query_container_port(container_id)
+
+    @run_command
+    def query_container_port(self, container_id: str) -> "str|None":
         try:
             for port in list(self.client.containers.get(container_id).ports.values()):
                 if port is not None:
+                    if self.state_cache is not None:
+                        self.state_cache.set(
+                            container_id, port=port[0]["HostPort"])
                     return port[0]["HostPort"]
         except (KeyError, IndexError):
             return None
@@ -206,9 +511,79 @@ class ContainerManager:
             if len(image.tags) > 0:
                 images_list.append(image.tags[0])
 
-        images_list.sort()
         return images_list
 
+    @run_command
+    def has_image(self, image: str) -> bool:
+        try:
+            self.client.images.get(image)
+        except docker.errors.ImageNotFound:
+            return False
+        return True
+
+    @run_command
+    def pull_image(self, image: str, progress_callback=None) -> None:
+        """Pull an image, reporting the fraction of bytes downloaded over all layers"""
+        repository, tag = docker.utils.parse_repository_tag(image)
+        layers: "dict[str, tuple[int, int]]" = {}
+        try:
+            for line in self.client.api.pull(repository, tag=tag or "latest", stream=True, decode=True):
+                if "error" in line:
+                    raise ContainerException(
+                        f"Could not pull {image}: {line['error']}")
+
+                detail = line.get("progressDetail") or {}
+                if line.get("id") and detail.get("total"):
+                    layers[line["id"]] = (
+                        detail.get("current", 0), detail["total"])
+                    if progress_callback is not None:
+                        current = sum(c for c, _ in layers.values())
+                        total = sum(t for _, t in layers.values())
+                        progress_callback(current / total)
+        except (docker.errors.NotFound, docker.errors.APIError) as err:
+            raise ContainerException(f"Could not pull {image}: {err}")
+
+    @run_command
+    def get_container_activity(self, container_id: str) -> "tuple[int, int]|None":
+        """
+        Read a container's cumulative counters from the stats API.
+
+        :return: (CPU time in nanoseconds, network bytes received and sent), or None if the container is gone
+        """
+        try:
+            # one_shot skips the second sample Docker otherwise waits for to compute CPU percentages
+            stats = self.client.api.stats(
+                container_id, stream=False, one_shot=True)
+        except docker.errors.NotFound:
+            return None
+
+        cpu = (stats.get("cpu_stats") or {}).get(
+            "cpu_usage", {}).get("total_usage", 0)
+        network = sum(interface.get("rx_bytes", 0) + interface.get("tx_bytes", 0)
+                      for interface in (stats.get("networks") or {}).values())
+        return cpu, network
+
+    @run_command
+    def remove_container(self, container_id: str) -> None:
+        """Kill and remove a container whatever its state, e.g. one that was created but never started"""
+        try:
+            self.client.api.remove_container(container_id, force=True)
+        except docker.errors.NotFound:
+            pass
+
+        if self.state_cache is not None:
+            self.state_cache.set(container_id, state="removed")
+
+    @run_command
+    def restart_container(self, container_id: str) -> None:
+        try:
+            self.client.containers.get(container_id).restart(timeout=0)
+        except docker.errors.NotFound:
+            raise ContainerException("Container not found")
+
+        if self.state_cache is not None:
+            self.state_cache.set(container_id, state="running")
+
     @run_command
     def kill_container(self, container_id: str):
         try:
@@ -216,9 +591,613 @@ class ContainerManager:
         except docker.errors.NotFound:
             pass
 
-    def is_connected(self) -> bool:
+        if self.state_cache is not None:
+            self.state_cache.set(container_id, state="exited")
+
+
+class ContainerManager:
+    # Number of hosts contacted at once for calls that fan out to every host
+    MAX_HOST_WORKERS = 16
+    # Ports tried before giving up when ports in the range are taken by other processes
+    PORT_ATTEMPTS = 5
+    # Concurrent stats calls per host while sampling container activity
+    STATS_WORKERS_PER_HOST = 8
+    # A recreated container waits for the killed one to free its port, checking this often up to this many times
+    RECREATE_RETRY_SECONDS = 0.05
+    RECREATE_ATTEMPTS = 40
+
+    def __init__(self, settings, app):
+        self.settings = settings
+        self.app = app
+        # Held while settings are swapped and the hosts reconnected
+        self.settings_lock = threading.Lock()
+        self.hosts: "dict[str, DockerHost]" = {}
+        self.leader = None
+        self.reaper = None
+        self.warm_pool = None
+        self.shared = None
+        self.reconciler = None
+        self.images = None
+        self.ports = None
+        self.expiration_seconds = 0
+
+        # Shut down whichever scheduler is running when exiting the app. Registered once, since settings reloads
+        # replace the scheduler.
+        atexit.register(self.shutdown_scheduler)
+
+        if len(parse_hosts_or_empty(settings)) == 0:
+            return
+
+        # The hosts connect in the background, so startup doesn't wait on the docker daemons
         try:
-            self.client.ping()
-        except:
-            return False
-        return True
+            self.initialize_connection(settings, app)
+        except ContainerException as err:
+            print("Docker could not initialize:", err)
+            return
+
+    def initialize_connection(self, settings, app) -> None:
+        """Set up the hosts and maintenance jobs. Connection errors are not raised, see wait_for_hosts."""
+        self.settings = settings
+        self.app = app
+
+        self.disconnect()
+
+        host_configs = parse_hosts(settings)
+        if len(host_configs) == 0:
+            return
+
+        # Set up expiration scheduler
+        self.expiration_seconds = max(
+            0, settings.value("container_expiration", 0)) * 60
+
+        for config in host_configs:
+            self.hosts[config["name"]] = DockerHost(
+                name=config["name"],
+                base_url=config["base_url"],
+                hostname=config.get("hostname", ""),
+                instance_id=self.instance_id,
+                max_containers=config.get("max_containers"),
+                max_cpu=config.get("max_cpu"),
+                max_memory=config.get("max_memory"),
+                pool_size=config.get("pool_size") or settings.value(
+                    "docker_pool_size"),
+            )
+
+        # Every host connects on its own health monitor thread, so one slow host doesn't hold up the others
+        for host in self.hosts.values():
+            host.start()
+
+        self.scheduler = BackgroundScheduler()
+        self.scheduler.start()
+
+        # Every process keeps its own scheduler, but only the lease holder runs the maintenance jobs
+        self.leader = LeaderLease(app, self.scheduler, self.on_leader_acquired)
+        self.leader.start()
+
+        self.reaper = None
+        if self.expiration_seconds > 0:
+            self.reaper = ExpiryReaper(self, app, self.scheduler)
+            self.reaper.start()
+
+        self.warm_pool = WarmPool(self, app, self.scheduler)
+        self.warm_pool.start()
+
+        self.shared = SharedReplicas(self, app, self.scheduler)
+        self.shared.start()
+
+        # Also pulls every challenge's image onto every host
+        self.images = ImageCatalogue(self, app, self.scheduler)
+        self.images.start()
+
+        # Corrects drift in the per-challenge solve counters
+        SolveRecount(self, app, self.scheduler).start()
+
+        # Stops team containers nobody has used for a while, if container_idle_minutes is set
+        IdleMonitor(self, app, self.scheduler).start()
+
+        # Tells teams a few minutes before their container expires
+        ExpiryWarnings(self, app, self.scheduler).start()
+
+        # Cleans up containers and rows that got out of step, e.g. after a failed kill
+        self.reconciler = OrphanReconciler(self, app, self.scheduler)
+        self.reconciler.start()
+
+        self.ports = None
+        port_range = parse_port_range(settings.get("container_port_range"))
+        if port_range is not None:
+            self.ports = PortAllocator(
+                port_range, app, self.scheduler, self.leader)
+            self.ports.start()
+
+    def disconnect(self) -> None:
+        """Stop the maintenance schedulers, pull workers and hosts, and forget the jobs"""
+        self.shutdown_scheduler()
+        if self.images is not None:
+            self.images.stop()
+            self.images = None
+        self.stop_hosts()
+
+        self.reaper = None
+        self.warm_pool = None
+        self.shared = None
+        self.reconciler = None
+        self.ports = None
+
+    def wait_for_hosts(self) -> "ContainerException|None":
+        """Wait for every host's first connection attempt, which is bounded by the connect timeout"""
+        # The TCP check and the SSH handshake each get the timeout
+        timeout = DockerHost.CONNECT_TIMEOUT_SECONDS * 3
+        errors = self.map_hosts(lambda host: host.wait_connected(timeout))
+        failed = [f"{name}: {err}" for name,
+                  err in errors.items() if err is not None]
+        if len(failed) > 0:
+            return ContainerException("; ".join(failed))
+        return None
+
+    def reload_settings(self, settings, wait: bool = False) -> "ContainerException|None":
+        """
+        Switch to new settings and reconnect. Does nothing if these settings are already in use.
+
+        :param wait: Wait for the hosts to connect and return the connection errors, for an admin saving the settings
+        """
+        with self.settings_lock:
+            if settings.version is not None and settings.version == self.settings.version:
+                return None
+            self.settings = settings
+
+            if not settings.get("docker_base_url") and not settings.get("docker_hosts"):
+                # Docker was turned off, so the old hosts and their jobs must not keep running
+                self.disconnect()
+                return None
+            try:
+                self.initialize_connection(settings, self.app)
+            except ContainerException as err:
+                print("Docker could not initialize:", err)
+                return err
+            if not wait:
+                return None
+
+        err = self.wait_for_hosts()
+        if err is not None:
+            print("Docker could not connect:", err)
+        return err
+
+    def stop_hosts(self) -> None:
+        for host in self.hosts.values():
+            host.stop()
+        self.hosts = {}
+
+    def shutdown_scheduler(self) -> None:
+        try:
+            self.scheduler.shutdown(wait=False)
+        except (SchedulerNotRunningError, AttributeError):
+            # Scheduler was never running
+            pass
+
+        if self.leader is not None:
+            self.leader.release()
+            self.leader = None
+
+    def is_leader(self) -> bool:
+        """Whether this process currently runs the maintenance jobs"""
+        return self.leader is not None and self.leader.is_leader()
+
+    def on_leader_acquired(self) -> None:
+        # Catch up on work the previous leader may have left behind
+        if self.reaper is not None:
+            self.reaper.schedule(time.time())
+        if self.warm_pool is not None:
+            self.warm_pool.trigger()
+        if self.shared is not None:
+            self.shared.trigger()
+
+    def reconcile(self) -> dict:
+        """Diff Docker against the database now. Must be called with an app context."""
+        if self.reconciler is None:
+            raise ContainerException("Docker is not connected")
+        return self.reconciler.reconcile()
+
+    def reconcile_status(self) -> "dict|None":
+        if self.reconciler is None:
+            return None
+        return self.reconciler.last_report
+
+    def leader_status(self) -> "dict|None":
+        if self.leader is None:
+            return None
+        return self.leader.status()
+
+    def map_hosts(self, func, hosts: "list[DockerHost]|None" = None) -> dict:
+        """Call func on every host in parallel and return a dictionary of host name to result"""
+        if hosts is None:
+            hosts = list(self.hosts.values())
+        if len(hosts) == 0:
+            return {}
+        if len(hosts) == 1:
+            return {hosts[0].name: func(hosts[0])}
+
+        with ThreadPoolExecutor(max_workers=min(self.MAX_HOST_WORKERS, len(hosts))) as executor:
+            results = list(executor.map(func, hosts))
+        return {host.name: result for host, result in zip(hosts, results)}
+
+    def get_host(self, name: "str|None" = None) -> DockerHost:
+        """Look up a host by name. Rows without a host were created before multiple hosts and use the first one."""
+        if len(self.hosts) == 0:
+            raise ContainerException("Docker is not connected")
+        if name is None:
+            return next(iter(self.hosts.values()))
+        if name not in self.hosts:
+            raise ContainerException(f"Unknown Docker host {name}")
+        return self.hosts[name]
+
+    def get_hostname(self, name: "str|None" = None) -> str:
+        try:
+            return self.get_host(name).hostname
+        except ContainerException:
+            return self.settings.get("docker_hostname", "")
+
+    def container_cpu(self) -> float:
+        """CPUs reserved for each container, or 0 if unlimited"""
+        return max(0.0, self.settings.value("container_maxcpu", 0.0))
+
+    def container_memory(self) -> int:
+        """Memory in MB reserved for each container, or 0 if unlimited"""
+        return max(0, self.settings.value("container_maxmemory", 0))
+
+    def host_load(self, host: DockerHost) -> "float|None":
+        """
+        Fraction of the host's capacity in use, taking the most constrained of container count, reserved CPU and
+        reserved memory. Returns None if the host is full.
+        """
+        count = host.running_count()
+        if count is None:
+            from .models import ContainerInfoModel, ContainerPoolModel, ContainerReplicaModel
+
+            with self.app.app_context():
+                count = ContainerInfoModel.query.filter_by(host=host.name).count() + \
+                    ContainerPoolModel.query.filter_by(host=host.name).count() + \
+                    ContainerReplicaModel.query.filter_by(host=host.name).count()
+
+        loads = []
+        if host.max_containers:
+            loads.append((count + 1) / host.max_containers)
+        if host.max_cpu and self.container_cpu() > 0:
+            loads.append((count + 1) * self.container_cpu() / host.max_cpu)
+        if host.max_memory and self.container_memory() > 0:
+            loads.append((count + 1) * self.container_memory() /
+                         host.max_memory)
+
+        if len(loads) == 0:
+            # No limits configured, so spread containers by count
+            return float(count)
+        if max(loads) > 1:
+            return None
+        return max(loads)
+
+    def select_host(self) -> DockerHost:
+        """Pick the least-loaded healthy host that still has capacity for another container"""
+        healthy = [host for host in self.hosts.values()
+                   if host.client is not None and host.breaker.allow_request()]
+        if len(healthy) == 0:
+            if self.connection_status() == "connecting":
+                raise ContainerException(
+                    "Docker is still connecting, please try again shortly.")
+            raise ContainerException("Docker is not connected")
+
+        loads = self.map_hosts(self.host_load, healthy)
+        candidates = []
+        for host in healthy:
+            if loads[host.name] is not None:
+                candidates.append((loads[host.name], host.name))
+
+        if len(candidates) == 0:
+            raise ContainerException(
+                "All Docker hosts are at capacity, please try again later.")
+
+        return self.hosts[min(candidates)[1]]
+
+    def claim_warm_container(self, challenge) -> "tuple[str, str, int]|None":
+        if self.warm_pool is None:
+            return None
+        return self.warm_pool.claim(challenge)
+
+    def assign_shared(self, challenge, team_id: int, start: bool = False) -> "dict|None":
+        if self.shared is None:
+            raise ContainerException("Docker is not connected")
+        return self.shared.assign(challenge, team_id, start)
+
+    def renew_shared(self, challenge_id: int, team_id: int) -> "int|None":
+        if self.shared is None:
+            raise ContainerException("Docker is not connected")
+        return self.shared.renew(challenge_id, team_id)
+
+    def release_shared(self, challenge_id: int, team_id: int) -> bool:
+        if self.shared is None:
+            raise ContainerException("Docker is not connected")
+        return self.shared.release(challenge_id, team_id)
+
+    def notify_expiry(self, expires: int) -> None:
+        if self.reaper is not None:
+            self.reaper.notify(expires)
+
+    def reaper_lag(self) -> float:
+        if self.reaper is None:
+            return 0.0
+        return self.reaper.lag_seconds
+
+    def is_container_running(self, container_id: str, host: "str|None" = None) -> bool:
+        return self.get_host(host).is_container_running(container_id)
+
+    @property
+    def instance_id(self) -> str:
+        return self.settings.get("instance_id", "")
+
+    def container_labels(self, challenge_id: "int|None" = None, team_id: "int|None" = None) -> "dict[str, str]":
+        return {
+            LABEL_INSTANCE: self.instance_id,
+            LABEL_CHALLENGE: "" if challenge_id is None else str(challenge_id),
+            LABEL_TEAM: "" if team_id is None else str(team_id),
+        }
+
+    def get_container_states(self, containers: "list[tuple[str, str|None]]|None" = None) -> "dict[str, str]":
+        """
+        Get the state (e.g. running or exited) of every container started by this plugin, on every host.
+
+        :param containers: (container_id, host) pairs that must be looked up even if they were started before
+        containers were labelled. Containers that don't exist anymore are left out of the result.
+        :return: Dictionary of container id to Docker state
+        """
+        wanted: "dict[str, list[str]]" = {}
+        for container_id, host in containers or []:
+            try:
+                wanted.setdefault(self.get_host(host).name,
+                                  []).append(container_id)
+            except ContainerException:
+                pass
+
+        def host_states(host: DockerHost) -> "dict[str, str]":
+            try:
+                return host.get_container_states(wanted.get(host.name))
+            except ContainerException:
+                return {}
+
+        states = {}
+        for host_result in self.map_hosts(host_states).values():
+            states.update(host_result)
+        return states
+
+    def create_container(self, image: str, port: int, command: str, volumes: str,
+                         challenge_id: "int|None" = None, team_id: "int|None" = None,
+                         host: "str|None" = None) -> "tuple[str, str, str|None]":
+        """
+        Start a container on the given host, or on the least-loaded one. Must be called with an app context when a
+        port range is configured.
+
+        :return: (host name, container id, host port). The port is None if Docker didn't report one.
+        """
+        kwargs = self.container_options(volumes)
+
+        if host is not None:
+            docker_host = self.get_host(host)
+        else:
+            docker_host = self.select_host()
+
+        labels = self.container_labels(challenge_id, team_id)
+
+        if self.ports is None:
+            # Docker picks a random port, which has to be looked up afterwards
+            container = docker_host.create_container(
+                image, port, command, labels, **kwargs)
+            return docker_host.name, container.id, docker_host.get_container_port(container.id)
+
+        for _ in range(self.PORT_ATTEMPTS):
+            host_port = self.ports.allocate(docker_host.name)
+            try:
+                container = docker_host.create_container(
+                    image, port, command, labels, host_port=host_port, **kwargs)
+            except PortInUseException:
+                # Leave the reservation in place so the port isn't handed out again until the sweep clears it
+                continue
+            except Exception:
+                self.ports.release_port(docker_host.name, host_port)
+                raise
+
+            self.ports.assign(docker_host.name, host_port, container.id)
+            return docker_host.name, container.id, str(host_port)
+
+        raise ContainerException(
+            "Could not find a free port, please try again later.")
+
+    def prepare_standby(self, host: "str|None", host_port: int, image: str, port: int, command: str, volumes: str,
+                        challenge_id: "int|None" = None, team_id: "int|None" = None) -> str:
+        """
+        Create a stopped replacement for a team's container, bound to the same host port once started, so that
+        recreate_container only has to start it.
+
+        :return: Id of the standby container
+        """
+        kwargs = self.container_options(volumes)
+        labels = self.container_labels(challenge_id, team_id)
+        labels[LABEL_SPEC] = container_spec(image, command, volumes, host_port)
+        return self.get_host(host).prepare_container(
+            image, port, command, labels, host_port=host_port, **kwargs)
+
+    def recreate_container(self, container_id: str, host: "str|None", host_port: int, image: str, port: int,
+                           command: str, volumes: str, challenge_id: "int|None" = None,
+                           team_id: "int|None" = None, standby_id: "str|None" = None) -> str:
+        """
+        Replace a container with a fresh one from the same image, on the same host and host port. Starts the standby
+        made by prepare_standby if there is one, and creates a new container otherwise. Must be called with an app
+        context when a port range is configured.
+
+        :return: Id of the new container
+        """
+        docker_host = self.get_host(host)
+
+        docker_host.kill_container(container_id)
+
+        new_id = None
+        if standby_id is not None:
+            spec = container_spec(image, command, volumes, host_port)
+            try:
+                self.retry_port(lambda: docker_host.start_prepared_container(
+                    standby_id, spec, host_port))
+                new_id = standby_id
+            except Exception as err:
+                # E.g. the challenge was changed after the standby was made, or the standby was removed
+                print("[Container Reset] Could not start the standby container, creating a new one:", err)
+                try:
+                    docker_host.remove_container(standby_id)
+                except Exception:
+                    pass
+
+        if new_id is None:
+            kwargs = self.container_options(volumes)
+            labels = self.container_labels(challenge_id, team_id)
+            new_id = self.retry_port(lambda: docker_host.create_container(
+                image, port, command, labels, host_port=host_port, **kwargs).id)
+
+        # The port reservation moves over to the new container
+        if self.ports is not None:
+            self.ports.assign(docker_host.name, host_port, new_id)
+        # Make the next standby for this container
+        if standby_id is not None and self.warm_pool is not None:
+            self.warm_pool.trigger()
+        return new_id
+
+    def retry_port(self, func):
+        """Call func until it stops raising PortInUseException, which it does while a killed container exits"""
+        for _ in range(self.RECREATE_ATTEMPTS):
+            try:
+                return func()
+            except PortInUseException:
+                time.sleep(self.RECREATE_RETRY_SECONDS)
+
+        raise ContainerException(
+            "The container's port is still in use, please try again.")
+
+    def restart_container(self, container_id: str, host: "str|None" = None) -> "str|None":
+        """
+        Restart a container in place. Its files are kept.
+
+        :return: Host port after the restart. Docker keeps a port from the configured range, but may pick a new random
+        port.
+        """
+        docker_host = self.get_host(host)
+        docker_host.restart_container(container_id)
+        return docker_host.query_container_port(container_id)
+
+    def container_options(self, volumes: str) -> dict:
+        """Docker run options shared by every team container: resource limits and volumes"""
+        kwargs = {}
+
+        # Set the memory and CPU limits for the container
+        mem_limit = self.container_memory()
+        if mem_limit > 0:
+            kwargs["mem_limit"] = f"{mem_limit}m"
+        cpu_period = self.container_cpu()
+        if cpu_period > 0:
+            kwargs["cpu_quota"] = int(cpu_period * 100000)
+            kwargs["cpu_period"] = 100000
+
+        if volumes is not None and volumes != "":
+            print("Volumes:", volumes)
+            try:
+                volumes_dict = json.loads(volumes)
+                kwargs["volumes"] = volumes_dict
+            except json.decoder.JSONDecodeError:
+                raise ContainerException("Volumes JSON string is invalid")
+
+        return kwargs
+
+    def release_ports(self, container_ids: "list[str]") -> None:
+        """Return the ports of killed containers to the port range. Must be called with an app context."""
+        if self.ports is not None:
+            self.ports.release(container_ids)
+
+    def get_container_port(self, container_id: str, host: "str|None" = None) -> "str|None":
+        return self.get_host(host).get_container_port(container_id)
+
+    def get_images(self) -> "list[str]|None":
+        """Images available on any host, from the cached image catalogue"""
+        if self.images is None:
+            raise ContainerException("Docker is not connected")
+
+        images = self.images.get_images()
+        if len(images) == 0 and not self.is_connected():
+            raise ContainerException("Docker is not connected")
+
+        return images
+
+    def prefetch_image(self, image: str, force: bool = False) -> None:
+        if self.images is not None:
+            self.images.prefetch(image, force)
+
+    def image_status(self) -> "list[dict]":
+        if self.images is None:
+            return []
+        return self.images.pull_status()
+
+    def kill_container(self, container_id: str, host: "str|None" = None):
+        self.get_host(host).kill_container(container_id)
+
+    def remove_container(self, container_id: str, host: "str|None" = None) -> None:
+        self.get_host(host).remove_container(container_id)
+
+    def get_container_activity(self, containers: "list[tuple[str, str|None]]") -> "dict[str, tuple[int, int]]":
+        """
+        Sample the activity counters of many containers, hosts in parallel and a bounded number of calls per host.
+
+        :param containers: (container_id, host) pairs
+        :return: Dictionary of container id to (CPU nanoseconds, network bytes). Containers that are gone or whose
+        host is down are left out.
+        """
+        by_host: "dict[str, list[str]]" = {}
+        for container_id, host in containers:
+            try:
+                by_host.setdefault(self.get_host(host).name,
+                                   []).append(container_id)
+            except ContainerException:
+                continue
+
+        def host_activity(host: DockerHost) -> "dict[str, tuple[int, int]]":
+            def sample(container_id: str):
+                try:
+                    return host.get_container_activity(container_id)
+                except Exception:
+                    return None
+
+            container_ids = by_host.get(host.name, [])
+            if len(container_ids) == 0:
+                return {}
+            with ThreadPoolExecutor(max_workers=min(self.STATS_WORKERS_PER_HOST, len(container_ids))) as executor:
+                samples = list(executor.map(sample, container_ids))
+            return {container_id: activity for container_id, activity in zip(container_ids, samples)
+                    if activity is not None}
+
+        activity = {}
+        for host_result in self.map_hosts(host_activity).values():
+            activity.update(host_result)
+        return activity
+
+    def is_connected(self) -> bool:
+        """Whether at least one host answered the health monitor's last ping"""
+        return any(host.is_connected() for host in self.hosts.values())
+
+    def connection_status(self) -> str:
+        """connected if any host is, connecting while a host's first connection is still being made, else disconnected"""
+        if self.is_connected():
+            return "connected"
+        if any(host.connecting for host in self.hosts.values()):
+            return "connecting"
+        return "disconnected"
+
+    def host_status(self) -> "list[dict]":
+        return [{
+            "name": host.name,
+            "hostname": host.hostname,
+            "connected": host.is_connected(),
+            "connecting": host.connecting,
+            "circuit": host.circuit_state(),
+            "running": host.running_count(),
+        } for host in self.hosts.values()]
@@ -0,0 +1,273 @@
+import json
+import time
+import queue
+import threading
+
+from flask import Flask
+from sqlalchemy.sql import func
+
+from CTFd.models import db
+from .models import ContainerEventModel, ContainerInfoModel
+
+# Event types pushed to players
+PROGRESS = "progress"
+READY = "ready"
+RENEWED = "renewed"
+EXPIRING = "expiring"
+KILLED = "killed"
+FAILED = "failed"
+
+
+def publish_event(team_id: int, challenge_id: int, event: str, **data) -> None:
+    """Record an event for a team's status streams. It is committed with the caller's transaction."""
+    publish_events([(team_id, challenge_id, event, data)])
+
+
+def publish_events(events: "list[tuple[int, int, str, dict]]") -> None:
+    """Record many (team_id, challenge_id, event, data) events. They are committed with the caller's transaction."""
+    now = int(time.time())
+    for team_id, challenge_id, event, data in events:
+        if team_id is None:
+            continue
+        db.session.add(ContainerEventModel(
+            team_id=team_id,
+            challenge_id=challenge_id,
+            event=event,
+            data=json.dumps(data),
+            timestamp=now,
+        ))
+
+
+class EventPublisher:
+    """
+    Fans container events out to the Server-Sent Event streams of players connected to this process.
+
+    Events are written to ContainerEventModel by whichever process caused them. One thread per process reads the new
+    ones with a single query per interval and hands each to the streams of its team, so the database load doesn't
+    grow with the number of connected players. Nothing is queried while no player is connected and no team's version
+    is cached.
+
+    The id of a team's latest event doubles as the version of its containers, since every create, renew and kill
+    records an event. Versions are cached from the same reads, so checking whether a team's containers changed needs
+    no query. Pruning keeps each team's latest event, so a version never goes back to an older value.
+    """
+
+    POLL_INTERVAL_SECONDS = 1
+    # Events read in one query
+    BATCH_SIZE = 1000
+    # Events are kept this long, then deleted
+    RETENTION_SECONDS = 600
+    PRUNE_INTERVAL_SECONDS = 60
+    # Events a slow stream may fall behind by before it is closed and has to reconnect
+    MAX_QUEUED = 100
+    KEEPALIVE_SECONDS = 15
+    # Streams are closed after this long and the browser reconnects, so a worker isn't held forever
+    STREAM_SECONDS = 600
+
+    def __init__(self, app: Flask) -> None:
+        self.app = app
+        self.lock = threading.Lock()
+        self.subscribers: "dict[int, set[queue.Queue]]" = {}
+        # Team id -> id of the team's latest event
+        self.versions: "dict[int, int]" = {}
+        # Held while reading events, so a version looked up from the database can't miss one
+        self.poll_lock = threading.Lock()
+        self.last_id = None
+        self.last_prune = 0
+
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self.watch, name="container-events", daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def subscribe(self, team_id: int) -> queue.Queue:
+        events = queue.Queue(maxsize=self.MAX_QUEUED)
+        with self.lock:
+            self.subscribers.setdefault(team_id, set()).add(events)
+        return events
+
+    def unsubscribe(self, team_id: int, events: queue.Queue) -> None:
+        with self.lock:
+            streams = self.subscribers.get(team_id)
+            if streams is None:
+                return
+            streams.discard(events)
+            if len(streams) == 0:
+                del self.subscribers[team_id]
+
+    def stream(self, team_id: int):
+        """Generator of Server-Sent Event messages for a team. Needs no app context."""
+        events = self.subscribe(team_id)
+        try:
+            # Browsers wait this long before reconnecting
+            yield "retry: 3000\n\n"
+
+            deadline = time.time() + self.STREAM_SECONDS
+            while time.time() < deadline:
+                try:
+                    message = events.get(timeout=self.KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+
+                # None means the stream fell too far behind and should reconnect
+                if message is None:
+                    return
+                yield message
+        finally:
+            self.unsubscribe(team_id, events)
+
+    def watch(self) -> None:
+        while not self.stopped.wait(self.POLL_INTERVAL_SECONDS):
+            try:
+                with self.app.app_context():
+                    self.poll()
+                    self.prune()
+            except Exception as err:
+                print("[Container Events] Could not read events:", err)
+
+    def team_version(self, team_id: int) -> int:
+        """Version of the team's containers, which changes whenever they do. Must be called with an app context."""
+        with self.lock:
+            version = self.versions.get(team_id)
+        if version is not None:
+            return version
+
+        with self.poll_lock:
+            # Events after this point are picked up by poll, so the version stays current from here on
+            self.start_reading()
+            version = db.session.query(func.max(ContainerEventModel.id)).filter(
+                ContainerEventModel.team_id == team_id).scalar() or 0
+            db.session.commit()
+
+            with self.lock:
+                self.versions[team_id] = max(
+                    version, self.versions.get(team_id, 0))
+                return self.versions[team_id]
+
+    def start_reading(self) -> None:
+        if self.last_id is None:
+            self.last_id = db.session.query(
+                func.max(ContainerEventModel.id)).scalar() or 0
+
+    def poll(self) -> None:
+        with self.poll_lock:
+            self.poll_locked()
+
+    def poll_locked(self) -> None:
+        with self.lock:
+            listening = len(self.subscribers) > 0 or len(self.versions) > 0
+        if not listening:
+            # Start from the newest event once somebody connects
+            self.last_id = None
+            return
+
+        self.start_reading()
+
+        rows: "list[ContainerEventModel]" = ContainerEventModel.query.filter(
+            ContainerEventModel.id > self.last_id
+        ).order_by(ContainerEventModel.id).limit(self.BATCH_SIZE).all()
+        db.session.commit()
+
+        for row in rows:
+            self.last_id = row.id
+            with self.lock:
+                if row.team_id in self.versions:
+                    self.versions[row.team_id] = row.id
+
+            data = json.loads(row.data or "{}")
+            data["challenge_id"] = row.challenge_id
+            message = f"event: {row.event}\ndata: {json.dumps(data)}\n\n"
+
+            with self.lock:
+                streams = list(self.subscribers.get(row.team_id, ()))
+            for events in streams:
+                try:
+                    events.put_nowait(message)
+                except queue.Full:
+                    self.drop(row.team_id, events)
+
+    def drop(self, team_id: int, events: queue.Queue) -> None:
+        self.unsubscribe(team_id, events)
+        # Make room for the marker that closes the stream
+        try:
+            events.get_nowait()
+        except queue.Empty:
+            pass
+        events.put_nowait(None)
+
+    def prune(self) -> None:
+        now = time.time()
+        if now - self.last_prune < self.PRUNE_INTERVAL_SECONDS:
+            return
+        self.last_prune = now
+
+        cutoff = int(now - self.RETENTION_SECONDS)
+        # The latest event of a team with nothing newer is its version, so it is kept
+        latest = [event_id for event_id, in db.session.query(func.max(ContainerEventModel.id)).group_by(
+            ContainerEventModel.team_id
+        ).having(func.max(ContainerEventModel.timestamp) < cutoff)]
+        query = ContainerEventModel.query.filter(
+            ContainerEventModel.timestamp < cutoff)
+        if len(latest) > 0:
+            query = query.filter(ContainerEventModel.id.notin_(latest))
+        query.delete(synchronize_session=False)
+        db.session.commit()
+
+    def shutdown(self) -> None:
+        self.stopped.set()
+
+
+class ExpiryWarnings:
+    """Warns teams a few minutes before their container expires, once per deadline"""
+
+    JOB_ID = "container_expiry_warnings"
+
+    INTERVAL_SECONDS = 30
+    # How long before the deadline teams are warned
+    WARNING_SECONDS = 300
+
+    def __init__(self, container_manager, app: Flask, scheduler) -> None:
+        self.container_manager = container_manager
+        self.app = app
+        self.scheduler = scheduler
+
+    def start(self) -> None:
+        self.scheduler.add_job(
+            func=self.run,
+            trigger="interval",
+            seconds=self.INTERVAL_SECONDS,
+            id=self.JOB_ID,
+            replace_existing=True,
+            coalesce=True,
+        )
+
+    def run(self) -> None:
+        if not self.container_manager.is_leader():
+            return
+
+        try:
+            with self.app.app_context():
+                self.warn()
+        except Exception as err:
+            print("[Container Events] Could not send expiry warnings:", err)
+
+    def warn(self) -> None:
+        now = int(time.time())
+        # A renewed container has a new deadline, so it is warned again
+        due: "list[ContainerInfoModel]" = ContainerInfoModel.query.filter(
+            ContainerInfoModel.expires > now,
+            ContainerInfoModel.expires <= now + self.WARNING_SECONDS,
+            (ContainerInfoModel.warned_expires == None) |
+            (ContainerInfoModel.warned_expires != ContainerInfoModel.expires),
+        ).all()
+        if len(due) == 0:
+            return
+
+        publish_events([(row.team_id, row.challenge_id, EXPIRING, {"expires": row.expires})
+                        for row in due])
+        for row in due:
+            row.warned_expires = row.expires
+        db.session.commit()
@@ -0,0 +1,124 @@
+import time
+import threading
+
+
+class CircuitBreaker:
+    """
+    Fails Docker calls fast while the daemon is unreachable.
+
+    closed: calls go through, and consecutive failures are counted. Reaching the threshold opens the circuit.
+    open: calls are rejected without touching the daemon until the backoff delay has passed.
+    half_open: the health monitor sends a single probe. Success closes the circuit; failure reopens it with twice the
+    previous backoff delay.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    FAILURE_THRESHOLD = 3
+    INITIAL_BACKOFF_SECONDS = 1
+    MAX_BACKOFF_SECONDS = 60
+
+    def __init__(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+        self.backoff = self.INITIAL_BACKOFF_SECONDS
+        self.retry_at = 0.0
+        self.lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        return self.state == self.CLOSED
+
+    def try_probe(self) -> bool:
+        """Move from open to half-open once the backoff delay has passed. Only the caller that gets True may probe."""
+        with self.lock:
+            if self.state != self.OPEN or time.time() < self.retry_at:
+                return False
+            self.state = self.HALF_OPEN
+            return True
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.backoff = self.INITIAL_BACKOFF_SECONDS
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN:
+                self.backoff = min(self.backoff * 2, self.MAX_BACKOFF_SECONDS)
+                self.open()
+            elif self.state == self.CLOSED and self.failures >= self.FAILURE_THRESHOLD:
+                self.open()
+
+    def trip(self) -> None:
+        """Open the circuit right away, e.g. when the initial connection failed"""
+        with self.lock:
+            self.open()
+
+    def open(self) -> None:
+        self.state = self.OPEN
+        self.retry_at = time.time() + self.backoff
+
+
+class HealthMonitor:
+    """
+    Pings the Docker daemon in the background and caches the result, so individual calls don't need their own ping.
+
+    The monitor's thread also makes the host's first connection. While the circuit is open the monitor is the one that
+    probes the daemon: it reconnects the client and pings, and the circuit breaker decides how long to back off between
+    attempts.
+    """
+
+    INTERVAL_SECONDS = 5
+
+    def __init__(self, host, breaker: CircuitBreaker) -> None:
+        self.host = host
+        self.breaker = breaker
+        self.healthy = False
+        self.last_check = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self.watch, name=f"docker-health-{host.name}", daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def watch(self) -> None:
+        # The first connection is made here rather than in start, so starting a host never waits on the daemon
+        self.host.connect()
+        while not self.stopped.is_set():
+            self.check()
+
+            delay = self.INTERVAL_SECONDS
+            if self.breaker.state == CircuitBreaker.OPEN:
+                # Probe as soon as the backoff delay allows
+                delay = max(0.1, min(delay, self.breaker.retry_at - time.time()))
+            self.stopped.wait(delay)
+
+    def check(self) -> None:
+        probing = False
+        if self.breaker.state != CircuitBreaker.CLOSED:
+            probing = self.breaker.try_probe()
+            if not probing:
+                self.healthy = False
+                return
+
+        try:
+            if probing or self.host.client is None:
+                self.host.connect_client()
+            self.host.client.ping()
+        except Exception:
+            self.breaker.record_failure()
+            self.healthy = False
+            return
+        finally:
+            self.last_check = time.time()
+
+        self.breaker.record_success()
+        self.healthy = True
@@ -0,0 +1,152 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask
+
+from CTFd.models import db
+from .models import ContainerInfoModel, ContainerReclaimModel
+from .events import publish_event, KILLED
+
+
+class IdleMonitor:
+    """
+    Stops team containers early once nobody has used them for container_idle_minutes. Does nothing while the setting
+    is blank, so it can be turned on and off without restarting CTFd.
+
+    Every pass samples the cumulative CPU time and network bytes of every team container through the Docker stats API.
+    A container whose counters moved more than the thresholds since the previous pass is marked active. Containers
+    that have not been active for the idle timeout are killed, and the team is told why when it next uses the
+    container.
+    """
+
+    JOB_ID = "container_idle_monitor"
+
+    INTERVAL_SECONDS = 60
+    # Activity below these amounts per pass counts as idle, so background noise doesn't keep a container alive
+    CPU_NANOSECONDS_THRESHOLD = 50_000_000
+    NETWORK_BYTES_THRESHOLD = 2048
+    # Number of concurrent Docker kill calls
+    MAX_WORKERS = 16
+
+    def __init__(self, container_manager, app: Flask, scheduler) -> None:
+        self.container_manager = container_manager
+        self.app = app
+        self.scheduler = scheduler
+        # Container id -> counters from the previous pass
+        self.samples: "dict[str, tuple[int, int]]" = {}
+        self.last_reclaimed = 0
+
+    def start(self) -> None:
+        self.scheduler.add_job(
+            func=self.run,
+            trigger="interval",
+            seconds=self.INTERVAL_SECONDS,
+            id=self.JOB_ID,
+            replace_existing=True,
+            coalesce=True,
+        )
+
+    def run(self) -> None:
+        idle_minutes = self.container_manager.settings.value(
+            "container_idle_minutes", 0)
+        if idle_minutes <= 0 or not self.container_manager.is_leader():
+            # Samples from an earlier term as leader are too old to compare against
+            self.samples = {}
+            return
+
+        try:
+            with self.app.app_context():
+                self.check(idle_minutes * 60)
+        except Exception as err:
+            print("[Container Idle Monitor] Idle check failed:", err)
+
+    def check(self, idle_seconds: int) -> None:
+        now = int(time.time())
+        containers = [(row.container_id, row.host)
+                      for row in ContainerInfoModel.query.all()]
+        activity = self.container_manager.get_container_activity(containers)
+
+        active = []
+        compared = []
+        first_seen = []
+        for container_id, (cpu, network) in activity.items():
+            previous = self.samples.get(container_id)
+            if previous is None:
+                first_seen.append(container_id)
+                continue
+            compared.append(container_id)
+            if cpu - previous[0] > self.CPU_NANOSECONDS_THRESHOLD or network - previous[1] > self.NETWORK_BYTES_THRESHOLD:
+                active.append(container_id)
+        self.samples = activity
+
+        if len(active) > 0:
+            ContainerInfoModel.query.filter(
+                ContainerInfoModel.container_id.in_(active)
+            ).update({"last_active": now}, synchronize_session=False)
+        # Nothing is known about these containers' past activity, e.g. after a deploy, a leader change or a settings
+        # reload, so rows never marked active start counting from now
+        if len(first_seen) > 0:
+            ContainerInfoModel.query.filter(
+                ContainerInfoModel.container_id.in_(first_seen),
+                ContainerInfoModel.last_active == None,
+            ).update({"last_active": now}, synchronize_session=False)
+        db.session.commit()
+
+        # Only containers sampled on two passes in a row can be idle, so a host that is down or a monitor that just
+        # started doesn't get containers reclaimed
+        if len(compared) == 0:
+            return
+        cutoff = now - idle_seconds
+        idle: "list[ContainerInfoModel]" = [
+            row for row in ContainerInfoModel.query.filter(
+                ContainerInfoModel.container_id.in_(compared)
+            ).all()
+            if (row.last_active or row.timestamp or now) < cutoff
+        ]
+        if len(idle) > 0:
+            self.reclaim(idle, idle_seconds)
+
+    def reclaim(self, idle: "list[ContainerInfoModel]", idle_seconds: int) -> None:
+        from .container_manager import ContainerException
+
+        targets = [(row.container_id, row.host, row.challenge_id, row.team_id)
+                   for row in idle]
+
+        def kill(target) -> bool:
+            try:
+                self.container_manager.kill_container(target[0], target[1])
+            except ContainerException:
+                return False
+            return True
+
+        with ThreadPoolExecutor(max_workers=min(self.MAX_WORKERS, len(targets))) as executor:
+            results = list(executor.map(kill, targets))
+        killed = [target for target, ok in zip(targets, results) if ok]
+        if len(killed) == 0:
+            return
+
+        killed_ids = [container_id for container_id, _, _, _ in killed]
+        ContainerInfoModel.query.filter(
+            ContainerInfoModel.container_id.in_(killed_ids)
+        ).delete(synchronize_session=False)
+
+        now = int(time.time())
+        minutes = max(1, idle_seconds // 60)
+        reason = f"Your container was stopped after {minutes} minutes without activity. Request a new one to keep " \
+                 f"going."
+        for _, _, challenge_id, team_id in killed:
+            db.session.merge(ContainerReclaimModel(
+                challenge_id=challenge_id,
+                team_id=team_id,
+                reason=reason,
+                timestamp=now,
+            ))
+            publish_event(team_id, challenge_id, KILLED, reason=reason)
+        db.session.commit()
+
+        self.container_manager.release_ports(killed_ids)
+        for container_id in killed_ids:
+            self.samples.pop(container_id, None)
+
+        self.last_reclaimed = len(killed_ids)
+        print(f"[Container Idle Monitor] Stopped {len(killed_ids)} idle containers")
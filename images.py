@@ -0,0 +1,145 @@
+import time
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask
+
+from .models import ContainerChallengeModel
+
+
+class ImageCatalogue:
+    """
+    Cached list of images on every Docker host, plus background pulls of challenge images.
+
+    Listing images on every admin form load is slow on big hosts, so the catalogue is refreshed on a schedule and after
+    pulls. Challenge images are pulled onto every host when a challenge is saved and when the plugin connects, so a
+    missing image shows up as a failed pull on the dashboard rather than as an error when a player requests a container.
+    """
+
+    JOB_ID = "container_image_catalogue"
+
+    REFRESH_INTERVAL_SECONDS = 300
+    # Number of image pulls running at once, over all hosts
+    MAX_PULLS = 4
+
+    def __init__(self, container_manager, app: Flask, scheduler) -> None:
+        self.container_manager = container_manager
+        self.app = app
+        self.scheduler = scheduler
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.MAX_PULLS, thread_name_prefix="container-pull")
+
+        self.lock = threading.Lock()
+        # Host name -> image tags on that host
+        self.images: "dict[str, set[str]]" = {}
+        self.last_refresh = None
+        # (image, host name) -> {"status": queued|pulling|ready|failed, "progress": 0..1, "error": str}
+        self.pulls: "dict[tuple[str, str], dict]" = {}
+
+    def start(self) -> None:
+        self.scheduler.add_job(
+            func=self.run,
+            trigger="interval",
+            seconds=self.REFRESH_INTERVAL_SECONDS,
+            id=self.JOB_ID,
+            replace_existing=True,
+            coalesce=True,
+            next_run_time=datetime.datetime.now(datetime.timezone.utc),
+        )
+
+    def run(self) -> None:
+        try:
+            self.refresh()
+            # Also retries pulls that failed, e.g. because a host was down. Every process keeps its own image list,
+            # but only the leader pulls.
+            if self.container_manager.is_leader():
+                self.prefetch_all()
+        except Exception as err:
+            print("[Container Images] Refresh failed:", err)
+
+    def stop(self) -> None:
+        self.executor.shutdown(wait=False)
+
+    def refresh(self) -> None:
+        from .container_manager import ContainerException
+
+        def host_images(host) -> "set[str]|None":
+            try:
+                return set(host.get_images())
+            except ContainerException:
+                return None
+
+        results = self.container_manager.map_hosts(host_images)
+        with self.lock:
+            for name, images in results.items():
+                # Keep the last known images for hosts that are down
+                if images is not None:
+                    self.images[name] = images
+            for name in list(self.images.keys()):
+                if name not in results:
+                    del self.images[name]
+            self.last_refresh = time.time()
+
+    def get_images(self) -> "list[str]":
+        if self.last_refresh is None:
+            self.refresh()
+
+        with self.lock:
+            images = set()
+            for host_images in self.images.values():
+                images.update(host_images)
+        return sorted(images)
+
+    def prefetch_all(self) -> None:
+        with self.app.app_context():
+            images = {challenge.image for challenge in ContainerChallengeModel.query.all()
+                      if challenge.image}
+        for image in images:
+            self.prefetch(image)
+
+    def prefetch(self, image: str, force: bool = False) -> None:
+        """Make sure the image is on every host, pulling it in the background where it's missing"""
+        if not image:
+            return
+
+        for host in self.container_manager.hosts.values():
+            key = (image, host.name)
+            with self.lock:
+                current = self.pulls.get(key)
+                if not force and current is not None and current["status"] in ("queued", "pulling", "ready"):
+                    continue
+                self.pulls[key] = {"status": "queued",
+                                   "progress": 0.0, "error": None}
+            self.executor.submit(self.pull, image, host)
+
+    def pull(self, image: str, host) -> None:
+        key = (image, host.name)
+
+        def set_progress(progress: float) -> None:
+            with self.lock:
+                self.pulls[key]["progress"] = progress
+
+        try:
+            if not host.has_image(image):
+                with self.lock:
+                    self.pulls[key]["status"] = "pulling"
+                host.pull_image(image, set_progress)
+        except Exception as err:
+            # Any error, including Docker API errors and timeouts, marks the pull failed so that the next prefetch
+            # retries it
+            with self.lock:
+                self.pulls[key].update({"status": "failed", "error": str(err) or "Unknown error"})
+            return
+
+        with self.lock:
+            self.pulls[key].update({"status": "ready", "progress": 1.0})
+            self.images.setdefault(host.name, set()).add(image)
+
+    def pull_status(self) -> "list[dict]":
+        with self.lock:
+            return [{
+                "image": image,
+                "host": host,
+                **status,
+            } for (image, host), status in sorted(self.pulls.items())]
@@ -0,0 +1,142 @@
+import os
+import time
+import uuid
+import socket
+import datetime
+import threading
+
+from flask import Flask
+from sqlalchemy.exc import IntegrityError
+
+from CTFd.models import db
+from .models import ContainerLeaseModel
+
+
+class LeaderLease:
+    """
+    Elects one plugin process, out of every web worker on every node, to run the maintenance jobs.
+
+    The leader holds a row in ContainerLeaseModel and renews it well before it expires. Any process may take the lease
+    over once it has expired, so when the leader dies another process becomes leader within LEASE_SECONDS. A process
+    stops acting as leader as soon as its own copy of the lease runs out, even if it could not reach the database to
+    find out whether someone else took over.
+    """
+
+    JOB_ID = "container_leader_lease"
+    LEASE_NAME = "maintenance"
+
+    LEASE_SECONDS = 30
+    RENEW_INTERVAL_SECONDS = 10
+
+    def __init__(self, app: Flask, scheduler, on_acquire=None) -> None:
+        self.app = app
+        self.scheduler = scheduler
+        # Called from the scheduler thread when this process becomes leader
+        self.on_acquire = on_acquire
+        self.hostname = socket.gethostname()
+        self.pid = os.getpid()
+        self.holder = f"{self.hostname}:{self.pid}:{uuid.uuid4().hex[:8]}"
+
+        self.lock = threading.Lock()
+        self.expires = 0.0
+
+    def start(self) -> None:
+        self.scheduler.add_job(
+            func=self.renew,
+            trigger="interval",
+            seconds=self.RENEW_INTERVAL_SECONDS,
+            id=self.JOB_ID,
+            replace_existing=True,
+            coalesce=True,
+            next_run_time=datetime.datetime.now(datetime.timezone.utc),
+        )
+
+    def is_leader(self) -> bool:
+        with self.lock:
+            return time.time() < self.expires
+
+    def renew(self) -> None:
+        was_leader = self.is_leader()
+        try:
+            with self.app.app_context():
+                acquired = self.try_acquire()
+        except Exception as err:
+            print("[Container Leader] Lease renewal failed:", err)
+            return
+
+        if acquired and not was_leader:
+            print(f"[Container Leader] {self.holder} is now running maintenance jobs")
+            if self.on_acquire is not None:
+                self.on_acquire()
+        elif was_leader and not acquired:
+            print(f"[Container Leader] {self.holder} lost the maintenance lease")
+
+    def try_acquire(self) -> bool:
+        """Take or renew the lease. Must be called with an app context."""
+        started = time.time()
+        now = int(started)
+        values = {
+            "holder": self.holder,
+            "hostname": self.hostname,
+            "pid": self.pid,
+            "expires": now + self.LEASE_SECONDS,
+        }
+
+        # Renewing our own lease keeps the acquired time, taking over an expired one resets it
+        updated = ContainerLeaseModel.query.filter_by(
+            name=self.LEASE_NAME, holder=self.holder
+        ).update(values, synchronize_session=False)
+        if updated == 0:
+            updated = ContainerLeaseModel.query.filter(
+                ContainerLeaseModel.name == self.LEASE_NAME,
+                ContainerLeaseModel.expires < now,
+            ).update({**values, "acquired": now}, synchronize_session=False)
+        db.session.commit()
+
+        if updated == 0:
+            # The lease row may not exist yet; the primary key makes sure only one process creates it
+            try:
+                with db.session.begin_nested():
+                    db.session.add(ContainerLeaseModel(
+                        name=self.LEASE_NAME, acquired=now, **values))
+                db.session.commit()
+                updated = 1
+            except IntegrityError:
+                db.session.rollback()
+
+        with self.lock:
+            # Measured from before the update, so our copy of the lease never outlives the one in the database
+            self.expires = started + self.LEASE_SECONDS if updated == 1 else 0.0
+        return updated == 1
+
+    def release(self) -> None:
+        """Give the lease up so another process can take over straight away"""
+        with self.lock:
+            if self.expires == 0.0:
+                return
+            self.expires = 0.0
+
+        try:
+            with self.app.app_context():
+                ContainerLeaseModel.query.filter_by(
+                    name=self.LEASE_NAME, holder=self.holder
+                ).delete(synchronize_session=False)
+                db.session.commit()
+        except Exception as err:
+            print("[Container Leader] Lease release failed:", err)
+
+    def status(self) -> "dict|None":
+        """The current lease holder, or None if nobody holds the lease. Must be called with an app context."""
+        lease: ContainerLeaseModel = ContainerLeaseModel.query.filter_by(
+            name=self.LEASE_NAME).first()
+        if lease is None or lease.expires < time.time():
+            return None
+
+        return {
+            "holder": lease.holder,
+            "hostname": lease.hostname,
+            "pid": lease.pid,
+            "acquired": lease.acquired,
+            "expires": lease.expires,
+            "this_process": lease.holder == self.holder,
+        }
@@ -0,0 +1,241 @@
+import time
+import threading
+
+
+def format_labels(names: "tuple[str, ...]", values: "tuple[str, ...]", extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    if len(pairs) == 0:
+        return ""
+    return "{" + ",".join(pairs) + "}"
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A Prometheus counter with labels, kept in memory in this process"""
+
+    def __init__(self, name: str, documentation: str, label_names: "tuple[str, ...]" = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.lock = threading.Lock()
+        self.values: "dict[tuple[str, ...], float]" = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self) -> "list[str]":
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(
+                    f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """A Prometheus histogram with labels, kept in memory in this process"""
+
+    # Seconds; Docker calls range from a cached lookup to a slow image pull over SSH
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, name: str, documentation: str, label_names: "tuple[str, ...]" = (),
+                 buckets: "tuple[float, ...]" = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self.lock = threading.Lock()
+        # Label values -> (bucket counts, sum, count)
+        self.values: "dict[tuple[str, ...], list]" = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.label_names)
+        with self.lock:
+            if key not in self.values:
+                self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            counts, _, _ = self.values[key]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.values[key][1] += value
+            self.values[key][2] += 1
+
+    def time(self, **labels) -> "Timer":
+        return Timer(self, labels)
+
+    def render(self) -> "list[str]":
+        lines = [f"# HELP {self.name} {self.documentation}",
+                 f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    labels = format_labels(
+                        self.label_names, key, f'le="{format_value(float(bound))}"')
+                    lines.append(f"{self.name}_bucket{labels} {bucket_count}")
+                labels = format_labels(self.label_names, key)
+                lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Timer:
+    """Context manager that observes how long its block took. Set outcome to label the result."""
+
+    def __init__(self, histogram: Histogram, labels: dict) -> None:
+        self.histogram = histogram
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        if exc_type is not None and "outcome" in self.histogram.label_names:
+            self.labels.setdefault("outcome", "error")
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+def response_outcome(response) -> str:
+    """Outcome label for a route response, which is a dict or a (dict, status) tuple"""
+    body = response[0] if isinstance(response, tuple) else response
+    return "failed" if "error" in body else "ok"
+
+
+def render_gauge(name: str, documentation: str, samples: "list[tuple[dict, float]]") -> "list[str]":
+    """Render a gauge computed at scrape time from (labels, value) samples"""
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} gauge"]
+    for labels, value in samples:
+        names = tuple(labels.keys())
+        lines.append(
+            f"{name}{format_labels(names, tuple(labels.values()))} {format_value(value)}")
+    return lines
+
+
+DOCKER_CALL_SECONDS = Histogram(
+    "ctfd_containers_docker_call_seconds",
+    "Time spent in Docker API calls, by host, call and outcome.",
+    ("host", "call", "outcome"),
+)
+REQUESTS = Counter(
+    "ctfd_containers_requests_total",
+    "Player container requests by action and outcome.",
+    ("action", "outcome"),
+)
+PROVISION_SECONDS = Histogram(
+    "ctfd_containers_provision_seconds",
+    "Time from a request or reset being queued until its container was ready or it failed.",
+    ("action", "outcome"),
+)
+REAPER_PASS_SECONDS = Histogram(
+    "ctfd_containers_reaper_pass_seconds",
+    "Time taken by one pass of the expiry reaper.",
+)
+REAPED = Counter(
+    "ctfd_containers_reaped_total",
+    "Expired containers killed by the expiry reaper.",
+)
+RECONCILED = Counter(
+    "ctfd_containers_reconciled_total",
+    "Orphaned containers removed and stale rows dropped by the reconciler.",
+    ("kind",),
+)
+
+# Circuit breaker states as gauge values
+CIRCUIT_STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+def render_metrics(container_manager, admission_status: dict) -> str:
+    """
+    Render every metric in the Prometheus text format. Must be called with an app context.
+
+    Counters and histograms cover this process only, so scrape every worker or sum them. Instance gauges come from the
+    database and are the same in every process.
+    """
+    from sqlalchemy.sql import func
+
+    from CTFd.models import db
+    from .models import ContainerInfoModel, ContainerPoolModel, ContainerReplicaModel, ContainerAssignmentModel
+
+    lines = []
+    for metric in (DOCKER_CALL_SECONDS, REQUESTS, PROVISION_SECONDS, REAPER_PASS_SECONDS, REAPED, RECONCILED):
+        lines.extend(metric.render())
+
+    per_challenge = db.session.query(
+        ContainerInfoModel.challenge_id, func.count(ContainerInfoModel.container_id)
+    ).group_by(ContainerInfoModel.challenge_id).all()
+    lines.extend(render_gauge(
+        "ctfd_containers_instances", "Live team instances by challenge.",
+        [({"challenge_id": challenge_id}, count) for challenge_id, count in per_challenge]))
+
+    per_host = db.session.query(
+        ContainerInfoModel.host, func.count(ContainerInfoModel.container_id)
+    ).group_by(ContainerInfoModel.host).all()
+    # Rows without a host were created before multiple hosts and live on the first one
+    first_host = next(iter(container_manager.hosts), "")
+    lines.extend(render_gauge(
+        "ctfd_containers_host_instances", "Live team instances by Docker host.",
+        [({"host": host or first_host}, count) for host, count in per_host]))
+
+    pooled = db.session.query(
+        ContainerPoolModel.challenge_id, func.count(ContainerPoolModel.container_id)
+    ).group_by(ContainerPoolModel.challenge_id).all()
+    lines.extend(render_gauge(
+        "ctfd_containers_warm_pool", "Idle warm pool containers by challenge.",
+        [({"challenge_id": challenge_id}, count) for challenge_id, count in pooled]))
+
+    replicas = db.session.query(
+        ContainerReplicaModel.challenge_id, func.count(ContainerReplicaModel.container_id)
+    ).group_by(ContainerReplicaModel.challenge_id).all()
+    lines.extend(render_gauge(
+        "ctfd_containers_shared_replicas", "Containers shared by every team, by challenge.",
+        [({"challenge_id": challenge_id}, count) for challenge_id, count in replicas]))
+
+    assigned = db.session.query(
+        ContainerAssignmentModel.challenge_id, func.count(ContainerAssignmentModel.team_id)
+    ).filter(
+        ContainerAssignmentModel.expires >= int(time.time())
+    ).group_by(ContainerAssignmentModel.challenge_id).all()
+    lines.extend(render_gauge(
+        "ctfd_containers_shared_teams", "Teams assigned to a shared container, by challenge.",
+        [({"challenge_id": challenge_id}, count) for challenge_id, count in assigned]))
+
+    lines.extend(render_gauge(
+        "ctfd_containers_queued_requests", "Requests waiting for admission.",
+        [({}, admission_status["queued"])]))
+    if admission_status["capacity"] is not None:
+        lines.extend(render_gauge(
+            "ctfd_containers_capacity", "Instances allowed at once over all teams.",
+            [({}, admission_status["capacity"])]))
+
+    lines.extend(render_gauge(
+        "ctfd_containers_reaper_lag_seconds", "How far behind schedule the last expiry reaper pass in this process was.",
+        [({}, container_manager.reaper_lag())]))
+    lines.extend(render_gauge(
+        "ctfd_containers_leader", "1 if this process runs the maintenance jobs.",
+        [({}, 1 if container_manager.is_leader() else 0)]))
+
+    hosts = container_manager.host_status()
+    lines.extend(render_gauge(
+        "ctfd_containers_host_connected", "1 if the Docker host is connected.",
+        [({"host": host["name"]}, 1 if host["connected"] else 0) for host in hosts]))
+    lines.extend(render_gauge(
+        "ctfd_containers_host_circuit", "Circuit breaker state of the Docker host: 0 closed, 1 half-open, 2 open.",
+        [({"host": host["name"]}, CIRCUIT_STATES.get(host["circuit"], 2)) for host in hosts]))
+
+    return "\n".join(lines) + "\n"
+
@@ -0,0 +1,26 @@
+"""Index provisioning job status
+
+Revision ID: 0a7d3e95c1b2
+Revises: f28c5d1b7a49
+Create Date: 2026-10-18 09:40:00.000000
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "0a7d3e95c1b2"
+down_revision = "f28c5d1b7a49"
+branch_labels = None
+depends_on = None
+
+
+def upgrade(op=None):
+    # Admission control reads the queued jobs on every dispatch
+    indexes = [index["name"] for index in sa.inspect(
+        op.get_bind()).get_indexes("container_job_model")]
+    if "ix_container_job_model_status" not in indexes:
+        op.create_index("ix_container_job_model_status", "container_job_model", ["status"])
+
+
+def downgrade(op=None):
+    op.drop_index("ix_container_job_model_status", table_name="container_job_model")
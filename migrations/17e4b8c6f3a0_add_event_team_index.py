@@ -0,0 +1,26 @@
+"""Index container events by team
+
+Revision ID: 17e4b8c6f3a0
+Revises: 0a7d3e95c1b2
+Create Date: 2026-10-18 09:40:00.000000
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "17e4b8c6f3a0"
+down_revision = "0a7d3e95c1b2"
+branch_labels = None
+depends_on = None
+
+
+def upgrade(op=None):
+    # Instance listings look up a team's latest event
+    indexes = [index["name"] for index in sa.inspect(
+        op.get_bind()).get_indexes("container_event_model")]
+    if "ix_container_event_model_team_id" not in indexes:
+        op.create_index("ix_container_event_model_team_id", "container_event_model", ["team_id"])
+
+
+def downgrade(op=None):
+    op.drop_index("ix_container_event_model_team_id", table_name="container_event_model")
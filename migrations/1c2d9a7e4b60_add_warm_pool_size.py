@@ -0,0 +1,27 @@
+"""Add warm_pool_size to container challenges
+
+Revision ID: 1c2d9a7e4b60
+Revises:
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "1c2d9a7e4b60"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade(op=None):
+    # Installs whose tables were created after this column was added already have it
+    columns = [column["name"] for column in sa.inspect(
+        op.get_bind()).get_columns("container_challenge_model")]
+    if "warm_pool_size" not in columns:
+        op.add_column("container_challenge_model", sa.Column(
+            "warm_pool_size", sa.Integer(), nullable=True, server_default="0"))
+
+
+def downgrade(op=None):
+    op.drop_column("container_challenge_model", "warm_pool_size")
@@ -0,0 +1,26 @@
+"""Add standby_id to team containers
+
+Revision ID: 3d8a5f0c7e21
+Revises: 17e4b8c6f3a0
+Create Date: 2026-10-18 16:40:00.000000
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "3d8a5f0c7e21"
+down_revision = "17e4b8c6f3a0"
+branch_labels = None
+depends_on = None
+
+
+def upgrade(op=None):
+    columns = [column["name"] for column in sa.inspect(
+        op.get_bind()).get_columns("container_info_model")]
+    if "standby_id" not in columns:
+        op.add_column("container_info_model", sa.Column(
+            "standby_id", sa.String(length=512), nullable=True))
+
+
+def downgrade(op=None):
+    op.drop_column("container_info_model", "standby_id")
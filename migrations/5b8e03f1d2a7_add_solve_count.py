@@ -0,0 +1,26 @@
+"""Add solve_count to container challenges
+
+Revision ID: 5b8e03f1d2a7
+Revises: 1c2d9a7e4b60
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "5b8e03f1d2a7"
+down_revision = "1c2d9a7e4b60"
+branch_labels = None
+depends_on = None
+
+
+def upgrade(op=None):
+    columns = [column["name"] for column in sa.inspect(
+        op.get_bind()).get_columns("container_challenge_model")]
+    if "solve_count" not in columns:
+        op.add_column("container_challenge_model", sa.Column(
+            "solve_count", sa.Integer(), nullable=True))
+
+
+def downgrade(op=None):
+    op.drop_column("container_challenge_model", "solve_count")
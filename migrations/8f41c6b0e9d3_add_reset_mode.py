@@ -0,0 +1,26 @@
+"""Add reset_mode to container challenges
+
+Revision ID: 8f41c6b0e9d3
+Revises: 5b8e03f1d2a7
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "8f41c6b0e9d3"
+down_revision = "5b8e03f1d2a7"
+branch_labels = None
+depends_on = None
+
+
+def upgrade(op=None):
+    columns = [column["name"] for column in sa.inspect(
+        op.get_bind()).get_columns("container_challenge_model")]
+    if "reset_mode" not in columns:
+        op.add_column("container_challenge_model", sa.Column(
+            "reset_mode", sa.String(length=16), nullable=True, server_default="new"))
+
+
+def downgrade(op=None):
+    op.drop_column("container_challenge_model", "reset_mode")
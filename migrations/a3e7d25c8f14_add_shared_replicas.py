@@ -0,0 +1,26 @@
+"""Add shared_replicas to container challenges
+
+Revision ID: a3e7d25c8f14
+Revises: 8f41c6b0e9d3
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "a3e7d25c8f14"
+down_revision = "8f41c6b0e9d3"
+branch_labels = None
+depends_on = None
+
+
+def upgrade(op=None):
+    columns = [column["name"] for column in sa.inspect(
+        op.get_bind()).get_columns("container_challenge_model")]
+    if "shared_replicas" not in columns:
+        op.add_column("container_challenge_model", sa.Column(
+            "shared_replicas", sa.Integer(), nullable=True, server_default="0"))
+
+
+def downgrade(op=None):
+    op.drop_column("container_challenge_model", "shared_replicas")
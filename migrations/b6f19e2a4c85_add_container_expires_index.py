@@ -0,0 +1,28 @@
+"""Index container expiry times
+
+Revision ID: b6f19e2a4c85
+Revises: a3e7d25c8f14
+Create Date: 2026-10-18 09:10:00.000000
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "b6f19e2a4c85"
+down_revision = "a3e7d25c8f14"
+branch_labels = None
+depends_on = None
+
+
+def upgrade(op=None):
+    # The expiry reaper only reads containers that are due, which needs this index to avoid a full scan
+    indexes = [index["name"] for index in sa.inspect(
+        op.get_bind()).get_indexes("container_info_model")]
+    if "ix_container_info_model_expires" not in indexes:
+        op.create_index("ix_container_info_model_expires",
+                        "container_info_model", ["expires"])
+
+
+def downgrade(op=None):
+    op.drop_index("ix_container_info_model_expires",
+                  table_name="container_info_model")
@@ -0,0 +1,32 @@
+"""Add the Docker host to team and warm pool containers
+
+Revision ID: c4a8e61f0b37
+Revises: b6f19e2a4c85
+Create Date: 2026-10-18 09:20:00.000000
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "c4a8e61f0b37"
+down_revision = "b6f19e2a4c85"
+branch_labels = None
+depends_on = None
+
+# Rows without a host were created before multiple hosts and live on the first one
+TABLES = ("container_info_model", "container_pool_model")
+
+
+def upgrade(op=None):
+    inspector = sa.inspect(op.get_bind())
+    for table in TABLES:
+        columns = [column["name"]
+                   for column in inspector.get_columns(table)]
+        if "host" not in columns:
+            op.add_column(table, sa.Column(
+                "host", sa.String(length=128), nullable=True))
+
+
+def downgrade(op=None):
+    for table in TABLES:
+        op.drop_column(table, "host")
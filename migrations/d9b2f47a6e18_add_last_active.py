@@ -0,0 +1,26 @@
+"""Add last_active to team containers
+
+Revision ID: d9b2f47a6e18
+Revises: c4a8e61f0b37
+Create Date: 2026-10-18 09:20:00.000000
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "d9b2f47a6e18"
+down_revision = "c4a8e61f0b37"
+branch_labels = None
+depends_on = None
+
+
+def upgrade(op=None):
+    columns = [column["name"] for column in sa.inspect(
+        op.get_bind()).get_columns("container_info_model")]
+    if "last_active" not in columns:
+        op.add_column("container_info_model", sa.Column(
+            "last_active", sa.Integer(), nullable=True))
+
+
+def downgrade(op=None):
+    op.drop_column("container_info_model", "last_active")
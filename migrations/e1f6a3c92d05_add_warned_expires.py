@@ -0,0 +1,26 @@
+"""Add warned_expires to team containers
+
+Revision ID: e1f6a3c92d05
+Revises: d9b2f47a6e18
+Create Date: 2026-10-18 09:20:00.000000
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "e1f6a3c92d05"
+down_revision = "d9b2f47a6e18"
+branch_labels = None
+depends_on = None
+
+
+def upgrade(op=None):
+    columns = [column["name"] for column in sa.inspect(
+        op.get_bind()).get_columns("container_info_model")]
+    if "warned_expires" not in columns:
+        op.add_column("container_info_model", sa.Column(
+            "warned_expires", sa.Integer(), nullable=True))
+
+
+def downgrade(op=None):
+    op.drop_column("container_info_model", "warned_expires")
@@ -0,0 +1,68 @@
+"""Allow one container per team and challenge, and index the lookups by team
+
+Revision ID: f28c5d1b7a49
+Revises: e1f6a3c92d05
+Create Date: 2026-10-18 09:30:00.000000
+
+"""
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "f28c5d1b7a49"
+down_revision = "e1f6a3c92d05"
+branch_labels = None
+depends_on = None
+
+UNIQUE_NAME = "container_info_challenge_team"
+
+container_info = sa.table(
+    "container_info_model",
+    sa.column("container_id", sa.String),
+)
+
+
+def upgrade(op=None):
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+
+    names = [index["name"]
+             for index in inspector.get_indexes("container_info_model")]
+    names += [constraint["name"]
+              for constraint in inspector.get_unique_constraints("container_info_model")]
+    if UNIQUE_NAME not in names:
+        # Keep the newest row of each team and challenge. The containers of the others no longer have a row, so the
+        # orphan reconciler removes them.
+        rows = bind.execute(sa.text(
+            "SELECT container_id, challenge_id, team_id FROM container_info_model ORDER BY timestamp DESC"
+        )).fetchall()
+        seen = set()
+        duplicates = []
+        for container_id, challenge_id, team_id in rows:
+            if (challenge_id, team_id) in seen:
+                duplicates.append(container_id)
+            seen.add((challenge_id, team_id))
+
+        for i in range(0, len(duplicates), 500):
+            bind.execute(container_info.delete().where(
+                container_info.c.container_id.in_(duplicates[i:i + 500])))
+
+        op.create_unique_constraint(
+            UNIQUE_NAME, "container_info_model", ["challenge_id", "team_id"])
+
+    if "ix_container_info_model_team_id" not in names:
+        op.create_index("ix_container_info_model_team_id",
+                        "container_info_model", ["team_id"])
+
+    job_indexes = [index["name"]
+                   for index in inspector.get_indexes("container_job_model")]
+    if "container_job_challenge_team" not in job_indexes:
+        op.create_index("container_job_challenge_team",
+                        "container_job_model", ["challenge_id", "team_id"])
+
+
+def downgrade(op=None):
+    op.drop_index("container_job_challenge_team",
+                  table_name="container_job_model")
+    op.drop_index("ix_container_info_model_team_id",
+                  table_name="container_info_model")
+    op.drop_constraint(UNIQUE_NAME, "container_info_model", type_="unique")
@@ -14,11 +14,20 @@ class ContainerChallengeModel(Challenges):
     port = db.Column(db.Integer)
     command = db.Column(db.Text, default="")
     volumes = db.Column(db.Text, default="")
+    # Number of idle pre-started containers to keep ready for this challenge
+    warm_pool_size = db.Column(db.Integer, default=0)
+    # How a reset replaces the team's container: "new" (a new container and port), "restart" (restart it in place,
+    # keeping its files) or "recreate" (a fresh container on the same port)
+    reset_mode = db.Column(db.String(16), default="new")
+    # Maximum number of containers shared by every team, for stateless challenges (0 = one container per team)
+    shared_replicas = db.Column(db.Integer, default=0)
 
     # Dynamic challenge properties
     initial = db.Column(db.Integer, default=0)
     minimum = db.Column(db.Integer, default=0)
     decay = db.Column(db.Integer, default=0)
+    # Solves by visible, unbanned accounts, kept up to date on every solve. None until first counted.
+    solve_count = db.Column(db.Integer)
 
     def __init__(self, *args, **kwargs):
         super(ContainerChallengeModel, self).__init__(**kwargs)
@@ -27,20 +36,183 @@ class ContainerChallengeModel(Challenges):
 
 class ContainerInfoModel(db.Model):
     __mapper_args__ = {"polymorphic_identity": "container_info"}
+    # A team has at most one container per challenge. The unique index also serves every lookup by challenge and team.
+    __table_args__ = (
+        db.UniqueConstraint("challenge_id", "team_id",
+                            name="container_info_challenge_team"),
+    )
+    # Container id of a row reserved for a container that is still being created
+    PENDING_PREFIX = "pending-"
     container_id = db.Column(db.String(512), primary_key=True)
     challenge_id = db.Column(
         db.Integer, db.ForeignKey("challenges.id", ondelete="CASCADE")
     )
     team_id = db.Column(
-        db.Integer, db.ForeignKey("teams.id", ondelete="CASCADE")
+        db.Integer, db.ForeignKey("teams.id", ondelete="CASCADE"), index=True
     )
+    # Name of the Docker host the container runs on (None for the first configured host)
+    host = db.Column(db.String(128))
     port = db.Column(db.Integer)
     timestamp = db.Column(db.Integer)
-    expires = db.Column(db.Integer)
+    expires = db.Column(db.Integer, index=True)
+    # Last time the idle monitor saw network or CPU activity (None until then, counting from timestamp)
+    last_active = db.Column(db.Integer)
+    # Deadline the team was last warned about, so each deadline is only warned about once
+    warned_expires = db.Column(db.Integer)
+    # Stopped container created ahead of time to replace this one on a recreate reset (None until made)
+    standby_id = db.Column(db.String(512))
     team = relationship("Teams", foreign_keys=[team_id])
     challenge = relationship(ContainerChallengeModel,
                              foreign_keys=[challenge_id])
 
+    @property
+    def pending(self) -> bool:
+        return self.container_id.startswith(self.PENDING_PREFIX)
+
+
+class ContainerReclaimModel(db.Model):
+    """Why a team's container was stopped early, so the team can be told"""
+    __mapper_args__ = {"polymorphic_identity": "container_reclaim"}
+    challenge_id = db.Column(
+        db.Integer, db.ForeignKey("challenges.id", ondelete="CASCADE"), primary_key=True
+    )
+    team_id = db.Column(
+        db.Integer, db.ForeignKey("teams.id", ondelete="CASCADE"), primary_key=True
+    )
+    reason = db.Column(db.Text)
+    timestamp = db.Column(db.Integer)
+
+
+class ContainerPoolModel(db.Model):
+    """Pre-started containers that have not been handed to a team yet"""
+    __mapper_args__ = {"polymorphic_identity": "container_pool"}
+    container_id = db.Column(db.String(512), primary_key=True)
+    challenge_id = db.Column(
+        db.Integer, db.ForeignKey("challenges.id", ondelete="CASCADE"), index=True
+    )
+    image = db.Column(db.Text)
+    command = db.Column(db.Text, default="")
+    host = db.Column(db.String(128))
+    port = db.Column(db.Integer)
+    timestamp = db.Column(db.Integer)
+    challenge = relationship(ContainerChallengeModel,
+                             foreign_keys=[challenge_id])
+
+
+class ContainerReplicaModel(db.Model):
+    """Containers shared by every team, for challenges in shared-instance mode"""
+    __mapper_args__ = {"polymorphic_identity": "container_replica"}
+    container_id = db.Column(db.String(512), primary_key=True)
+    challenge_id = db.Column(
+        db.Integer, db.ForeignKey("challenges.id", ondelete="CASCADE"), index=True
+    )
+    image = db.Column(db.Text)
+    command = db.Column(db.Text, default="")
+    host = db.Column(db.String(128))
+    port = db.Column(db.Integer)
+    timestamp = db.Column(db.Integer)
+    # Draining replicas get no new teams and are killed once their teams' assignments have expired
+    draining = db.Column(db.Boolean, default=False)
+    challenge = relationship(ContainerChallengeModel,
+                             foreign_keys=[challenge_id])
+
+
+class ContainerAssignmentModel(db.Model):
+    """The shared replica a team was given, until the assignment expires"""
+    __mapper_args__ = {"polymorphic_identity": "container_assignment"}
+    challenge_id = db.Column(
+        db.Integer, db.ForeignKey("challenges.id", ondelete="CASCADE"), primary_key=True
+    )
+    team_id = db.Column(
+        db.Integer, db.ForeignKey("teams.id", ondelete="CASCADE"), primary_key=True
+    )
+    container_id = db.Column(db.String(512), index=True)
+    expires = db.Column(db.Integer, index=True)
+
+
+class ContainerEventModel(db.Model):
+    """Container events for players' live status streams, read by the event publisher in every process"""
+    __mapper_args__ = {"polymorphic_identity": "container_event"}
+    id = db.Column(db.Integer, primary_key=True)
+    team_id = db.Column(
+        db.Integer, db.ForeignKey("teams.id", ondelete="CASCADE"), index=True
+    )
+    challenge_id = db.Column(
+        db.Integer, db.ForeignKey("challenges.id", ondelete="CASCADE")
+    )
+    # One of progress, ready, renewed, expiring, killed or failed
+    event = db.Column(db.String(16))
+    # JSON object with the event's details
+    data = db.Column(db.Text)
+    timestamp = db.Column(db.Integer, index=True)
+
+
+class ContainerJobModel(db.Model):
+    """Background provisioning jobs, polled by the client until the container is ready"""
+    __mapper_args__ = {"polymorphic_identity": "container_job"}
+    # Requests look for an unfinished job for the same challenge and team
+    __table_args__ = (
+        db.Index("container_job_challenge_team", "challenge_id", "team_id"),
+    )
+    id = db.Column(db.String(32), primary_key=True)
+    challenge_id = db.Column(
+        db.Integer, db.ForeignKey("challenges.id", ondelete="CASCADE")
+    )
+    team_id = db.Column(
+        db.Integer, db.ForeignKey("teams.id", ondelete="CASCADE")
+    )
+    reset = db.Column(db.Boolean, default=False)
+    # One of queued, starting, ready or failed
+    status = db.Column(db.String(16), default="queued", index=True)
+    error = db.Column(db.Text)
+    hostname = db.Column(db.Text)
+    port = db.Column(db.Integer)
+    expires = db.Column(db.Integer)
+    created = db.Column(db.Integer)
+    updated = db.Column(db.Integer, index=True)
+
+
+class ContainerPortModel(db.Model):
+    """Host ports handed out from the configured port range"""
+    __mapper_args__ = {"polymorphic_identity": "container_port"}
+    host = db.Column(db.String(128), primary_key=True)
+    port = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    # None while the container is being started
+    container_id = db.Column(db.String(512), index=True)
+    timestamp = db.Column(db.Integer)
+
+
+class ContainerBulkJobModel(db.Model):
+    """Background admin operations over many containers, e.g. purging every container"""
+    __mapper_args__ = {"polymorphic_identity": "container_bulk_job"}
+    id = db.Column(db.String(32), primary_key=True)
+    # One of purge, kill_challenge, kill_team or renew_all
+    operation = db.Column(db.String(32))
+    # Challenge or team id for kill_challenge and kill_team
+    target = db.Column(db.Integer)
+    # One of queued, running, done or failed
+    status = db.Column(db.String(16), default="queued")
+    total = db.Column(db.Integer, default=0)
+    done = db.Column(db.Integer, default=0)
+    failed = db.Column(db.Integer, default=0)
+    # JSON list of {"container_id", "error"} for containers that could not be killed
+    errors = db.Column(db.Text, default="[]")
+    created = db.Column(db.Integer)
+    updated = db.Column(db.Integer)
+
+
+class ContainerLeaseModel(db.Model):
+    """Leases held by one plugin process at a time, e.g. the lease for running the maintenance jobs"""
+    __mapper_args__ = {"polymorphic_identity": "container_lease"}
+    name = db.Column(db.String(64), primary_key=True)
+    # Unique id of the holding process
+    holder = db.Column(db.String(128))
+    # Machine name and process id of the holder, for display
+    hostname = db.Column(db.String(256))
+    pid = db.Column(db.Integer)
+    acquired = db.Column(db.Integer)
+    expires = db.Column(db.Integer)
+
 
 class ContainerSettingsModel(db.Model):
     __mapper_args__ = {"polymorphic_identity": "container_settings"}
@@ -0,0 +1,161 @@
+import time
+import threading
+import collections
+
+from flask import Flask
+from sqlalchemy.exc import IntegrityError
+
+from CTFd.models import db
+from .models import ContainerInfoModel, ContainerPoolModel, ContainerPortModel, ContainerReplicaModel
+
+
+def parse_port_range(value: "str|None") -> "range|None":
+    """Parse a "start-end" port range setting. Blank means Docker picks a random port."""
+    from .container_manager import ContainerException
+
+    if value is None or value.strip() == "":
+        return None
+
+    try:
+        start, end = (int(part) for part in value.split("-", 1))
+    except ValueError:
+        raise ContainerException(
+            "Port range must look like 30000-31000")
+
+    if not (1 <= start <= end <= 65535):
+        raise ContainerException(
+            "Port range must be between 1 and 65535")
+
+    return range(start, end + 1)
+
+
+class PortAllocator:
+    """
+    Hands out host ports from a configured range, so a container's port is known before it starts.
+
+    Each host has an in-memory free list. A port is only taken once a ContainerPortModel row for it has been inserted,
+    so web workers sharing the database never hand out the same port. Released ports go to the front of the free list
+    and are reused right away.
+    """
+
+    JOB_ID = "container_port_sweep"
+
+    SWEEP_INTERVAL_SECONDS = 300
+    # Reservations without a live container row are only swept once they are this old, so that reservations for
+    # containers that are still being created are left alone
+    STALE_RESERVATION_SECONDS = 600
+
+    def __init__(self, port_range: range, app: Flask, scheduler, leader=None) -> None:
+        self.port_range = port_range
+        self.app = app
+        self.scheduler = scheduler
+        # Only the lease holder deletes stale reservations
+        self.leader = leader
+        self.lock = threading.Lock()
+        self.free: "dict[str, collections.deque]" = {}
+
+    def start(self) -> None:
+        self.scheduler.add_job(
+            func=self.sweep,
+            trigger="interval",
+            seconds=self.SWEEP_INTERVAL_SECONDS,
+            id=self.JOB_ID,
+            replace_existing=True,
+            coalesce=True,
+        )
+
+    def load_free_list(self, host: str) -> collections.deque:
+        reserved = {row.port for row in ContainerPortModel.query.filter_by(
+            host=host).all()}
+        return collections.deque(port for port in self.port_range if port not in reserved)
+
+    def allocate(self, host: str) -> int:
+        """Reserve a free port on the host. Must be called with an app context."""
+        from .container_manager import ContainerException
+
+        reloaded = False
+        while True:
+            with self.lock:
+                if host not in self.free or (len(self.free[host]) == 0 and not reloaded):
+                    self.free[host] = self.load_free_list(host)
+                    reloaded = True
+                if len(self.free[host]) == 0:
+                    raise ContainerException(
+                        "No free ports are left on the Docker host, please try again later.")
+                port = self.free[host].popleft()
+
+            # The primary key on (host, port) makes the insert the reservation; a savepoint keeps a conflict from
+            # rolling back the rest of the session
+            try:
+                with db.session.begin_nested():
+                    db.session.add(ContainerPortModel(
+                        host=host, port=port, timestamp=int(time.time())))
+                db.session.commit()
+                return port
+            except IntegrityError:
+                # Another worker took this port
+                continue
+
+    def assign(self, host: str, port: int, container_id: str) -> None:
+        ContainerPortModel.query.filter_by(host=host, port=port).update(
+            {"container_id": container_id}, synchronize_session=False)
+        db.session.commit()
+
+    def release(self, container_ids: "list[str]") -> None:
+        """Free the ports of the given containers. Must be called with an app context."""
+        if len(container_ids) == 0:
+            return
+
+        rows: "list[ContainerPortModel]" = ContainerPortModel.query.filter(
+            ContainerPortModel.container_id.in_(container_ids)).all()
+        if len(rows) == 0:
+            return
+
+        released = [(row.host, row.port) for row in rows]
+        ContainerPortModel.query.filter(
+            ContainerPortModel.container_id.in_(container_ids)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+
+        with self.lock:
+            for host, port in released:
+                if host in self.free and port in self.port_range:
+                    self.free[host].appendleft(port)
+
+    def release_port(self, host: str, port: int) -> None:
+        """Free a reserved port that never got a container"""
+        ContainerPortModel.query.filter_by(
+            host=host, port=port).delete(synchronize_session=False)
+        db.session.commit()
+
+        with self.lock:
+            if host in self.free:
+                self.free[host].appendleft(port)
+
+    def sweep(self) -> None:
+        """Drop reservations whose container is gone, e.g. after a crash, and rebuild the free lists"""
+        try:
+            with self.app.app_context():
+                if self.leader is None or self.leader.is_leader():
+                    self.delete_stale()
+
+                with self.lock:
+                    for host in list(self.free.keys()):
+                        self.free[host] = self.load_free_list(host)
+        except Exception as err:
+            print("[Container Ports] Sweep failed:", err)
+
+    def delete_stale(self) -> None:
+        cutoff = int(time.time() - self.STALE_RESERVATION_SECONDS)
+        ContainerPortModel.query.filter(
+            ContainerPortModel.timestamp < cutoff,
+            (ContainerPortModel.container_id == None) | (
+                ContainerPortModel.container_id.notin_(
+                    db.session.query(ContainerInfoModel.container_id)) &
+                ContainerPortModel.container_id.notin_(
+                    db.session.query(ContainerPoolModel.container_id)) &
+                ContainerPortModel.container_id.notin_(
+                    db.session.query(ContainerReplicaModel.container_id))
+            ),
+        ).delete(synchronize_session=False)
+        db.session.commit()
@@ -0,0 +1,251 @@
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask
+
+from CTFd.models import db
+from .models import ContainerJobModel
+from .admission import AdmissionControl, fair_order
+from .metrics import REQUESTS, PROVISION_SECONDS
+from .events import publish_event, publish_events, PROGRESS, READY, FAILED
+
+
+class ProvisioningQueue:
+    """
+    Runs container provisioning (Docker run, port lookup and database insert) on a bounded pool of background workers
+    so that web workers don't block on the Docker daemon.
+
+    Job state is kept in ContainerJobModel so any web worker can answer a status request, not only the one that queued
+    the job. New jobs wait in the queued state until admission control lets them start; whichever process has a free
+    worker when capacity frees up starts the next jobs, so the queue is shared by every process.
+    """
+
+    # Number of provisioning jobs running at once in this process
+    MAX_WORKERS = 8
+    # Jobs waiting in the queue, over all processes, before new requests are turned away
+    MAX_QUEUED = 1024
+    # Finished jobs are kept this long so clients can still read their result
+    JOB_RETENTION_SECONDS = 3600
+    # Starting jobs older than this are assumed to belong to a worker that died
+    STALE_JOB_SECONDS = 300
+    PRUNE_INTERVAL_SECONDS = 60
+    # How often queued jobs are checked when nothing else triggers a dispatch, e.g. when another process killed a
+    # container
+    DISPATCH_INTERVAL_SECONDS = 2
+
+    def __init__(self, app: Flask, provision, admission: AdmissionControl, max_workers: int = MAX_WORKERS) -> None:
+        """
+        :param provision: Callable taking (chal_id, team_id, reset) and returning a dict with the hostname, port and
+        expires of the container. It should raise ContainerException on failure.
+        """
+        self.app = app
+        self.provision = provision
+        self.admission = admission
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="container-provision")
+        self.pending = 0
+        self.pending_lock = threading.Lock()
+        self.dispatch_lock = threading.Lock()
+        self.last_prune = 0
+
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self.watch, name="container-dispatch", daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def watch(self) -> None:
+        while not self.stopped.wait(self.DISPATCH_INTERVAL_SECONDS):
+            try:
+                with self.app.app_context():
+                    self.dispatch()
+            except Exception as err:
+                print("[Container Provisioning] Dispatch failed:", err)
+
+    def submit(self, chal_id: int, team_id: int, reset: bool = False) -> ContainerJobModel:
+        from .container_manager import ContainerException
+
+        self.prune()
+
+        # Requests for the same challenge and team share a job that hasn't finished yet
+        active: ContainerJobModel = ContainerJobModel.query.filter(
+            ContainerJobModel.challenge_id == chal_id,
+            ContainerJobModel.team_id == team_id,
+            (ContainerJobModel.status == "queued") | (
+                (ContainerJobModel.status == "starting") &
+                (ContainerJobModel.updated >= int(
+                    time.time() - self.STALE_JOB_SECONDS))
+            ),
+        ).first()
+        if active is not None:
+            return active
+
+        if ContainerJobModel.query.filter_by(status="queued").count() >= self.MAX_QUEUED:
+            REQUESTS.inc(action="reset" if reset else "request",
+                         outcome="rejected")
+            raise ContainerException(
+                "Too many containers are waiting to start right now, please try again shortly.")
+
+        now = int(time.time())
+        job = ContainerJobModel(
+            id=uuid.uuid4().hex,
+            challenge_id=chal_id,
+            team_id=team_id,
+            reset=reset,
+            status="queued",
+            created=now,
+            updated=now,
+        )
+        db.session.add(job)
+        publish_event(team_id, chal_id, PROGRESS, status="queued")
+        db.session.commit()
+
+        self.dispatch()
+        return job
+
+    def dispatch(self) -> None:
+        """Start as many queued jobs as admission control and this process's free workers allow"""
+        with self.dispatch_lock:
+            with self.pending_lock:
+                free = self.max_workers - self.pending
+            if free <= 0:
+                return
+
+            # Cheap check before taking the admission lock
+            if ContainerJobModel.query.filter_by(status="queued").first() is None:
+                db.session.commit()
+                return
+
+            self.admission.lock()
+            # Read again under the lock, since another process may have started some of these jobs
+            queued: "list[ContainerJobModel]" = ContainerJobModel.query.filter_by(
+                status="queued").all()
+            now = int(time.time())
+            admitted = self.admission.admit(
+                queued, now - self.STALE_JOB_SECONDS, free)
+            for job in admitted:
+                job.status = "starting"
+                job.updated = now
+            publish_events([(job.team_id, job.challenge_id, PROGRESS, {"status": "starting"})
+                            for job in admitted])
+            job_ids = [job.id for job in admitted]
+            # Releases the admission lock
+            db.session.commit()
+
+            with self.pending_lock:
+                self.pending += len(job_ids)
+            for job_id in job_ids:
+                self.executor.submit(self.run, job_id)
+
+    def run(self, job_id: str) -> None:
+        from .container_manager import ContainerException
+
+        try:
+            with self.app.app_context():
+                job: ContainerJobModel = ContainerJobModel.query.filter_by(
+                    id=job_id).first()
+                if job is None:
+                    return
+
+                try:
+                    result = self.provision(
+                        job.challenge_id, job.team_id, job.reset)
+                except ContainerException as err:
+                    db.session.rollback()
+                    job.error = str(err)
+                    self.finish(job, "failed")
+                    return
+                except Exception as err:
+                    print("[Container Provisioning] Job failed:", err)
+                    db.session.rollback()
+                    job.error = "Could not start container"
+                    self.finish(job, "failed")
+                    return
+
+                job.hostname = result.get("hostname")
+                job.port = result.get("port")
+                job.expires = result.get("expires")
+                self.finish(job, "ready")
+        finally:
+            with self.pending_lock:
+                self.pending -= 1
+
+            # A worker is free again, so the next queued job may be able to start
+            try:
+                with self.app.app_context():
+                    self.dispatch()
+            except Exception as err:
+                print("[Container Provisioning] Dispatch failed:", err)
+
+    def set_status(self, job: ContainerJobModel, status: str) -> None:
+        job.status = status
+        job.updated = int(time.time())
+        db.session.commit()
+
+    def finish(self, job: ContainerJobModel, status: str) -> None:
+        action = "reset" if job.reset else "request"
+        REQUESTS.inc(action=action, outcome=status)
+        PROVISION_SECONDS.observe(
+            max(0, time.time() - job.created), action=action, outcome=status)
+
+        # Teammates watching the challenge see the result too
+        if status == "ready":
+            publish_event(job.team_id, job.challenge_id, READY,
+                          hostname=job.hostname, port=job.port, expires=job.expires)
+        else:
+            publish_event(job.team_id, job.challenge_id,
+                          FAILED, error=job.error)
+        self.set_status(job, status)
+
+    def queue_position(self, job: ContainerJobModel) -> "int|None":
+        """1-based position of a queued job in the fair order, or None if it isn't queued"""
+        if job.status != "queued":
+            return None
+
+        queued = ContainerJobModel.query.filter_by(status="queued").all()
+        for position, queued_job in enumerate(fair_order(queued), start=1):
+            if queued_job.id == job.id:
+                return position
+        return None
+
+    def admission_status(self) -> dict:
+        return self.admission.status(int(time.time() - self.STALE_JOB_SECONDS))
+
+    def prune(self) -> None:
+        now = time.time()
+        if now - self.last_prune < self.PRUNE_INTERVAL_SECONDS:
+            return
+        self.last_prune = now
+
+        # Queued jobs are kept however long they wait
+        ContainerJobModel.query.filter(
+            ContainerJobModel.status != "queued",
+            ContainerJobModel.updated < int(now - self.JOB_RETENTION_SECONDS),
+        ).delete(synchronize_session=False)
+        db.session.commit()
+
+    def shutdown(self) -> None:
+        self.stopped.set()
+        self.executor.shutdown(wait=False)
+
+
+def job_to_dict(job: ContainerJobModel, position: "int|None" = None) -> dict:
+    data = {
+        "job_id": job.id,
+        "status": job.status,
+    }
+    if job.status == "queued" and position is not None:
+        data["position"] = position
+    elif job.status == "ready":
+        data.update({
+            "hostname": job.hostname,
+            "port": job.port,
+            "expires": job.expires,
+        })
+    elif job.status == "failed":
+        data["error"] = job.error
+    return data
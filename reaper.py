@@ -0,0 +1,143 @@
+import time
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask
+from sqlalchemy.sql import func
+
+from CTFd.models import db
+from .models import ContainerInfoModel
+from .metrics import REAPER_PASS_SECONDS, REAPED
+from .events import publish_events, KILLED
+
+
+class ExpiryReaper:
+    """
+    Kills containers once their expiry deadline has passed.
+
+    Instead of scanning every row on a fixed interval, the reaper only queries rows that are due (using the index on
+    ContainerInfoModel.expires) and then schedules its next run for the earliest remaining deadline.
+    """
+
+    JOB_ID = "container_expiry_reaper"
+
+    # Never sleep longer than this, so deadlines written by other processes are picked up
+    MAX_SLEEP_SECONDS = 60
+    # Number of expired containers killed in one pass
+    BATCH_SIZE = 500
+    # Number of concurrent Docker kill calls
+    MAX_WORKERS = 16
+    # Containers whose kill failed are retried after this long rather than in a tight loop on their past deadline
+    RETRY_SECONDS = 10
+
+    def __init__(self, container_manager, app: Flask, scheduler) -> None:
+        self.container_manager = container_manager
+        self.app = app
+        self.scheduler = scheduler
+        self.next_run = None
+        # How far behind schedule the last pass was, in seconds
+        self.lag_seconds = 0.0
+        self.last_run = None
+        self.last_killed = 0
+        self.last_failed = 0
+
+    def start(self) -> None:
+        self.schedule(time.time())
+
+    def schedule(self, timestamp: float) -> None:
+        self.next_run = timestamp
+        self.scheduler.add_job(
+            func=self.run,
+            trigger="date",
+            run_date=datetime.datetime.fromtimestamp(
+                timestamp, tz=datetime.timezone.utc),
+            id=self.JOB_ID,
+            replace_existing=True,
+            misfire_grace_time=None,
+        )
+
+    def notify(self, expires: int) -> None:
+        """Wake the reaper earlier if a new deadline comes before its next scheduled run"""
+        if not self.container_manager.is_leader():
+            # The leader picks the deadline up within MAX_SLEEP_SECONDS
+            return
+        if self.next_run is None or expires < self.next_run:
+            self.schedule(expires)
+
+    def run(self) -> None:
+        if not self.container_manager.is_leader():
+            # Another process runs the reaper; check again in case it dies
+            self.schedule(time.time() + self.MAX_SLEEP_SECONDS)
+            return
+
+        try:
+            with REAPER_PASS_SECONDS.time(), self.app.app_context():
+                self.reap()
+                next_deadline = db.session.query(
+                    func.min(ContainerInfoModel.expires)).scalar()
+        except Exception as err:
+            print("[Container Expiry Job] Reaper pass failed:", err)
+            next_deadline = None
+
+        now = time.time()
+        next_run = now + self.MAX_SLEEP_SECONDS
+        if next_deadline is not None:
+            next_run = max(now, min(next_run, next_deadline))
+        if self.last_failed > 0:
+            next_run = max(next_run, now + self.RETRY_SECONDS)
+        self.schedule(next_run)
+
+    def reap(self) -> None:
+        now = time.time()
+        self.last_run = now
+
+        expired: "list[ContainerInfoModel]" = (
+            ContainerInfoModel.query
+            .filter(ContainerInfoModel.expires <= int(now))
+            .order_by(ContainerInfoModel.expires)
+            .limit(self.BATCH_SIZE)
+            .all()
+        )
+
+        if len(expired) == 0:
+            self.lag_seconds = 0.0
+            self.last_killed = 0
+            self.last_failed = 0
+            return
+
+        # The oldest deadline tells us how far behind schedule we are
+        self.lag_seconds = max(0.0, now - expired[0].expires)
+
+        container_ids = [container.container_id for container in expired]
+        hosts = [container.host for container in expired]
+        # Kills on different hosts run in parallel as well
+        with ThreadPoolExecutor(max_workers=min(self.MAX_WORKERS, len(container_ids))) as executor:
+            results = list(executor.map(self.kill, container_ids, hosts))
+
+        # Rows whose kill failed stay for the next pass, so their containers aren't left running without a row
+        killed = [container for container, ok in zip(expired, results) if ok]
+        killed_ids = [container.container_id for container in killed]
+        self.last_failed = len(expired) - len(killed)
+        self.last_killed = len(killed)
+        if len(killed) == 0:
+            return
+
+        ContainerInfoModel.query.filter(
+            ContainerInfoModel.container_id.in_(killed_ids)
+        ).delete(synchronize_session=False)
+        publish_events([(container.team_id, container.challenge_id, KILLED, {"reason": "Your container expired."})
+                        for container in killed])
+        db.session.commit()
+
+        self.container_manager.release_ports(killed_ids)
+
+        REAPED.inc(len(killed_ids))
+
+    def kill(self, container_id: str, host: "str|None") -> bool:
+        """Kill one container and return whether it is gone. A container that no longer exists counts as killed."""
+        try:
+            self.container_manager.kill_container(container_id, host)
+        except Exception as err:
+            print(f"[Container Expiry Job] Could not kill {container_id}:", err)
+            return False
+        return True
@@ -0,0 +1,204 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask
+import docker
+
+from CTFd.models import db
+from .models import ContainerInfoModel, ContainerPoolModel, ContainerReplicaModel
+from .metrics import RECONCILED
+from .events import publish_events, KILLED
+from .shared import delete_assignments
+
+
+class OrphanReconciler:
+    """
+    Brings Docker and the database back in line after leaks, e.g. a kill that failed after its row was deleted.
+
+    Each pass lists the plugin's containers once per host and diffs them against the team container, warm pool and
+    shared replica rows. Containers without a row are removed, and rows whose container is gone are deleted. Anything
+    created within the grace period is left alone, since it may belong to a request that is still starting its
+    container, and hosts that can't be listed are skipped entirely.
+    """
+
+    JOB_ID = "container_orphan_reconciler"
+
+    INTERVAL_SECONDS = 300
+    # Containers and rows younger than this may be part of a creation that is still in progress
+    GRACE_SECONDS = 300
+    # Number of concurrent Docker remove calls
+    MAX_WORKERS = 16
+
+    def __init__(self, container_manager, app: Flask, scheduler) -> None:
+        self.container_manager = container_manager
+        self.app = app
+        self.scheduler = scheduler
+        # Passes run one at a time, whether scheduled or started by an admin
+        self.lock = threading.Lock()
+        self.last_report: "dict|None" = None
+
+    def start(self) -> None:
+        self.scheduler.add_job(
+            func=self.run,
+            trigger="interval",
+            seconds=self.INTERVAL_SECONDS,
+            id=self.JOB_ID,
+            replace_existing=True,
+            coalesce=True,
+        )
+
+    def run(self) -> None:
+        if not self.container_manager.is_leader():
+            return
+
+        try:
+            with self.app.app_context():
+                self.reconcile()
+        except Exception as err:
+            print("[Container Reconciler] Reconciliation failed:", err)
+
+    def reconcile(self) -> dict:
+        """Run one pass. Must be called with an app context."""
+        with self.lock:
+            return self.reconcile_locked()
+
+    def reconcile_locked(self) -> dict:
+        from .container_manager import ContainerException
+
+        now = int(time.time())
+        cutoff = now - self.GRACE_SECONDS
+
+        # Every row that points at a container, as (container_id, host name, timestamp, model)
+        rows = []
+        for model in (ContainerInfoModel, ContainerPoolModel, ContainerReplicaModel):
+            for container_id, host, timestamp in db.session.query(
+                    model.container_id, model.host, model.timestamp).all():
+                # Reservations have no container yet and expire on their own
+                if container_id.startswith(ContainerInfoModel.PENDING_PREFIX):
+                    continue
+                try:
+                    rows.append((container_id, self.container_manager.get_host(
+                        host).name, timestamp, model))
+                except ContainerException:
+                    # The row's host was removed from the settings
+                    continue
+        # Stopped standby containers belong to their team container's row
+        standbys = {standby_id: host for standby_id, host in db.session.query(
+            ContainerInfoModel.standby_id, ContainerInfoModel.host
+        ).filter(ContainerInfoModel.standby_id != None).all()}
+        db.session.commit()
+
+        wanted: "dict[str, list[str]]" = {}
+        for container_id, host, _, _ in rows:
+            wanted.setdefault(host, []).append(container_id)
+
+        def list_host(host) -> "dict[str, tuple[str, int]]|None":
+            try:
+                return host.list_containers(wanted.get(host.name))
+            except Exception as err:
+                print(
+                    f"[Container Reconciler] Could not list containers on {host.name}:", err)
+                return None
+
+        listed = self.container_manager.map_hosts(list_host)
+        reachable = {host: containers for host,
+                     containers in listed.items() if containers is not None}
+
+        # Rows whose container is gone
+        stale_rows: "dict[type, list[str]]" = {}
+        known = set()
+        for container_id, host, timestamp, model in rows:
+            known.add(container_id)
+            if host not in reachable or (timestamp or 0) >= cutoff:
+                continue
+            if container_id not in reachable[host]:
+                stale_rows.setdefault(model, []).append(container_id)
+
+        known.update(standbys.keys())
+
+        # Standbys that are gone are forgotten, so the warm pool makes new ones
+        lost_standbys = []
+        for standby_id, host in standbys.items():
+            try:
+                name = self.container_manager.get_host(host).name
+            except ContainerException:
+                continue
+            if name in reachable and standby_id not in reachable[name]:
+                lost_standbys.append(standby_id)
+        if len(lost_standbys) > 0:
+            ContainerInfoModel.query.filter(
+                ContainerInfoModel.standby_id.in_(lost_standbys)
+            ).update({"standby_id": None}, synchronize_session=False)
+            db.session.commit()
+
+        # Containers without a row, whether running or left behind stopped
+        to_remove: "list[tuple[str, str]]" = []
+        for host, containers in reachable.items():
+            for container_id, (_, created) in containers.items():
+                if container_id not in known and created < cutoff:
+                    to_remove.append((container_id, host))
+
+        dropped = self.drop_rows(stale_rows)
+        removed = self.remove_containers(to_remove)
+
+        report = {
+            "timestamp": now,
+            "hosts_checked": len(reachable),
+            "hosts_skipped": len(listed) - len(reachable),
+            "containers_removed": removed,
+            "removal_failures": len(to_remove) - removed,
+            "rows_dropped": dropped,
+        }
+        self.last_report = report
+        RECONCILED.inc(removed, kind="container")
+        RECONCILED.inc(dropped, kind="row")
+
+        if removed > 0 or dropped > 0:
+            print(
+                f"[Container Reconciler] Removed {removed} orphaned containers and dropped {dropped} stale rows")
+        return report
+
+    def drop_rows(self, stale_rows: "dict[type, list[str]]") -> int:
+        # Teams whose container vanished are told, like for any other kill
+        team_container_ids = stale_rows.get(ContainerInfoModel, [])
+        if len(team_container_ids) > 0:
+            owners = db.session.query(ContainerInfoModel.team_id, ContainerInfoModel.challenge_id).filter(
+                ContainerInfoModel.container_id.in_(team_container_ids)).all()
+            publish_events([(team_id, challenge_id, KILLED, {"reason": "Your container stopped."})
+                            for team_id, challenge_id in owners])
+
+        container_ids = []
+        for model, ids in stale_rows.items():
+            model.query.filter(model.container_id.in_(ids)).delete(
+                synchronize_session=False)
+            container_ids.extend(ids)
+
+        # Teams assigned to a replica that is gone get a new one on their next request
+        replica_ids = stale_rows.get(ContainerReplicaModel, [])
+        if len(replica_ids) > 0:
+            delete_assignments(replica_ids)
+        db.session.commit()
+
+        self.container_manager.release_ports(container_ids)
+        return len(container_ids)
+
+    def remove_containers(self, containers: "list[tuple[str, str]]") -> int:
+        from .container_manager import ContainerException
+
+        if len(containers) == 0:
+            return 0
+
+        def remove(target: "tuple[str, str]") -> bool:
+            container_id, host = target
+            try:
+                self.container_manager.get_host(
+                    host).remove_container(container_id)
+            except (ContainerException, docker.errors.APIError) as err:
+                print(
+                    f"[Container Reconciler] Could not remove container {container_id}:", err)
+                return False
+            return True
+
+        with ThreadPoolExecutor(max_workers=min(self.MAX_WORKERS, len(containers))) as executor:
+            return sum(executor.map(remove, containers))
@@ -0,0 +1,103 @@
+import time
+import uuid
+
+from sqlalchemy.exc import IntegrityError
+
+from CTFd.models import db
+from .models import ContainerInfoModel, ContainerReclaimModel
+
+# How often a request waiting for another request's container checks whether it is ready
+POLL_INTERVAL_SECONDS = 0.5
+# How long a request waits for another request's container before giving up
+WAIT_SECONDS = 120
+# Reservations older than this belong to a worker that died while creating the container
+STALE_SECONDS = 300
+
+
+def reserve_container(container_manager, challenge_id: int, team_id: int) -> "tuple[ContainerInfoModel|None, str|None]":
+    """
+    Claim the right to create a team's container for a challenge, or find the container another request created.
+
+    The reservation is a ContainerInfoModel row with a pending container id. The unique index on challenge and team
+    makes inserting it atomic across workers, so only one request creates the container and the others wait for it.
+
+    :return: (row of the running container, None), or (None, container id of the new reservation)
+    """
+    from .container_manager import ContainerException
+
+    deadline = time.time() + WAIT_SECONDS
+    while True:
+        existing: ContainerInfoModel = ContainerInfoModel.query.filter_by(
+            challenge_id=challenge_id, team_id=team_id).first()
+
+        if existing is None:
+            now = int(time.time())
+            reservation_id = ContainerInfoModel.PENDING_PREFIX + uuid.uuid4().hex
+            db.session.add(ContainerInfoModel(
+                container_id=reservation_id,
+                challenge_id=challenge_id,
+                team_id=team_id,
+                timestamp=now,
+                expires=now + container_manager.expiration_seconds,
+            ))
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # Another request reserved it first
+                db.session.rollback()
+                continue
+            return None, reservation_id
+
+        if not existing.pending:
+            # Check if Docker says the container is still running before returning it
+            if container_manager.is_container_running(existing.container_id, existing.host):
+                return existing, None
+
+            # The container must have died or been killed, so remove it and reserve a new one
+            delete_container_row(existing.container_id)
+            container_manager.release_ports([existing.container_id])
+            continue
+
+        if existing.timestamp is None or existing.timestamp < time.time() - STALE_SECONDS:
+            delete_container_row(existing.container_id)
+            continue
+
+        if time.time() > deadline:
+            raise ContainerException(
+                "Your container is still starting, please try again shortly.")
+
+        # End the transaction so the next read sees the other request's commit
+        db.session.rollback()
+        time.sleep(POLL_INTERVAL_SECONDS)
+
+
+def fulfil_reservation(container_manager, reservation_id: str, challenge_id: int, team_id: int, container_id: str,
+                       host: "str|None", port: "int|str") -> "int|None":
+    """
+    Turn a reservation into the row of the created container. Also commits a warm pool claim made beforehand.
+
+    :return: Expiry of the container, or None if the reservation was removed in the meantime, e.g. by an admin
+    """
+    now = int(time.time())
+    expires = now + container_manager.expiration_seconds
+
+    updated = ContainerInfoModel.query.filter_by(container_id=reservation_id).update({
+        "container_id": container_id,
+        "host": host,
+        "port": port,
+        "timestamp": now,
+        "expires": expires,
+    }, synchronize_session=False)
+    if updated > 0:
+        ContainerReclaimModel.query.filter_by(
+            challenge_id=challenge_id, team_id=team_id).delete()
+    db.session.commit()
+
+    return expires if updated > 0 else None
+
+
+def delete_container_row(container_id: str) -> None:
+    """Delete a container's row, or a reservation that won't be fulfilled"""
+    ContainerInfoModel.query.filter_by(
+        container_id=container_id).delete(synchronize_session=False)
+    db.session.commit()
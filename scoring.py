@@ -0,0 +1,125 @@
+from __future__ import division
+
+import math
+
+from flask import Flask
+from sqlalchemy.sql import func
+
+from CTFd.models import db, Solves
+from CTFd.utils.modes import get_model
+
+from .models import ContainerChallengeModel
+
+
+def decayed_value(challenge: ContainerChallengeModel, solve_count: int) -> int:
+    # If the solve count is 0 we shouldn't manipulate the solve count to
+    # let the math update back to normal
+    if solve_count != 0:
+        # We subtract -1 to allow the first solver to get max point value
+        solve_count -= 1
+
+    # It is important that this calculation takes into account floats.
+    # Hence this file uses from __future__ import division
+    value = (
+        ((challenge.minimum - challenge.initial) / (challenge.decay ** 2))
+        * (solve_count ** 2)
+    ) + challenge.initial
+
+    value = math.ceil(value)
+
+    if value < challenge.minimum:
+        value = challenge.minimum
+
+    return value
+
+
+def count_solves(challenge_ids: "list[int]|None" = None) -> "dict[int, int]":
+    """Count the solves by visible, unbanned accounts with one grouped query. Challenges without solves are left out."""
+    Model = get_model()
+
+    query = (
+        db.session.query(Solves.challenge_id, func.count(Solves.id))
+        .join(Model, Solves.account_id == Model.id)
+        .filter(
+            Model.hidden == False,
+            Model.banned == False,
+        )
+    )
+    if challenge_ids is not None:
+        query = query.filter(Solves.challenge_id.in_(challenge_ids))
+
+    return dict(query.group_by(Solves.challenge_id).all())
+
+
+def recount_solves(challenge_ids: "list[int]|None" = None) -> int:
+    """
+    Recount solves from scratch and store the counts and values, correcting any drift in the counters, e.g. after an
+    account was hidden or banned or a solve was deleted.
+
+    :return: Number of challenges whose count was wrong
+    """
+    query = ContainerChallengeModel.query
+    if challenge_ids is not None:
+        query = query.filter(ContainerChallengeModel.id.in_(challenge_ids))
+    challenges: "list[ContainerChallengeModel]" = query.all()
+
+    counts = count_solves([challenge.id for challenge in challenges])
+
+    corrected = 0
+    for challenge in challenges:
+        solve_count = counts.get(challenge.id, 0)
+        if challenge.solve_count != solve_count:
+            corrected += 1
+        challenge.solve_count = solve_count
+        challenge.value = decayed_value(challenge, solve_count)
+    db.session.commit()
+
+    return corrected
+
+
+def record_solve(challenge: ContainerChallengeModel, account) -> None:
+    """Add one solve to the challenge's counter, unless the account doesn't count towards the decay"""
+    if account is None or account.hidden or account.banned:
+        return
+
+    # A single UPDATE, so concurrent solves don't lose increments
+    ContainerChallengeModel.query.filter(
+        ContainerChallengeModel.id == challenge.id,
+        ContainerChallengeModel.solve_count != None,
+    ).update({"solve_count": ContainerChallengeModel.solve_count + 1}, synchronize_session=False)
+    db.session.commit()
+
+
+class SolveRecount:
+    """Recounts every container challenge's solves on a schedule, in case the counters drifted"""
+
+    JOB_ID = "container_solve_recount"
+
+    INTERVAL_SECONDS = 300
+
+    def __init__(self, container_manager, app: Flask, scheduler) -> None:
+        self.container_manager = container_manager
+        self.app = app
+        self.scheduler = scheduler
+
+    def start(self) -> None:
+        self.scheduler.add_job(
+            func=self.run,
+            trigger="interval",
+            seconds=self.INTERVAL_SECONDS,
+            id=self.JOB_ID,
+            replace_existing=True,
+            coalesce=True,
+        )
+
+    def run(self) -> None:
+        if not self.container_manager.is_leader():
+            return
+
+        try:
+            with self.app.app_context():
+                corrected = recount_solves()
+            if corrected > 0:
+                print(f"[Container Scoring] Corrected the solve count of {corrected} challenges")
+        except Exception as err:
+            print("[Container Scoring] Solve recount failed:", err)
@@ -0,0 +1,139 @@
+import uuid
+import threading
+
+from flask import Flask
+
+from CTFd.models import db
+from .models import ContainerSettingsModel
+
+
+class ContainerSettings:
+    """
+    Typed, read-only snapshot of the plugin settings, loaded with a single query.
+
+    Raw values are available like a dictionary (settings.get("docker_hostname")) for templates and host parsing, while
+    value() returns the value parsed to the type in TYPES. Every save writes a new settings_version, so other processes
+    can tell their snapshot is stale by reading that one row.
+    """
+
+    VERSION_KEY = "settings_version"
+
+    # Keys the settings form must always send
+    REQUIRED_KEYS = ("docker_base_url", "docker_hostname",
+                     "container_expiration", "container_maxmemory", "container_maxcpu")
+    # Keys the settings form may leave out
+    OPTIONAL_KEYS = ("docker_hosts", "container_port_range", "container_max_instances",
+                     "container_max_team_instances", "container_cpu_budget", "container_memory_budget",
+                     "metrics_token", "container_idle_minutes", "docker_pool_size")
+
+    # Setting key -> type its value is parsed as; blank or invalid values parse as None
+    TYPES = {
+        "docker_base_url": str,
+        "docker_hostname": str,
+        "docker_hosts": str,
+        "container_expiration": int,
+        "container_maxmemory": int,
+        "container_maxcpu": float,
+        "container_port_range": str,
+        "container_max_instances": int,
+        "container_max_team_instances": int,
+        "container_cpu_budget": float,
+        "container_memory_budget": int,
+        "metrics_token": str,
+        "container_idle_minutes": int,
+        "docker_pool_size": int,
+        "instance_id": str,
+    }
+
+    def __init__(self, values: "dict[str, str]") -> None:
+        self.values = dict(values)
+        self.version = self.values.get(self.VERSION_KEY)
+        self.parsed = {}
+        for key, value_type in self.TYPES.items():
+            self.parsed[key] = self.parse(key, value_type)
+
+    @classmethod
+    def load(cls) -> "ContainerSettings":
+        """Read every setting. Must be called with an app context."""
+        return cls({setting.key: setting.value for setting in ContainerSettingsModel.query.all()})
+
+    def parse(self, key: str, value_type):
+        raw = self.values.get(key)
+        if raw is None or raw.strip() == "":
+            return None
+        try:
+            return value_type(raw.strip()) if value_type is not str else raw
+        except ValueError:
+            print(f"[Container Settings] Ignoring invalid value for {key}: {raw}")
+            return None
+
+    def value(self, key: str, default=None):
+        parsed = self.parsed.get(key)
+        return default if parsed is None else parsed
+
+    def get(self, key: str, default=None) -> "str|None":
+        return self.values.get(key, default)
+
+    def __getitem__(self, key: str) -> "str|None":
+        return self.values[key]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.values
+
+
+def save_settings(values: "dict[str, str]") -> ContainerSettings:
+    """Create or update the given settings and bump the settings version. Must be called with an app context."""
+    rows = {setting.key: setting for setting in ContainerSettingsModel.query.all()}
+
+    values = {**values, ContainerSettings.VERSION_KEY: uuid.uuid4().hex}
+    for key, value in values.items():
+        if key in rows:
+            rows[key].value = value
+        else:
+            rows[key] = ContainerSettingsModel(key=key, value=value)
+            db.session.add(rows[key])
+    db.session.commit()
+
+    return ContainerSettings({key: row.value for key, row in rows.items()})
+
+
+class SettingsWatcher:
+    """
+    Reloads the settings in this process when another process saves them.
+
+    Only the settings_version row is read on every check; the full settings are loaded again when it has changed.
+    """
+
+    INTERVAL_SECONDS = 5
+
+    def __init__(self, container_manager, app: Flask) -> None:
+        self.container_manager = container_manager
+        self.app = app
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self.watch, name="container-settings", daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+
+    def watch(self) -> None:
+        while not self.stopped.wait(self.INTERVAL_SECONDS):
+            try:
+                self.check()
+            except Exception as err:
+                print("[Container Settings] Settings check failed:", err)
+
+    def check(self) -> None:
+        with self.app.app_context():
+            version = ContainerSettingsModel.query.filter_by(
+                key=ContainerSettings.VERSION_KEY).first()
+            if version is None or version.value == self.container_manager.settings.version:
+                return
+
+            settings = ContainerSettings.load()
+
+        print("[Container Settings] Settings changed, reloading")
+        self.container_manager.reload_settings(settings)
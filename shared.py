@@ -0,0 +1,326 @@
+import time
+import math
+
+from sqlalchemy.sql import func
+
+from CTFd.models import db
+from .models import ContainerChallengeModel, ContainerReplicaModel, ContainerAssignmentModel
+from .events import publish_events, KILLED
+from .admission import lock_row
+from .background import BackgroundContainers
+
+
+def delete_assignments(container_ids: "list[str]") -> None:
+    """
+    Drop the assignments to replicas that are going away. Teams whose assignment was still active are told, so their
+    listings change and they request a new replica. Committed with the caller's transaction.
+    """
+    active = db.session.query(ContainerAssignmentModel.team_id, ContainerAssignmentModel.challenge_id).filter(
+        ContainerAssignmentModel.container_id.in_(container_ids),
+        ContainerAssignmentModel.expires >= int(time.time()),
+    ).all()
+    publish_events([(team_id, challenge_id, KILLED, {"reason": "Your container stopped."})
+                    for team_id, challenge_id in active])
+
+    ContainerAssignmentModel.query.filter(
+        ContainerAssignmentModel.container_id.in_(container_ids)
+    ).delete(synchronize_session=False)
+
+
+class SharedReplicas(BackgroundContainers):
+    """
+    Runs a small set of containers shared by every team, for stateless challenges with shared_replicas set.
+
+    A team requesting the challenge is assigned to the serving replica with the fewest active teams, and keeps that
+    replica until its assignment expires. The number of replicas follows the number of teams with an active
+    assignment, up to the challenge's shared_replicas. Replicas that are no longer needed, or that run an outdated
+    image or command, stop taking new teams and are killed once their teams' assignments have expired.
+
+    A request that finds no serving replica starts one itself. Those cold starts are serialized per challenge, so
+    concurrent requests share the first replica instead of each starting their own.
+    """
+
+    JOB_ID = "container_shared_replicas"
+    LOG_NAME = "Container Shared Replicas"
+    # Name of the ContainerLeaseModel row locked during a challenge's cold start, followed by the challenge id
+    COLD_START_LOCK = "shared-replica-"
+
+    SCALE_INTERVAL_SECONDS = 30
+    # Active teams per replica before another replica is started
+    TEAMS_PER_REPLICA = 50
+    # How long an assignment lasts when containers don't expire
+    DEFAULT_ASSIGNMENT_SECONDS = 3600
+
+    def start(self) -> None:
+        self.scheduler.add_job(
+            func=self.scale,
+            trigger="interval",
+            seconds=self.SCALE_INTERVAL_SECONDS,
+            id=self.JOB_ID,
+            replace_existing=True,
+            coalesce=True,
+        )
+
+    @property
+    def assignment_seconds(self) -> int:
+        return self.container_manager.expiration_seconds or self.DEFAULT_ASSIGNMENT_SECONDS
+
+    def assign(self, challenge: ContainerChallengeModel, team_id: int, start: bool = False) -> "dict|None":
+        """
+        Give the team a shared replica of the challenge: the one it already has, or the least-loaded serving one.
+
+        :param start: Start a replica if none is serving. Otherwise None is returned in that case.
+        :return: Dictionary with the hostname, port and expires of the assignment
+        """
+        from .container_manager import ContainerException
+
+        now = int(time.time())
+        expires = now + self.assignment_seconds
+
+        assignment: ContainerAssignmentModel = ContainerAssignmentModel.query.filter_by(
+            challenge_id=challenge.id, team_id=team_id).first()
+        if assignment is not None:
+            replica = ContainerReplicaModel.query.filter_by(
+                container_id=assignment.container_id).first()
+            if replica is not None and self.is_running(replica):
+                assignment.expires = expires
+                db.session.commit()
+                return self.connection_info(replica, expires)
+
+        for replica in self.least_loaded(challenge):
+            if self.is_running(replica):
+                break
+        else:
+            if not start:
+                return None
+            replica = self.cold_start(challenge)
+            if replica is None:
+                raise ContainerException("Could not start container")
+
+        db.session.merge(ContainerAssignmentModel(
+            challenge_id=challenge.id,
+            team_id=team_id,
+            container_id=replica.container_id,
+            expires=expires,
+        ))
+        db.session.commit()
+
+        # Busy replicas are a sign that another one is needed
+        if self.team_count(replica.container_id, now) >= self.TEAMS_PER_REPLICA:
+            self.trigger()
+
+        return self.connection_info(replica, expires)
+
+    def renew(self, challenge_id: int, team_id: int) -> "int|None":
+        """Extend the team's assignment. Returns the new expiry, or None if the team has no assignment."""
+        expires = int(time.time()) + self.assignment_seconds
+        updated = ContainerAssignmentModel.query.filter_by(
+            challenge_id=challenge_id, team_id=team_id
+        ).update({"expires": expires}, synchronize_session=False)
+        db.session.commit()
+        return expires if updated > 0 else None
+
+    def release(self, challenge_id: int, team_id: int) -> bool:
+        """Drop the team's assignment. The replica keeps running for the other teams."""
+        deleted = ContainerAssignmentModel.query.filter_by(
+            challenge_id=challenge_id, team_id=team_id
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        return deleted > 0
+
+    def connection_info(self, replica: ContainerReplicaModel, expires: int) -> dict:
+        return {
+            "status": "shared",
+            "hostname": self.container_manager.get_hostname(replica.host),
+            "port": replica.port,
+            "expires": expires,
+        }
+
+    def is_running(self, replica: ContainerReplicaModel, forget: bool = True) -> bool:
+        """
+        :param forget: Remove the replica if it died. This commits, so it is turned off while a lock is held.
+        """
+        from .container_manager import ContainerException
+
+        try:
+            if self.container_manager.is_container_running(replica.container_id, replica.host):
+                return True
+        except ContainerException:
+            return False
+
+        # The replica died, so forget it and let its teams be assigned elsewhere
+        if forget:
+            self.remove([replica.container_id])
+        return False
+
+    def team_count(self, container_id: str, now: int) -> int:
+        return ContainerAssignmentModel.query.filter(
+            ContainerAssignmentModel.container_id == container_id,
+            ContainerAssignmentModel.expires >= now,
+        ).count()
+
+    def least_loaded(self, challenge: ContainerChallengeModel) -> "list[ContainerReplicaModel]":
+        """Serving replicas of the challenge, fewest active teams first"""
+        replicas: "list[ContainerReplicaModel]" = ContainerReplicaModel.query.filter_by(
+            challenge_id=challenge.id, image=challenge.image, command=challenge.command, draining=False
+        ).order_by(ContainerReplicaModel.timestamp).all()
+
+        loads = self.team_counts([replica.container_id for replica in replicas])
+        return sorted(replicas, key=lambda replica: loads.get(replica.container_id, 0))
+
+    def team_counts(self, container_ids: "list[str]") -> "dict[str, int]":
+        if len(container_ids) == 0:
+            return {}
+
+        return dict(db.session.query(
+            ContainerAssignmentModel.container_id, func.count(
+                ContainerAssignmentModel.team_id)
+        ).filter(
+            ContainerAssignmentModel.container_id.in_(container_ids),
+            ContainerAssignmentModel.expires >= int(time.time()),
+        ).group_by(ContainerAssignmentModel.container_id).all())
+
+    def cold_start(self, challenge: ContainerChallengeModel) -> "ContainerReplicaModel|None":
+        """
+        Start a replica for a challenge that has none serving. Holds the challenge's cold start lock until the new
+        replica is committed, and uses a replica another request started meanwhile instead, if there is one.
+        """
+        # Start a new transaction, so replicas committed while waiting for the lock are seen after it
+        db.session.commit()
+        lock_row(self.COLD_START_LOCK + str(challenge.id))
+
+        for replica in self.least_loaded(challenge):
+            # The caller's commit releases the lock
+            if self.is_running(replica, forget=False):
+                return replica
+
+        replica = self.start_replica(challenge)
+        if replica is None:
+            db.session.rollback()
+        return replica
+
+    def start_replica(self, challenge: ContainerChallengeModel) -> "ContainerReplicaModel|None":
+        result = self.start_container(
+            (challenge.id, challenge.image, challenge.port, challenge.command, challenge.volumes))
+        if result is None:
+            return None
+
+        host, container_id, port = result
+        replica = ContainerReplicaModel(
+            container_id=container_id,
+            challenge_id=challenge.id,
+            image=challenge.image,
+            command=challenge.command,
+            host=host,
+            port=port,
+            timestamp=int(time.time()),
+            draining=False,
+        )
+        db.session.add(replica)
+        db.session.commit()
+        return replica
+
+    def scale(self) -> None:
+        if not self.container_manager.is_leader():
+            return
+
+        try:
+            with self.app.app_context():
+                self.reconcile()
+        except Exception as err:
+            print("[Container Shared Replicas] Scaling failed:", err)
+
+    def reconcile(self) -> None:
+        now = int(time.time())
+        ContainerAssignmentModel.query.filter(
+            ContainerAssignmentModel.expires < now
+        ).delete(synchronize_session=False)
+        db.session.commit()
+
+        replicas: "dict[int, list[ContainerReplicaModel]]" = {}
+        for row in ContainerReplicaModel.query.order_by(ContainerReplicaModel.timestamp).all():
+            replicas.setdefault(row.challenge_id, []).append(row)
+
+        challenges: "list[ContainerChallengeModel]" = ContainerChallengeModel.query.filter(
+            (ContainerChallengeModel.shared_replicas > 0) |
+            ContainerChallengeModel.id.in_(list(replicas.keys()))
+        ).all()
+
+        active_teams = dict(db.session.query(
+            ContainerAssignmentModel.challenge_id, func.count(
+                ContainerAssignmentModel.team_id)
+        ).group_by(ContainerAssignmentModel.challenge_id).all())
+        loads = self.team_counts(
+            [row.container_id for rows in replicas.values() for row in rows])
+
+        to_kill: "list[tuple[str, str]]" = []
+        # Plain values rather than ORM objects, since these are used from worker threads
+        to_start: "list[tuple]" = []
+
+        for challenge in challenges:
+            rows = replicas.get(challenge.id, [])
+            teams = active_teams.get(challenge.id, 0)
+            target = 0
+            if challenge.shared_replicas and challenge.shared_replicas > 0 and teams > 0:
+                target = min(challenge.shared_replicas, math.ceil(
+                    teams / self.TEAMS_PER_REPLICA))
+
+            # Replicas started from an outdated image or command stop taking teams
+            fresh = [row for row in rows if row.image ==
+                     challenge.image and row.command == challenge.command]
+            for row in rows:
+                if row not in fresh:
+                    row.draining = True
+
+            # Prefer keeping the busiest replicas, so the ones drained empty out soonest
+            fresh.sort(key=lambda row: (row.draining,
+                                        -loads.get(row.container_id, 0)))
+            for i, row in enumerate(fresh):
+                row.draining = i >= target
+
+            if len(fresh) < target:
+                spec = (challenge.id, challenge.image, challenge.port,
+                        challenge.command, challenge.volumes)
+                to_start.extend([spec] * (target - len(fresh)))
+
+            to_kill.extend((row.container_id, row.host) for row in rows
+                           if row.draining and loads.get(row.container_id, 0) == 0)
+        db.session.commit()
+
+        if len(to_kill) > 0:
+            self.drain(to_kill)
+
+        if len(to_start) > 0:
+            started = self.start_containers(to_start)
+
+            for (challenge_id, image, _, command, _), result in zip(to_start, started):
+                if result is None:
+                    continue
+                host, container_id, port = result
+                db.session.add(ContainerReplicaModel(
+                    container_id=container_id,
+                    challenge_id=challenge_id,
+                    image=image,
+                    command=command,
+                    host=host,
+                    port=port,
+                    timestamp=now,
+                    draining=False,
+                ))
+            db.session.commit()
+
+    def drain(self, containers: "list[tuple[str, str]]") -> None:
+        """Kill the given (container_id, host) pairs and forget them"""
+        # Remove the rows first so no team is assigned a container that is being killed
+        self.remove([container_id for container_id, _ in containers])
+
+        self.kill_containers(containers)
+
+    def remove(self, container_ids: "list[str]") -> None:
+        delete_assignments(container_ids)
+        ContainerReplicaModel.query.filter(
+            ContainerReplicaModel.container_id.in_(container_ids)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+
+        self.container_manager.release_ports(container_ids)
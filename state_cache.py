@@ -0,0 +1,155 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class ContainerStateCache:
+    """
+    In-process map of container id to state and host port for containers started by this plugin.
+
+    The map is filled by one full list call when the Docker events stream is (re)connected and is then kept up to date
+    from container events, so checking whether a container is alive is a dictionary read instead of an API call. The
+    cache is only trusted while the stream is connected; callers fall back to the Docker API otherwise.
+
+    Removed containers are remembered for a while, so lookups right after a removal don't go to the API either. Older
+    tombstones are dropped, so the map doesn't grow with every container created during an event.
+    """
+
+    # Docker container event -> resulting container state
+    EVENT_STATES = {
+        "create": "created",
+        "start": "running",
+        "restart": "running",
+        "unpause": "running",
+        "pause": "paused",
+        # "kill" only means a signal was sent, which the container may survive, so the state changes on "die"
+        "die": "exited",
+        "stop": "exited",
+        "oom": "exited",
+    }
+
+    RECONNECT_DELAY_SECONDS = 1
+    MAX_RECONNECT_DELAY_SECONDS = 30
+    # Removed containers are remembered this long, and at most this many
+    TOMBSTONE_SECONDS = 600
+    MAX_TOMBSTONES = 10000
+
+    def __init__(self, client, label_filter: str) -> None:
+        self.client = client
+        self.label_filter = label_filter
+        self.states: "dict[str, str]" = {}
+        self.ports: "dict[str, str]" = {}
+        # Container id -> when it was removed, oldest first
+        self.tombstones: "OrderedDict[str, float]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.ready = False
+        self.stopped = threading.Event()
+        self.stream = None
+        self.thread = threading.Thread(
+            target=self.watch, name="container-events", daemon=True)
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        self.ready = False
+        try:
+            self.stream.close()
+        except AttributeError:
+            pass
+
+    def watch(self) -> None:
+        delay = self.RECONNECT_DELAY_SECONDS
+        while not self.stopped.is_set():
+            try:
+                # Open the stream before listing so no event between the two is missed
+                self.stream = self.client.events(decode=True, filters={
+                    "type": "container", "label": self.label_filter})
+                self.relist()
+                self.ready = True
+                delay = self.RECONNECT_DELAY_SECONDS
+
+                for event in self.stream:
+                    self.apply(event)
+            except Exception as err:
+                if not self.stopped.is_set():
+                    print("[Container Events] Event stream lost:", err)
+
+            # The stream ended, so the cache can't be trusted until it is relisted
+            self.ready = False
+            if self.stopped.wait(delay):
+                break
+            delay = min(delay * 2, self.MAX_RECONNECT_DELAY_SECONDS)
+
+    def relist(self) -> None:
+        containers = self.client.containers.list(
+            all=True, sparse=True, filters={"label": self.label_filter})
+
+        states = {}
+        ports = {}
+        for container in containers:
+            states[container.id] = container.status
+            for port in container.attrs.get("Ports") or []:
+                if port.get("PublicPort"):
+                    ports[container.id] = str(port["PublicPort"])
+                    break
+
+        with self.lock:
+            self.states = states
+            self.ports = ports
+            self.tombstones = OrderedDict()
+
+    def apply(self, event: dict) -> None:
+        container_id = event.get("id") or event.get("Actor", {}).get("ID")
+        action = event.get("Action") or event.get("status") or ""
+        if container_id is None:
+            return
+
+        # Actions like "exec_start: sh" carry a suffix
+        action = action.split(":")[0]
+
+        if action == "destroy":
+            self.set(container_id, state="removed")
+        elif action in self.EVENT_STATES:
+            self.set(container_id, state=self.EVENT_STATES[action])
+
+    def get_state(self, container_id: str) -> "str|None":
+        with self.lock:
+            return self.states.get(container_id)
+
+    def get_port(self, container_id: str) -> "str|None":
+        with self.lock:
+            return self.ports.get(container_id)
+
+    def set(self, container_id: str, state: "str|None" = None, port: "str|None" = None) -> None:
+        with self.lock:
+            if state == "removed":
+                # Keep a tombstone so lookups for removed containers don't fall back to the API
+                self.states[container_id] = state
+                self.ports.pop(container_id, None)
+                self.tombstones[container_id] = time.time()
+                self.tombstones.move_to_end(container_id)
+                self.prune_tombstones()
+                return
+
+            if state is not None:
+                self.states[container_id] = state
+            if port is not None:
+                self.ports[container_id] = port
+
+    def prune_tombstones(self) -> None:
+        """Forget the oldest removed containers. Must be called with the lock held."""
+        cutoff = time.time() - self.TOMBSTONE_SECONDS
+        while len(self.tombstones) > 0:
+            container_id, removed = next(iter(self.tombstones.items()))
+            if removed >= cutoff and len(self.tombstones) <= self.MAX_TOMBSTONES:
+                break
+            del self.tombstones[container_id]
+            if self.states.get(container_id) == "removed":
+                del self.states[container_id]
+
+    def snapshot(self) -> "dict[str, str]":
+        """States of all containers that still exist"""
+        with self.lock:
+            return {container_id: state for container_id, state in self.states.items() if state != "removed"}
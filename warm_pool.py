@@ -0,0 +1,232 @@
+import time
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from CTFd.models import db
+from .models import ContainerChallengeModel, ContainerInfoModel, ContainerPoolModel
+from .background import BackgroundContainers
+
+
+class WarmPool(BackgroundContainers):
+    """
+    Keeps idle, already running containers for challenges that have a warm pool size configured.
+
+    A team requesting a container claims one of these instead of waiting for a cold start, and the pool is refilled in
+    the background. The configured size is an upper bound: the pool only grows as large as recent demand for the
+    challenge, so it shrinks again when teams stop requesting it.
+
+    Team containers of challenges with the "recreate" reset mode get a standby: a stopped container created ahead of
+    time on the same port, which a reset only has to start.
+    """
+
+    JOB_ID = "container_warm_pool"
+    LOG_NAME = "Container Warm Pool"
+
+    REFILL_INTERVAL_SECONDS = 30
+    # Containers created within this window count as current demand
+    DEMAND_WINDOW_SECONDS = 600
+    # Warm containers kept for a challenge with a pool even when nobody is requesting it
+    MIN_IDLE = 1
+    # Standby containers created in one pass
+    STANDBY_BATCH_SIZE = 100
+
+    def start(self) -> None:
+        self.scheduler.add_job(
+            func=self.refill,
+            trigger="interval",
+            seconds=self.REFILL_INTERVAL_SECONDS,
+            id=self.JOB_ID,
+            replace_existing=True,
+            coalesce=True,
+            next_run_time=datetime.datetime.now(datetime.timezone.utc),
+        )
+
+    def claim(self, challenge: ContainerChallengeModel) -> "tuple[str, str, int]|None":
+        """
+        Atomically take a warm container for the challenge out of the pool.
+
+        The claim is left uncommitted. The caller commits it together with the row that gives the container to the
+        team, so the orphan reconciler never sees the container without a row, and rolls it back on failure.
+
+        :return: (host, container_id, port) of the claimed container, or None if the pool is empty
+        """
+        from .container_manager import ContainerException
+
+        if not challenge.warm_pool_size:
+            return None
+
+        # Plain values, since a rollback below expires the ORM objects
+        candidates = [(row.host, row.container_id, row.port) for row in ContainerPoolModel.query.filter_by(
+            challenge_id=challenge.id, image=challenge.image, command=challenge.command
+        ).order_by(ContainerPoolModel.timestamp).all()]
+        db.session.commit()
+
+        claimed = None
+        for host, container_id, port in candidates:
+            try:
+                running = self.container_manager.is_container_running(
+                    container_id, host)
+            except ContainerException:
+                break
+
+            if not running:
+                # The container died while it was waiting in the pool
+                deleted = ContainerPoolModel.query.filter_by(
+                    container_id=container_id).delete(synchronize_session=False)
+                db.session.commit()
+                if deleted == 1:
+                    self.container_manager.release_ports([container_id])
+                continue
+
+            # Deleting the row is the claim; another worker may have taken it first
+            deleted = ContainerPoolModel.query.filter_by(
+                container_id=container_id).delete(synchronize_session=False)
+            if deleted != 1:
+                db.session.rollback()
+                continue
+
+            claimed = (host, container_id, port)
+            break
+
+        self.trigger()
+        return claimed
+
+    def target_size(self, challenge: ContainerChallengeModel) -> int:
+        if not challenge.warm_pool_size or challenge.warm_pool_size <= 0:
+            return 0
+
+        recent = ContainerInfoModel.query.filter(
+            ContainerInfoModel.challenge_id == challenge.id,
+            ContainerInfoModel.timestamp >= int(
+                time.time() - self.DEMAND_WINDOW_SECONDS),
+        ).count()
+
+        return min(challenge.warm_pool_size, max(self.MIN_IDLE, recent))
+
+    def refill(self) -> None:
+        if not self.container_manager.is_leader():
+            return
+
+        try:
+            with self.app.app_context():
+                self.reconcile()
+                self.prepare_standbys()
+        except Exception as err:
+            print("[Container Warm Pool] Refill failed:", err)
+
+    def reconcile(self) -> None:
+        pooled: "dict[int, list[ContainerPoolModel]]" = {}
+        for row in ContainerPoolModel.query.order_by(ContainerPoolModel.timestamp).all():
+            pooled.setdefault(row.challenge_id, []).append(row)
+
+        challenges: "list[ContainerChallengeModel]" = ContainerChallengeModel.query.filter(
+            (ContainerChallengeModel.warm_pool_size > 0) |
+            ContainerChallengeModel.id.in_(list(pooled.keys()))
+        ).all()
+
+        to_kill: "list[tuple[str, str]]" = []
+        # Plain values rather than ORM objects, since these are used from worker threads
+        to_start: "list[tuple]" = []
+
+        for challenge in challenges:
+            rows = pooled.get(challenge.id, [])
+
+            # Containers started from an outdated image or command are replaced
+            fresh = [row for row in rows if row.image ==
+                     challenge.image and row.command == challenge.command]
+            to_kill.extend((row.container_id, row.host)
+                           for row in rows if row not in fresh)
+
+            target = self.target_size(challenge)
+            if len(fresh) > target:
+                to_kill.extend((row.container_id, row.host)
+                               for row in fresh[target:])
+            else:
+                spec = (challenge.id, challenge.image, challenge.port,
+                        challenge.command, challenge.volumes)
+                to_start.extend([spec] * (target - len(fresh)))
+
+        if len(to_kill) > 0:
+            self.drain(to_kill)
+
+        if len(to_start) > 0:
+            started = self.start_containers(to_start)
+
+            now = int(time.time())
+            for (challenge_id, image, _, command, _), result in zip(to_start, started):
+                if result is None:
+                    continue
+                host, container_id, port = result
+                db.session.add(ContainerPoolModel(
+                    container_id=container_id,
+                    challenge_id=challenge_id,
+                    image=image,
+                    command=command,
+                    host=host,
+                    port=port,
+                    timestamp=now,
+                ))
+            db.session.commit()
+
+    def drain(self, containers: "list[tuple[str, str]]") -> None:
+        """Kill the given (container_id, host) pairs and remove them from the pool"""
+        container_ids = [container_id for container_id, _ in containers]
+
+        # Remove the rows first so nobody claims a container that is being killed
+        ContainerPoolModel.query.filter(
+            ContainerPoolModel.container_id.in_(container_ids)
+        ).delete(synchronize_session=False)
+        db.session.commit()
+
+        self.kill_containers(containers)
+
+        self.container_manager.release_ports(container_ids)
+
+    def prepare_standbys(self) -> None:
+        """Create the missing standby containers of team containers whose challenge resets by recreating them"""
+        rows = db.session.query(
+            ContainerInfoModel.container_id, ContainerInfoModel.host, ContainerInfoModel.port,
+            ContainerInfoModel.team_id, ContainerChallengeModel.id, ContainerChallengeModel.image,
+            ContainerChallengeModel.port, ContainerChallengeModel.command, ContainerChallengeModel.volumes,
+        ).join(
+            ContainerChallengeModel, ContainerChallengeModel.id == ContainerInfoModel.challenge_id
+        ).filter(
+            ContainerChallengeModel.reset_mode == "recreate",
+            ContainerInfoModel.standby_id == None,
+            ContainerInfoModel.port != None,
+            ~ContainerInfoModel.container_id.startswith(
+                ContainerInfoModel.PENDING_PREFIX),
+        ).limit(self.STANDBY_BATCH_SIZE).all()
+        db.session.commit()
+        if len(rows) == 0:
+            return
+
+        def prepare(row) -> "str|None":
+            _, host, host_port, team_id, challenge_id, image, port, command, volumes = row
+            try:
+                return self.container_manager.prepare_standby(
+                    host, host_port, image, port, command, volumes, challenge_id=challenge_id, team_id=team_id)
+            except Exception as err:
+                print("[Container Warm Pool] Could not create standby container:", err)
+                return None
+
+        with ThreadPoolExecutor(max_workers=min(self.MAX_WORKERS, len(rows))) as executor:
+            standbys = list(executor.map(prepare, rows))
+
+        unused = []
+        for row, standby_id in zip(rows, standbys):
+            if standby_id is None:
+                continue
+            # The container may have been reset, killed or given a standby by another pass meanwhile
+            updated = ContainerInfoModel.query.filter_by(
+                container_id=row[0], standby_id=None
+            ).update({"standby_id": standby_id}, synchronize_session=False)
+            if updated == 0:
+                unused.append((standby_id, row[1]))
+        db.session.commit()
+
+        for standby_id, host in unused:
+            try:
+                self.container_manager.remove_container(standby_id, host)
+            except Exception as err:
+                print("[Container Warm Pool] Could not remove standby container:", err)